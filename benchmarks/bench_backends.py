@@ -0,0 +1,53 @@
+"""Compare the python-docx and direct-XML render backends per invoice.
+
+    python benchmarks/bench_backends.py [-n 500]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billcore
+
+
+def sample_data():
+    fields = {'CLIENTNAME': 'Red Soil Homestay', 'CLIENTADDRESS': 'Bolpur\nWest Bengal',
+              'BILLNUMBER': 'INV-0001', 'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026'}
+    items = [('Room booking', '3', '2500'), ('Breakfast', '6', '180'), ('Airport pickup', '1', '900')]
+    return billcore.build_bill_data(fields, items)
+
+
+def bench(backend, data, n):
+    template = billcore.load_template(backend=backend)
+    template.save(data, io.BytesIO())
+
+    start = time.perf_counter()
+    for _ in range(n):
+        template.save(data, io.BytesIO())
+    per_invoice = (time.perf_counter() - start) / n
+
+    tracemalloc.start()
+    template.save(data, io.BytesIO())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_invoice, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=500, help='invoices per backend')
+    args = parser.parse_args()
+
+    data = sample_data()
+    print(f"{'backend':<8} {'ms/invoice':>11} {'invoices/s':>11} {'peak KiB':>9}")
+    for backend in sorted(billcore.RENDER_BACKENDS):
+        per_invoice, peak = bench(backend, data, args.n)
+        print(f"{backend:<8} {per_invoice * 1000:>11.3f} {1 / per_invoice:>11.0f} {peak / 1024:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
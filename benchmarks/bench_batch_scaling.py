@@ -0,0 +1,59 @@
+"""Batch throughput from 1 to N worker processes.
+
+    python benchmarks/bench_batch_scaling.py [-n 10000] [--max-jobs 8] [--backend docx]
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billbatch
+import billcore
+
+
+def write_input(path, n):
+    columns = billcore.HEADER_FIELDS + [f'{c}{i}' for i in range(1, 4)
+                                        for c in ('description', 'quantity', 'price')]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for i in range(1, n + 1):
+            writer.writerow([f'Client {i}', f'{i} Station Road\nBolpur', f'INV-{i:06d}', '01/10/2026',
+                             '31/10/2026', 'Room booking', '3', '2500', 'Breakfast', '6', '180',
+                             'Airport pickup', '1', '900'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=10000, help='invoices per run')
+    parser.add_argument('--max-jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--backend', choices=sorted(billcore.RENDER_BACKENDS), default='docx')
+    parser.add_argument('--chunk-size', type=int, default=billbatch.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        input_path = os.path.join(tmp, 'bills.csv')
+        write_input(input_path, args.n)
+
+        print(f"{args.n} invoices, {args.backend} backend")
+        print(f"{'jobs':>4} {'seconds':>8} {'invoices/s':>11} {'speed-up':>9} {'efficiency':>11}")
+        base = None
+        for jobs in range(1, args.max_jobs + 1):
+            start = time.perf_counter()
+            done, failed, _ = billbatch.run_batch(input_path, os.path.join(tmp, f'out{jobs}'),
+                                               backend=args.backend, jobs=jobs,
+                                               chunk_size=args.chunk_size)
+            elapsed = time.perf_counter() - start
+            if failed:
+                sys.exit(f"{failed} invoices failed with {jobs} jobs")
+            base = base or elapsed
+            print(f"{jobs:>4} {elapsed:>8.2f} {done / elapsed:>11.0f} {base / elapsed:>8.2f}x "
+                  f"{base / elapsed / jobs:>10.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Batch output bundled into one ZIP or merged PDF: peak memory as the input grows.
+
+    python benchmarks/bench_bundle.py [--bills 200,2000] [--max-growth-mb 20]
+
+Each run is a fresh ``billmakerv1-5.py batch -j1`` over generated records
+with native PDFs. Peak RSS of the largest run may be at most --max-growth-mb
+above the smallest: bundles are written as bills arrive, so memory must not
+follow the bill count.
+"""
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'billmakerv1-5.py')
+OUTPUTS = {
+    'zip': lambda tmp: ['--zip', os.path.join(tmp, 'bills.zip'), '--pdf', '--pdf-engine', 'native'],
+    'merged pdf': lambda tmp: ['--merge-pdf', os.path.join(tmp, 'bills.pdf')],
+}
+
+
+def write_input(path, bills):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['CLIENTNAME', 'CLIENTADDRESS', 'BILLNUMBER', 'BILLDATE', 'DUEDATE',
+                         'description1', 'quantity1', 'price1', 'description2', 'quantity2', 'price2'])
+        for i in range(bills):
+            writer.writerow([f'Client {i}', f'{i} Station Road\nBolpur', f'B-{i:07d}', '01/10/2026', '31/10/2026',
+                             'Room booking', 1 + i % 4, '2500', 'Breakfast', 2, '180.50'])
+
+
+def run_once(input_path, extra):
+    # A child per run, so ru_maxrss of the children is the peak of this run alone
+    code = ('import resource, subprocess, sys, time\n'
+            'start = time.perf_counter()\n'
+            f'subprocess.run({[sys.executable, APP, "batch", input_path, "-j1"] + extra!r}, check=True,\n'
+            '               stdout=subprocess.DEVNULL)\n'
+            'print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)\n')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    elapsed, kilobytes = out.split()
+    return float(elapsed), int(kilobytes) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bills', default='200,2000')
+    parser.add_argument('--max-growth-mb', type=float, default=20)
+    args = parser.parse_args()
+    counts = [int(x) for x in args.bills.split(',')]
+
+    failed = False
+    print(f"{'output':<11} {'bills':>7} {'seconds':>8} {'bills/s':>8} {'peak MB':>8} {'size MB':>8}")
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        for name, extra in OUTPUTS.items():
+            peaks = []
+            for bills in counts:
+                input_path = os.path.join(tmp, f'{bills}.csv')
+                if not os.path.exists(input_path):
+                    write_input(input_path, bills)
+                args_for_run = extra(tmp)
+                elapsed, peak = run_once(input_path, args_for_run)
+                size = os.path.getsize(args_for_run[1]) / 2 ** 20
+                peaks.append(peak)
+                print(f"{name:<11} {bills:>7} {elapsed:>8.2f} {bills / elapsed:>8.0f} {peak:>8.1f} {size:>8.1f}")
+            if peaks[-1] - peaks[0] > args.max_growth_mb:
+                print(f"{name}: peak memory grew {peaks[-1] - peaks[0]:.1f} MB with the bill count")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Sizing the PDF converter pool: throughput and queue depth from 1 to N converters.
+
+    python benchmarks/bench_converters.py [-n 40] [--max-workers 4] [--timeout 120]
+
+Queues -n copies of a rendered bill on a fresh ConverterPool per converter
+count and reports what its stats() say at the end, plus the spread of job
+latencies (queueing included). Once adding converters stops raising
+bills/s, or the queue stays short, the pool is big enough. Needs soffice.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billcore
+import billpdf
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=40, help='conversions per pool size')
+    parser.add_argument('--max-workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--timeout', type=float, default=billpdf.CONVERT_TIMEOUT)
+    args = parser.parse_args()
+    if not billpdf.find_soffice():
+        sys.exit("soffice not found")
+
+    data = billcore.build_bill_data({'CLIENTNAME': 'Client', 'BILLNUMBER': 'INV-000001'},
+                                    [('Room booking', '3', '2500'), ('Breakfast', '6', '180')])
+    docx = billcore.render_bytes(data, billcore.load_template())
+
+    print(f"{'workers':>7} {'seconds':>8} {'bills/s':>8} {'p50 s':>7} {'p99 s':>7} {'queue peak':>10} "
+          f"{'retries':>7} {'timeouts':>8} {'failed':>6}")
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        for workers in range(1, args.max_workers + 1):
+            dead_letter = os.path.join(tmp, 'dead')
+            with billpdf.ConverterPool(workers, timeout=args.timeout, dead_letter_dir=dead_letter) as pool:
+                # Converters start with their first job; start them all before timing
+                for future in [pool.submit_docx(docx, os.path.join(tmp, f'warm{i}.pdf')) for i in range(workers)]:
+                    future.exception()
+                latencies = []
+                start = time.perf_counter()
+                futures = []
+                for i in range(args.n):
+                    future = pool.submit_docx(docx, os.path.join(tmp, f'{i}.pdf'))
+                    future.add_done_callback(lambda _, queued=time.perf_counter():
+                                             latencies.append(time.perf_counter() - queued))
+                    futures.append(future)
+                for future in futures:
+                    future.exception()
+                elapsed = time.perf_counter() - start
+                stats = pool.stats()
+            latencies.sort()
+            print(f"{workers:>7} {elapsed:>8.2f} {args.n / elapsed:>8.1f} {statistics.median(latencies):>7.2f} "
+                  f"{latencies[int(len(latencies) * 0.99) - 1]:>7.2f} {stats['queued_peak']:>10} "
+                  f"{stats['retries']:>7} {stats['timeouts']:>8} {stats['failed']:>6}")
+
+
+if __name__ == '__main__':
+    main()
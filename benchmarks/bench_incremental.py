@@ -0,0 +1,60 @@
+"""Re-saving an open bill after a one-field edit: full render vs incremental update.
+
+    python benchmarks/bench_incremental.py [-n 200] [--items 3,100,1000]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billcore
+
+FIELDS = {'CLIENTNAME': 'Red Soil Homestay', 'CLIENTADDRESS': 'Bolpur\nWest Bengal',
+          'BILLNUMBER': 'INV-0001', 'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026'}
+
+
+def edits(items, n):
+    """n successive bills, each differing from the last in the due date or one line item."""
+    rows = [(f'Service {i + 1}', '1', f'{100 + i}') for i in range(items)]
+    for i in range(n):
+        fields = dict(FIELDS)
+        if i % 2:
+            fields['DUEDATE'] = f'{1 + i % 28:02d}/11/2026'
+        else:
+            row = i % items
+            rows[row] = (rows[row][0], str(1 + i % 9), rows[row][2])
+        yield billcore.build_bill_data(fields, rows)
+
+
+def median_ms(fn, bills):
+    samples = []
+    for data in bills:
+        start = time.perf_counter()
+        fn(data)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200, help='edits per case')
+    parser.add_argument('--items', default='3,100,1000')
+    args = parser.parse_args()
+
+    template = billcore.load_template()
+    print(f"{'items':>6} {'full ms':>9} {'incremental ms':>15} {'speed-up':>9}")
+    for items in [int(x) for x in args.items.split(',')]:
+        full = median_ms(lambda data: template.save(data, io.BytesIO()), list(edits(items, args.n)))
+        session = billcore.BillSession()
+        bills = list(edits(items, args.n + 1))
+        session.save(bills[0], io.BytesIO())
+        incremental = median_ms(lambda data: session.save(data, io.BytesIO()), bills[1:])
+        print(f"{items:>6} {full:>9.3f} {incremental:>15.3f} {full / incremental:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
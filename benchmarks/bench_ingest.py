@@ -0,0 +1,148 @@
+"""Reading a large line-item export: rows/s and peak memory as the file grows.
+
+    python benchmarks/bench_ingest.py [--rows 500000,5000000] [--formats csv,jsonl,xlsx] [--max-growth-mb 20]
+
+Writes one row per line item (BILLNUMBER, client columns, description,
+quantity, price; --items-per-bill rows per bill) and reads it back through
+billingest.read_records in a fresh process per file, grouping the rows into
+bills. Peak RSS reading the largest file may be at most --max-growth-mb
+above the smallest. XLSX files stop at Excel's limit of rows per sheet.
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNS = ['BILLNUMBER', 'CLIENTNAME', 'CLIENTADDRESS', 'BILLDATE', 'DUEDATE', 'description', 'quantity', 'price']
+# Excel's rows per sheet, less the header
+XLSX_MAX_ROWS = 1048575
+ITEMS = [('Room booking', '2', '2500'), ('Breakfast', '4', '180.50'), ('Airport pickup', '1', '900'),
+         ('Laundry', '3', '75.25'), ('Late checkout', '1', '500')]
+
+CHILD = r'''
+import resource, sys, time
+sys.path.insert(0, ROOT)
+import billingest
+start = time.perf_counter()
+bills = items = 0
+for record in billingest.read_records(PATH):
+    bills += 1
+    items += len(record['items'])
+print(time.perf_counter() - start, bills, items, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def rows(count, per_bill):
+    for i in range(count):
+        bill = i // per_bill
+        description, quantity, price = ITEMS[i % per_bill % len(ITEMS)]
+        yield [f'RS-{bill:08d}', f'Guest {bill}', f'Room {bill % 40}, Red Soil Homestay', '01/10/2026',
+               '31/10/2026', description, quantity, price]
+
+
+def write_csv(path, count, per_bill):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows(count, per_bill))
+
+
+def write_jsonl(path, count, per_bill):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows(count, per_bill):
+            f.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
+
+
+def write_xlsx(path, count, per_bill):
+    # The smallest workbook Excel opens: inline strings, numbers as numbers, streamed into the zip
+    def cell(value):
+        try:
+            float(value)
+            return f'<c><v>{value}</v></c>'
+        except ValueError:
+            return f'<c t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    rel_ns = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml',
+                   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-'
+                   'officedocument.spreadsheetml.sheet.main+xml"/>'
+                   '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-'
+                   'officedocument.spreadsheetml.worksheet+xml"/></Types>')
+        z.writestr('_rels/.rels',
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                   'relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        z.writestr('xl/workbook.xml', f'<workbook {ns} {rel_ns}><sheets>'
+                                      f'<sheet name="Bills" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        z.writestr('xl/_rels/workbook.xml.rels',
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                   'relationships/worksheet" Target="worksheets/sheet1.xml"/></Relationships>')
+        with z.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(f'<worksheet {ns}><sheetData>'.encode('utf-8'))
+            sheet.write(('<row>' + ''.join(map(cell, COLUMNS)) + '</row>').encode('utf-8'))
+            for row in rows(count, per_bill):
+                sheet.write(('<row>' + ''.join(map(cell, row)) + '</row>').encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'xlsx': write_xlsx}
+
+
+def read_once(path):
+    code = f'ROOT = {ROOT!r}\nPATH = {path!r}\n' + CHILD
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    elapsed, bills, items, kilobytes = out.split()
+    return float(elapsed), int(bills), int(items), int(kilobytes) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='500000,5000000')
+    parser.add_argument('--formats', default='csv,jsonl,xlsx')
+    parser.add_argument('--items-per-bill', type=int, default=5)
+    parser.add_argument('--max-growth-mb', type=float, default=20)
+    args = parser.parse_args()
+    counts = [int(x) for x in args.rows.split(',')]
+
+    failed = False
+    print(f"{'format':<6} {'rows':>9} {'file MB':>8} {'write s':>8} {'read s':>7} {'rows/s':>9} {'bills':>8} "
+          f"{'peak MB':>8}")
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        for fmt in args.formats.split(','):
+            peaks = []
+            for count in counts:
+                if fmt == 'xlsx':
+                    count = min(count, XLSX_MAX_ROWS)
+                path = os.path.join(tmp, f'items.{fmt}')
+                start = time.perf_counter()
+                WRITERS[fmt](path, count, args.items_per_bill)
+                written = time.perf_counter() - start
+                elapsed, bills, items, peak = read_once(path)
+                if items != count:
+                    sys.exit(f"{fmt}: read {items} line items of {count}")
+                peaks.append(peak)
+                print(f"{fmt:<6} {count:>9} {os.path.getsize(path) / 2 ** 20:>8.1f} {written:>8.1f} "
+                      f"{elapsed:>7.1f} {count / elapsed:>9.0f} {bills:>8} {peak:>8.1f}")
+                os.remove(path)
+            if peaks[-1] - peaks[0] > args.max_growth_mb:
+                print(f"{fmt}: peak memory grew {peaks[-1] - peaks[0]:.1f} MB with the row count")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Bill data per invoice: the slotted Invoice against a dict of formatted strings.
+
+    python benchmarks/bench_invoice.py [-n 20000] [--items 3,20]
+
+For each item count, builds -n invoices both ways and reports build time,
+memory held per invoice and allocations per invoice (tracemalloc), and the
+time for a renderer to look up every keyword once, as it does with the
+keywords compiled into its template.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billcore
+import billmoney
+
+
+def dict_bill_data(fields, items):
+    # How build_bill_data worked before Invoice: every keyword formatted up front into a dict
+    data = {key: fields.get(key, "") for key in billcore.HEADER_FIELDS}
+    items = list(items)
+    items += [("", "0", "0")] * (billcore.ITEM_ROWS - len(items))
+    totals = billmoney.compute([qty for _, qty, _ in items], [price for _, _, price in items],
+                               fields.get('CURRENCY'), fields.get('DISCOUNT'), fields.get('TAX'))
+    rows = list(zip([desc for desc, _, _ in items], totals.format_quantities(), totals.format_lines()))
+    if totals.adjustments:
+        rows.append(('Subtotal', '', totals.format(totals.subtotal)))
+        rows += [(label, '', totals.format(amount)) for label, amount in totals.adjustments]
+    for i, (desc, qty, amount) in enumerate(rows):
+        data[f"description{i+1}"] = desc
+        data[f"quantity{i+1}"] = qty
+        data[f"amount{i+1}"] = amount
+    data["TOTAL"] = totals.format(totals.total)
+    return data
+
+
+BUILDERS = {'dict': dict_bill_data, 'Invoice': billcore.build_bill_data}
+
+
+def inputs(n, items):
+    for i in range(n):
+        fields = {'CLIENTNAME': f'Guest {i}', 'CLIENTADDRESS': 'Bolpur', 'BILLNUMBER': f'RS-{i:06d}',
+                  'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026', 'TAX': 'CGST 6%; SGST 6%'}
+        yield fields, [(f'Night {j + 1}', str(1 + j % 3), f'{2500 + j}.50') for j in range(items)]
+
+
+def measure(build, records):
+    gc.collect()
+    start = time.perf_counter()
+    bills = [build(fields, items) for fields, items in records]
+    built = time.perf_counter() - start
+
+    keys = list(bills[0])
+    start = time.perf_counter()
+    for bill in bills:
+        for key in keys:
+            bill[key]
+    looked_up = time.perf_counter() - start
+    del bills
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    bills = [build(fields, items) for fields, items in records]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return built, looked_up, held / len(bills), blocks / len(bills)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000, help='invoices per run')
+    parser.add_argument('--items', default='3,20', help='line items per invoice')
+    args = parser.parse_args()
+
+    print(f"{'items':>5} {'model':<8} {'build us':>9} {'lookup us':>10} {'both us':>8} {'held bytes':>11} {'blocks':>7}")
+    for items in [int(x) for x in args.items.split(',')]:
+        records = list(inputs(args.n, items))
+        for name, build in BUILDERS.items():
+            built, looked_up, held, blocks = measure(build, records)
+            print(f"{items:>5} {name:<8} {built / args.n * 1e6:>9.1f} {looked_up / args.n * 1e6:>10.1f} "
+                  f"{(built + looked_up) / args.n * 1e6:>8.1f} {held:>11.0f} {blocks:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Render time against line-item count for each backend; time per row should stay flat.
+
+    python benchmarks/bench_line_items.py [--max-items 10000]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billcore
+
+
+def bill(count):
+    fields = {'CLIENTNAME': 'Red Soil Homestay', 'CLIENTADDRESS': 'Bolpur', 'BILLNUMBER': 'INV-0001',
+              'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026'}
+    items = [(f'Room night {i}', '1', '2500') for i in range(count)]
+    return billcore.build_bill_data(fields, items)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-items', type=int, default=10000)
+    args = parser.parse_args()
+
+    renderers = {backend: billcore.load_template(backend=backend) for backend in billcore.RENDER_BACKENDS}
+    renderers['native-pdf'] = billcore.load_pdf_renderer()
+
+    counts = [c for c in (10, 100, 1000, 10000, 100000) if c <= args.max_items]
+    print(f"{'renderer':<11} {'items':>7} {'total ms':>10} {'us/item':>9}")
+    for name, renderer in sorted(renderers.items()):
+        for count in counts:
+            data = bill(count)
+            start = time.perf_counter()
+            renderer.save(data, io.BytesIO())
+            elapsed = time.perf_counter() - start
+            print(f"{name:<11} {count:>7} {elapsed * 1000:>10.1f} {elapsed / count * 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
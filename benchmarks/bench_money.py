@@ -0,0 +1,54 @@
+"""Bill totals over long item columns: whole-number fast path vs decimal prices.
+
+    python benchmarks/bench_money.py [--items 1000,100000] [-n 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billmoney
+
+CASES = {
+    'whole': lambda rng: (str(rng.randint(1, 20)), str(rng.randint(1, 99999))),
+    'decimal prices': lambda rng: (str(rng.randint(1, 20)), f'{rng.randint(1, 99999)}.{rng.randint(0, 99):02d}'),
+    'decimal both': lambda rng: (f'{rng.randint(1, 20)}.5', f'{rng.randint(1, 99999)}.{rng.randint(0, 99):02d}'),
+}
+
+
+def reference_total(quantities, prices):
+    # One Decimal at a time, for checking the batched result
+    return sum(int((Decimal(q) * Decimal(p) * 100).quantize(1, 'ROUND_HALF_UP'))
+               for q, p in zip(quantities, prices))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', default='1000,100000')
+    parser.add_argument('-n', type=int, default=20, help='runs per case')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    print(f"{'items':>7} {'case':<15} {'p50 ms':>8} {'ms / 1k items':>14}")
+    for items in [int(x) for x in args.items.split(',')]:
+        for name, make in CASES.items():
+            quantities, prices = zip(*(make(rng) for _ in range(items)))
+            quantities, prices = list(quantities), list(prices)
+            samples = []
+            for _ in range(args.n):
+                start = time.perf_counter()
+                totals = billmoney.compute(quantities, prices, 'INR', '5%', 'CGST 9%; SGST 9%')
+                samples.append(time.perf_counter() - start)
+            if totals.subtotal != reference_total(quantities, prices):
+                sys.exit(f"{name}: subtotal differs from the one-by-one Decimal sum")
+            p50 = statistics.median(samples) * 1000
+            print(f"{items:>7} {name:<15} {p50:>8.2f} {p50 / items * 1000:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
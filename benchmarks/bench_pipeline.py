@@ -0,0 +1,190 @@
+"""Time each stage of the bill pipeline on synthetic templates.
+
+Stages are timed separately: template load (parse and index), placeholder
+substitution, writing the .docx, and PDF output (the native renderer, plus
+a LibreOffice conversion when soffice is installed). Every case runs in a
+fresh process so its peak RSS is its own. Results are saved as JSON so runs
+from different releases can be compared.
+
+    python benchmarks/bench_pipeline.py [-n 50] [--sizes 0,200,2000] [--items 3,100,1000]
+    python benchmarks/bench_pipeline.py --label v1.6 --compare benchmarks/results/v1.5.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import billcore
+import billpdf
+import billpdfnative
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+FILLER = ("Payment is due within thirty days of the bill date. Please quote the bill number "
+          "with every payment so that it can be matched to this account.")
+
+
+def make_template(path, paragraphs):
+    """A template with the v1.5 keywords, a line-item table and ``paragraphs`` of filler text."""
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph('Bill to: CLIENTNAME')
+    doc.add_paragraph('CLIENTADDRESS')
+    doc.add_paragraph('Bill No: BILLNUMBER    Date: BILLDATE    Due: DUEDATE')
+    table = doc.add_table(rows=1 + billcore.ITEM_ROWS, cols=3)
+    for cell, title in zip(table.rows[0].cells, ('Description', 'Quantity', 'Amount')):
+        cell.text = title
+    for i, row in enumerate(table.rows[1:], 1):
+        for cell, field in zip(row.cells, billcore.ITEM_FIELDS):
+            cell.text = f'{field}{i}'
+    doc.add_paragraph('Total: TOTAL')
+    for i in range(paragraphs):
+        doc.add_paragraph(f'{i + 1}. {FILLER}')
+    doc.save(path)
+
+
+def sample_data(items):
+    fields = {'CLIENTNAME': 'Red Soil Homestay', 'CLIENTADDRESS': 'Bolpur\nWest Bengal',
+              'BILLNUMBER': 'INV-0001', 'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026'}
+    rows = [(f'Service {i + 1}', str(1 + i % 5), f'{100 + i % 900}') for i in range(items)]
+    return billcore.build_bill_data(fields, rows)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where it can't be read."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {'p50_ms': percentile(samples, 50) * 1000, 'p99_ms': percentile(samples, 99) * 1000,
+            'runs': n}
+
+
+def run_case(template_path, backend, items, n, convert_n):
+    """Runs in its own process; returns {stage: timings} and the process's peak RSS."""
+    factory = billcore.RENDER_BACKENDS[backend]
+    keys, item_fields = billcore.TEMPLATE_KEYS, billcore.ITEM_FIELDS
+    data = sample_data(items)
+
+    stages = {'load': timed(lambda: factory(template_path, keys, item_fields), n)}
+    template = factory(template_path, keys, item_fields)
+    stages['substitute'] = timed(lambda: template.render(data), n)
+    rendered = template.render(data)
+    stages['save'] = timed(lambda: template.write(rendered, io.BytesIO()), n)
+
+    renderer = billpdfnative.get_renderer(billcore.resource_path(billcore.TEMPLATE_NAME))
+    stages['pdf_native'] = timed(lambda: renderer.render(data), n)
+
+    if convert_n:
+        with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+            docx_path = os.path.join(tmp, 'bill.docx')
+            with open(docx_path, 'wb') as f:
+                template.write(rendered, f)
+            with billpdf.ConverterPool(workers=1) as pool:
+                # The first conversion pays for starting LibreOffice
+                pool.convert(docx_path, os.path.join(tmp, 'warm.pdf'))
+                stages['convert'] = timed(lambda: pool.convert(docx_path, os.path.join(tmp, 'bill.pdf')),
+                                          convert_n)
+    return stages, peak_rss()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def int_list(text):
+    return [int(x) for x in text.split(',') if x]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=50, help='timed runs per stage')
+    parser.add_argument('--sizes', type=int_list, default=[0, 200, 2000],
+                        help='filler paragraphs per synthetic template')
+    parser.add_argument('--items', type=int_list, default=[3, 100, 1000], help='line items per bill')
+    parser.add_argument('--backends', default=','.join(sorted(billcore.RENDER_BACKENDS)))
+    parser.add_argument('--convert-n', type=int, default=10,
+                        help='timed LibreOffice conversions per case (0 to skip)')
+    parser.add_argument('--label', help='name for the results file (default: git revision)')
+    parser.add_argument('--compare', help='earlier results file to show p50 changes against')
+    args = parser.parse_args()
+
+    convert_n = args.convert_n if billpdf.find_soffice() else 0
+    if args.convert_n and not convert_n:
+        print("soffice not found, skipping the convert stage")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        for size in args.sizes:
+            template_path = os.path.join(tmp, f'template_{size}.docx')
+            make_template(template_path, size)
+            for items in args.items:
+                for backend in args.backends.split(','):
+                    # A fresh process per case keeps peak RSS figures independent
+                    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+                        stages, rss = executor.submit(run_case, template_path, backend, items, args.n,
+                                                      convert_n).result()
+                    results.append({'paragraphs': size, 'items': items, 'backend': backend,
+                                    'stages': stages, 'peak_rss': rss})
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            for case in json.load(f)['cases']:
+                for stage, t in case['stages'].items():
+                    previous[(case['paragraphs'], case['items'], case['backend'], stage)] = t['p50_ms']
+
+    print(f"{'paras':>5} {'items':>5} {'backend':<7} {'stage':<10} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'RSS MiB':>8}" + (f" {'vs prev':>8}" if previous else ''))
+    for case in results:
+        rss = f"{case['peak_rss'] / 2 ** 20:.0f}" if case['peak_rss'] else '-'
+        for stage, t in case['stages'].items():
+            line = (f"{case['paragraphs']:>5} {case['items']:>5} {case['backend']:<7} {stage:<10} "
+                    f"{t['p50_ms']:>9.3f} {t['p99_ms']:>9.3f} {rss:>8}")
+            before = previous.get((case['paragraphs'], case['items'], case['backend'], stage))
+            if before:
+                line += f" {t['p50_ms'] / before - 1:>+8.0%}"
+            print(line)
+
+    label = args.label or git_revision() or time.strftime('%Y%m%d-%H%M%S')
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = os.path.join(RESULTS_DIR, f'{label}.json')
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump({'label': label, 'revision': git_revision(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(), 'platform': platform.platform(),
+                   'runs': args.n, 'cases': results}, f, indent=1)
+    print(f"results saved to {out_path}")
+
+
+if __name__ == '__main__':
+    main()
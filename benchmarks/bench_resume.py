@@ -0,0 +1,111 @@
+"""Resuming a killed batch: what a restart costs against a full run.
+
+    python benchmarks/bench_resume.py [-n 2000] [--kill-at 0.5] [-j 1] [--backend xml]
+
+Runs ``billmakerv1-5.py batch`` over -n generated records once in full,
+then again killed with SIGKILL once its journal lists --kill-at of the
+bills, and resumes that run with --resume. The resumed run should take
+about the remaining share of the full run, and a resume with nothing
+left to do shows what skipping costs per record. Every bill must end up
+on disk once, matching the hash in the journal.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'billmakerv1-5.py')
+sys.path.insert(0, ROOT)
+
+import billjournal
+
+
+def write_input(path, bills):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['CLIENTNAME', 'CLIENTADDRESS', 'BILLNUMBER', 'BILLDATE', 'DUEDATE',
+                         'description1', 'quantity1', 'price1', 'description2', 'quantity2', 'price2'])
+        for i in range(bills):
+            writer.writerow([f'Client {i}', f'{i} Station Road\nBolpur', f'B-{i:07d}', '01/10/2026', '31/10/2026',
+                             'Room booking', 1 + i % 4, '2500', 'Breakfast', 2, '180.50'])
+
+
+def journal_lines(out_dir):
+    try:
+        with open(os.path.join(out_dir, billjournal.JOURNAL_NAME), 'rb') as f:
+            return f.read().count(b'\n')
+    except FileNotFoundError:
+        return 0
+
+
+def run(command, out_dir, kill_after=None):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    if kill_after is not None:
+        while process.poll() is None and journal_lines(out_dir) < kill_after:
+            time.sleep(0.01)
+        process.send_signal(signal.SIGKILL)
+    process.wait()
+    return time.perf_counter() - start
+
+
+def check(out_dir, bills):
+    entries = {}
+    with open(os.path.join(out_dir, billjournal.JOURNAL_NAME), encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            entries[entry['bill']] = entry
+    names = [name for name in os.listdir(out_dir) if not name.startswith('.')]
+    if len(entries) != bills or len(names) != bills:
+        sys.exit(f"{len(entries)} bills in the journal and {len(names)} files, expected {bills}")
+    for entry in entries.values():
+        with open(os.path.join(out_dir, entry['file']), 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() != entry['sha256']:
+                sys.exit(f"{entry['file']} does not match its journal entry")
+    leftovers = [name for name in os.listdir(out_dir) if name.endswith('.part')]
+    if leftovers:
+        sys.exit(f"temporary files left behind: {', '.join(leftovers)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=2000, help='bills in the input')
+    parser.add_argument('--kill-at', type=float, default=0.5, help='share of the bills done when the run is killed')
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('--backend', default='xml')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        input_path = os.path.join(tmp, 'bills.csv')
+        write_input(input_path, args.n)
+
+        def command(out_dir, *extra):
+            return [sys.executable, APP, 'batch', input_path, '-o', out_dir, '-j', str(args.jobs),
+                    '--backend', args.backend] + list(extra)
+
+        full_dir, killed_dir = os.path.join(tmp, 'full'), os.path.join(tmp, 'killed')
+        full = run(command(full_dir), full_dir)
+        killed = run(command(killed_dir), killed_dir, kill_after=int(args.n * args.kill_at))
+        finished = journal_lines(killed_dir)
+        resumed = run(command(killed_dir, '--resume'), killed_dir)
+        check(killed_dir, args.n)
+        idle = run(command(killed_dir, '--resume'), killed_dir)
+
+        print(f"{'run':<22} {'seconds':>8} {'bills':>7}")
+        print(f"{'full':<22} {full:>8.2f} {args.n:>7}")
+        print(f"{'killed':<22} {killed:>8.2f} {finished:>7}")
+        print(f"{'resumed':<22} {resumed:>8.2f} {args.n - finished:>7}")
+        print(f"{'resumed, all done':<22} {idle:>8.2f} {0:>7}")
+        print(f"resumed run took {resumed / full:.0%} of a full run to render {1 - finished / args.n:.0%} of the bills; "
+              f"nothing left to do took {idle:.2f}s for {args.n} records")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""The HTTP rendering service under load from local clients.
+
+    python benchmarks/bench_service.py [--clients 8] [--requests 25] [--batch 500] [--workers N]
+
+Starts ``billmakerv1-5.py serve`` on a free port, then has --clients
+threads post single invoices (retrying after 503s) and one client stream
+a batch. Prints latency percentiles, throughput and how often the queue
+turned requests away.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def record(i):
+    return {'CLIENTNAME': f'Red Soil Homestay {i}', 'CLIENTADDRESS': 'Bolpur\nWest Bengal',
+            'BILLNUMBER': f'RS-{i:05d}', 'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026', 'TAX': 'GST 12%',
+            'items': [{'description': 'Room booking', 'quantity': 1 + i % 4, 'price': '2500'},
+                      {'description': 'Breakfast', 'quantity': 2, 'price': '180.50'}]}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+def start_server(args):
+    cmd = [sys.executable, os.path.join(ROOT, 'billmakerv1-5.py'), 'serve', '--port', '0',
+           '--workers', str(args.workers), '--queue', str(args.queue)]
+    server = subprocess.Popen(cmd, cwd=ROOT, stderr=subprocess.PIPE, text=True)
+    line = server.stderr.readline()
+    if 'http://' not in line:
+        server.kill()
+        sys.exit(f"service did not start: {line.strip()}")
+    return server, int(line.rsplit(':', 1)[1])
+
+
+def single_client(port, n, start_index, path, latencies, counts):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for i in range(start_index, start_index + n):
+        body = json.dumps(record(i)).encode('utf-8')
+        begin = time.perf_counter()
+        while True:
+            conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            content = resp.read()
+            if resp.status != 503:
+                break
+            counts['rejected'] += 1
+            time.sleep(float(resp.getheader('Retry-After') or 1) / 10)
+        latencies.append(time.perf_counter() - begin)
+        counts['ok' if resp.status == 200 and content else f'http {resp.status}'] += 1
+    conn.close()
+
+
+def run_singles(port, args, path):
+    latencies = []
+    counts = {'ok': 0, 'rejected': 0}
+    threads = [threading.Thread(target=single_client,
+                                args=(port, args.requests, c * args.requests, path, latencies, counts))
+               for c in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"POST {path}: {len(latencies)} bills from {args.clients} clients in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.1f}/s), p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.0f} ms, {counts['rejected']} turned away "
+          f"({', '.join(f'{k}: {v}' for k, v in counts.items() if k != 'rejected')})")
+
+
+def run_batch(port, n, path):
+    body = b''.join(json.dumps(record(i)).encode('utf-8') + b'\n' for i in range(n))
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    start = time.perf_counter()
+    conn.request('POST', path, body=body, headers={'Content-Type': 'application/x-ndjson'})
+    resp = conn.getresponse()
+    first = None
+    ok = errors = size = 0
+    expected = 1
+    for line in resp:
+        if first is None:
+            first = time.perf_counter() - start
+        result = json.loads(line)
+        if result['index'] != expected:
+            sys.exit(f"batch answered out of order: {result['index']} after {expected - 1}")
+        expected += 1
+        if 'error' in result:
+            errors += 1
+        else:
+            ok += 1
+            size += len(base64.b64decode(result['content']))
+    elapsed = time.perf_counter() - start
+    print(f"POST {path}: {ok} bills ({errors} failed, {size / 2 ** 20:.1f} MB) in {elapsed:.2f}s "
+          f"({ok / elapsed:.1f}/s), first result after {first * 1000:.0f} ms")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8, help='threads posting single invoices')
+    parser.add_argument('--requests', type=int, default=25, help='invoices per client')
+    parser.add_argument('--batch', type=int, default=500, help='records in the batch request')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--queue', type=int, default=16)
+    parser.add_argument('--pdf', action='store_true', help='ask for native PDFs instead of Word')
+    args = parser.parse_args()
+    query = '?format=pdf&engine=native' if args.pdf else ''
+
+    server, port = start_server(args)
+    try:
+        run_singles(port, args, '/invoices' + query)
+        run_batch(port, args.batch, '/invoices/batch' + query)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/health')
+        print(f"health: {conn.getresponse().read().decode('utf-8')}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Cold start of the GUI: time to the window's first paint, and what was imported before it.
+
+    python benchmarks/bench_startup.py [-n 10] [--max-ms 1500] [--importtime 25]
+
+Each run is a fresh interpreter (QT_QPA_PLATFORM=offscreen unless a display
+is set). The run fails if python-docx, lxml, docx2pdf or QtPdf were imported
+before the first paint, or if the median exceeds --max-ms. --importtime
+lists the slowest top-level imports of one start, from python -X importtime.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'billmakerv1-5.py')
+# Must not be on the startup path; they load behind the first paint
+DEFERRED = ['docx', 'lxml', 'docx2pdf', 'PyQt6.QtPdf']
+
+CHILD = r'''
+import importlib.util, json, sys, threading, time
+start = time.perf_counter()
+sys.path.insert(0, ROOT)
+spec = importlib.util.spec_from_file_location('billmaker_app', APP)
+app_module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app_module)
+imported = time.perf_counter()
+from PyQt6.QtCore import QEvent, QObject
+from PyQt6.QtWidgets import QApplication
+import billcore
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and not hasattr(self, 'painted'):
+            self.painted = time.perf_counter()
+            self.loaded = [name for name in DEFERRED if name in sys.modules]
+            app.quit()
+        return False
+
+app = QApplication(sys.argv)
+window = app_module.AstaEpsilonBilling()
+probe = FirstPaint()
+window.installEventFilter(probe)
+window.show()
+app.exec()
+if PREWARM:
+    prewarm = threading.Thread(target=billcore.prewarm)
+    prewarm.start()
+    prewarm.join()
+ready = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'paint_ms': (probe.painted - start) * 1000,
+                  'ready_ms': (ready - start) * 1000, 'loaded': probe.loaded}))
+window.preview.shutdown()
+'''
+
+
+def child_env(tmp):
+    env = dict(os.environ)
+    if not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env['BILLMAKER_DB'] = os.path.join(tmp, 'invoices.db')
+    env['BILLMAKER_CACHE'] = 'off'
+    return env
+
+
+def child_code(prewarm=True):
+    return f'ROOT = {ROOT!r}\nAPP = {APP!r}\nDEFERRED = {DEFERRED!r}\nPREWARM = {prewarm!r}\n' + CHILD
+
+
+def start_once(env):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', child_code()], env=env, cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    # Wall time of the whole child, interpreter startup and exit included
+    result['process_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def import_report(env, top):
+    # Stops at the first paint, so the report covers the startup path only
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', child_code(prewarm=False)], env=env, cwd=ROOT,
+                         check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Names are indented two spaces per level of nesting, after one separating space
+        rows.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    top_level = [row for row in rows if not row[2].startswith(' ')]
+    print(f"\nslowest top-level imports (of {len(rows)} modules):")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative_us, self_us, name in sorted(top_level, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=10, help='cold starts to time')
+    parser.add_argument('--max-ms', type=float, help='fail if the median time to first paint is above this')
+    parser.add_argument('--importtime', type=int, metavar='N', default=0,
+                        help='also list the N slowest top-level imports')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        env = child_env(tmp)
+        start_once(env)  # warm the OS file cache; the first start is not representative
+        runs = [start_once(env) for _ in range(args.n)]
+        if args.importtime:
+            import_report(env, args.importtime)
+
+    print(f"\n{'':<26} {'p50 ms':>8} {'max ms':>8}")
+    for key, label in (('import_ms', 'app imports'), ('paint_ms', 'first paint (in process)'),
+                       ('ready_ms', 'ready to export'), ('process_ms', 'whole process')):
+        values = [run[key] for run in runs]
+        print(f"{label:<26} {statistics.median(values):>8.1f} {max(values):>8.1f}")
+
+    failed = False
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    if loaded:
+        print(f"imported before the first paint: {', '.join(loaded)}")
+        failed = True
+    paint = statistics.median(run['paint_ms'] for run in runs)
+    if args.max_ms is not None and paint > args.max_ms:
+        print(f"first paint {paint:.1f} ms is over the {args.max_ms:.0f} ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Invoice store: client autocomplete over a large client list and concurrent bill numbering.
+
+    python benchmarks/bench_store.py [--clients 100000] [--writers 4] [--bills 250]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billstore
+
+ITEMS = [('Room booking', '3', '2500'), ('Breakfast', '6', '180')]
+
+
+def client_name(rng):
+    return ' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).title()
+                    for _ in range(rng.randint(1, 3)))
+
+
+def populate(store, n, rng):
+    # Bulk load in one transaction; going through save_invoice would time the fsyncs instead
+    names = {}
+    while len(names) < n:
+        name = client_name(rng)
+        names[name.casefold()] = name
+    store.db.execute('BEGIN')
+    store.db.executemany('INSERT INTO clients (name, name_key, address, last_used) VALUES (?, ?, ?, ?)',
+                         [(name, key, 'Bolpur', '2026-10-01') for key, name in names.items()])
+    store.db.execute('COMMIT')
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+def writer(path, bills, worker):
+    with billstore.InvoiceStore(path) as store:
+        for i in range(bills):
+            fields = {'CLIENTNAME': f'Writer {worker}', 'CLIENTADDRESS': 'Bolpur', 'BILLNUMBER': '',
+                      'BILLDATE': '01/10/2026', 'DUEDATE': '31/10/2026'}
+            store.save_invoice(fields, ITEMS, '8,580.00')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=4, help='processes saving bills at once')
+    parser.add_argument('--bills', type=int, default=250, help='bills saved per writer')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory(prefix='billmaker-bench-') as tmp:
+        path = os.path.join(tmp, 'invoices.db')
+        with billstore.InvoiceStore(path) as store:
+            populate(store, args.clients, rng)
+            samples = []
+            found = 0
+            for _ in range(args.lookups):
+                prefix = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 3)))
+                start = time.perf_counter()
+                found += len(store.find_clients(prefix))
+                samples.append(time.perf_counter() - start)
+            print(f"autocomplete over {args.clients} clients: p50 {percentile(samples, 50) * 1e6:.0f} us, "
+                  f"p99 {percentile(samples, 99) * 1e6:.0f} us ({found / args.lookups:.1f} matches/lookup)")
+
+        start = time.perf_counter()
+        procs = [multiprocessing.Process(target=writer, args=(path, args.bills, w)) for w in range(args.writers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        with billstore.InvoiceStore(path) as store:
+            numbers = [row[0] for row in store.db.execute('SELECT bill_number FROM invoices')]
+        expected = {f'{billstore.BILL_PREFIX}{n:0{billstore.BILL_DIGITS}d}'
+                    for n in range(1, args.writers * args.bills + 1)}
+        ok = len(numbers) == len(expected) and set(numbers) == expected
+        print(f"{args.writers} writers x {args.bills} bills: {len(numbers) / elapsed:.0f} bills/s, "
+              f"numbers {'gap-free and unique' if ok else 'WRONG'}")
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,445 @@
+import argparse
+import collections
+import os
+import re
+import sqlite3
+import sys
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import billcache
+import billcore
+import billingest
+import billjournal
+import billmoney
+import billpdf
+import billpdfnative
+import billregistry
+import billstore
+import billtrace
+
+# Records handed to a worker process per task
+CHUNK_SIZE = 64
+
+
+def cell(value):
+    # JSON null is a blank cell, and JSON numbers are read like the text of a CSV cell
+    return '' if value is None else str(value)
+
+
+def record_items(record):
+    # JSONL may carry an "items" list; CSV uses description1/quantity1/price1 columns
+    if 'items' in record:
+        return [(cell(it.get('description')), cell(it.get('quantity')), cell(it.get('price')))
+                for it in record['items']]
+    items = []
+    i = 1
+    while any(f'{column}{i}' in record for column in ('description', 'quantity', 'price')):
+        items.append((cell(record.get(f'description{i}')),
+                      cell(record.get(f'quantity{i}')) or '0',
+                      cell(record.get(f'price{i}')) or '0'))
+        i += 1
+    return items
+
+
+def output_name(record, index, ext):
+    name = str(record.get('BILLNUMBER') or '').strip() or f"bill_{index:06d}"
+    return re.sub(r'[^\w.-]+', '_', name) + ext
+
+
+def record_fields(record):
+    return {key: str(record.get(key) or '') for key in billcore.HEADER_FIELDS + billcore.MONEY_FIELDS}
+
+
+def bill_for(record, index, out_dir, ext):
+    data = billcore.build_bill_data(record_fields(record), record_items(record))
+    return data, os.path.join(out_dir, output_name(record, index, ext))
+
+
+def store_record(store, record):
+    """Save a record to the invoice store and return it with its (possibly new) bill number."""
+    fields = record_fields(record)
+    items = record_items(record)
+    try:
+        total = billcore.build_bill_data(fields, items)['TOTAL']
+    except billmoney.MoneyError:
+        # Not stored; rendering it reports the bad amounts as a failed bill
+        return record
+    return {**record, 'BILLNUMBER': store.save_invoice(fields, items, total)}
+
+
+def chunked(iterable, size):
+    chunk = []
+    for entry in iterable:
+        chunk.append(entry)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ZipSink:
+    """Bills written one after another as members of a single ZIP archive."""
+
+    def __init__(self, path):
+        # Renamed into place by close(), so a killed run never leaves a truncated archive
+        self.output = billcore.AtomicFile(path)
+        self.archive = zipfile.ZipFile(self.output.file, 'w')
+        self.names = set()
+
+    def add(self, name, content):
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while name in self.names:
+            n += 1
+            name = f"{stem}_{n}{ext}"
+        self.names.add(name)
+        # A DOCX is a ZIP of deflated parts already; compressing it again only costs time
+        compress = zipfile.ZIP_STORED if ext == '.docx' else zipfile.ZIP_DEFLATED
+        with billtrace.stage('write'):
+            self.archive.writestr(name, content, compress_type=compress)
+
+    def close(self):
+        try:
+            self.archive.close()
+        except BaseException:
+            self.output.discard()
+            raise
+        self.output.commit()
+
+
+class MergedPdfSink:
+    """Bills appended to one PDF, bookmarked by file name."""
+
+    def __init__(self, path, renderer):
+        self.output = billcore.AtomicFile(path)
+        self.writer = billpdfnative.MergedPdfWriter(renderer, self.output.file)
+
+    def add(self, name, content):
+        template_path, (pages, used) = content
+        with billtrace.stage('write'):
+            self.writer.add(os.path.splitext(name)[0], pages, used, billpdfnative.get_renderer(template_path))
+
+    def close(self):
+        try:
+            self.writer.close()
+        except BaseException:
+            self.output.discard()
+            raise
+        self.output.commit()
+
+
+def render_bill(data, output_path, template, cache, mode, convert):
+    """Render one bill in the form the batch wants it.
+
+    ``mode`` is 'file' to write it to output_path, 'bytes' to return the
+    document and 'pages' to return its native PDF layout (with the template
+    its letterhead comes from) for a merged PDF.
+    With ``convert`` the Word output still has to become a PDF. Returns
+    ('done', SHA-256 of the file), ('bytes', content), ('pages', layout)
+    or, for the converter pool, ('convert', (DOCX bytes, PDF cache key)).
+    Files are written atomically: complete under their name, or not there.
+    """
+    if mode == 'pages':
+        return 'pages', (template.template_path, template.lay_out(data))
+    if convert:
+        key = billcore.pdf_cache_key(data, template, cache)
+        if mode == 'file':
+            content = billcore.copy_cached(cache, key, output_path)
+            if content is not None:
+                return 'done', billjournal.digest(content)
+        elif key is not None:
+            content = cache.read(key)
+            if content is not None:
+                billtrace.count('cache_hits')
+                return 'bytes', content
+        return 'convert', (billcore.cached_render(data, template, cache), key)
+    if mode == 'file':
+        return 'done', billjournal.digest(billcore.save_output(data, output_path, template, cache))
+    return 'bytes', billcore.cached_render(data, template, cache, billcore.output_kind(template))
+
+
+# Per-process templates, set up by the pool initializer
+_worker_templates = None
+_worker_options = None
+_worker_cache = None
+
+
+def _init_worker(template_dir, template_path, backend, native_pdf, trace_settings, cache_settings):
+    global _worker_templates, _worker_options, _worker_cache
+    billtrace.configure(**trace_settings)
+    if cache_settings:
+        _worker_cache = billcache.RenderCache(*cache_settings)
+    _worker_templates = billregistry.TemplateRegistry(template_dir, template_path)
+    _worker_options = (backend, native_pdf)
+    # The default template is loaded up front; others when a record first names them
+    _worker_templates.renderer(None, backend, native_pdf)
+
+
+def _render_chunk(chunk, out_dir, ext, mode, convert):
+    """Render a chunk of (index, record) pairs in a worker process.
+
+    Returns (index, output path, error, result, trace) per record, result
+    being render_bill's. Traces are held open and finished by the parent,
+    which owns the trace sinks.
+    """
+    results = []
+    for index, record in chunk:
+        output_path = result = error = None
+        with billtrace.job('bill', record=index) as trace:
+            try:
+                data, output_path = bill_for(record, index, out_dir, ext)
+                template = _worker_templates.for_record(record, *_worker_options)
+                result = render_bill(data, output_path, template, _worker_cache, mode, convert)
+            except Exception as e:
+                error = str(e)
+                if trace is not None:
+                    trace.error = error
+            if trace is not None:
+                trace.hold()
+        results.append((index, output_path, error, result, trace))
+    return results
+
+
+def _finished(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def run_batch(input_path, out_dir, export_pdf=False, template_path=None, backend='docx',
+              pdf_engine='convert', jobs=1, chunk_size=CHUNK_SIZE, store=None, cache=None,
+              zip_path=None, merge_path=None, template_dir=None, resume=False):
+    """Render every record of input_path; returns (bills written, bills failed, bills skipped).
+
+    Bills go to out_dir one file each, or with ``zip_path`` into one ZIP
+    archive and with ``merge_path`` (native PDFs only) into one merged PDF.
+    Both are written as bills arrive, in input order, so memory stays flat
+    however long the input is and no bill touches the disk on its own.
+    Records naming a TEMPLATE are rendered with that template from
+    ``template_dir`` (by default the directory of template_path).
+
+    Bills written to out_dir are listed in its journal (billjournal) as
+    they finish. With ``resume`` the records an earlier run finished are
+    skipped, neither rendered nor stored again, and counted as skipped.
+    """
+    if merge_path and not (export_pdf and pdf_engine == 'native'):
+        raise ValueError("a merged PDF needs the native PDF engine")
+    if resume and (zip_path or merge_path):
+        raise ValueError("only bills written to a directory can be resumed")
+    native_pdf = export_pdf and pdf_engine == 'native'
+    with billtrace.job('load', backend='native' if native_pdf else backend):
+        templates = billregistry.TemplateRegistry(template_dir, template_path)
+        # Drawn straight to PDF, a native bill is written exactly like a Word bill
+        template = templates.renderer(None, backend, native_pdf)
+    if native_pdf:
+        export_pdf = False
+        ext = ".pdf"
+    else:
+        ext = ".pdf" if export_pdf else ".docx"
+    pool = billpdf.get_pool() if export_pdf else None
+    journal = None
+    if merge_path:
+        sink, mode = MergedPdfSink(merge_path, template), 'pages'
+    elif zip_path:
+        sink, mode = ZipSink(zip_path), 'bytes'
+    else:
+        sink, mode = None, 'file'
+        os.makedirs(out_dir, exist_ok=True)
+        billcore.remove_partial_files(out_dir)
+        journal = billjournal.BatchJournal(os.path.join(out_dir, billjournal.JOURNAL_NAME), resume)
+
+    # Keep the converters busy without queueing the whole input at once
+    window = 4 * len(pool.converters) if pool else 0
+    in_flight = collections.deque()
+    done = failed = skipped = 0
+    # Journal keys of the records on their way, by index
+    keys = {}
+
+    def finish(index, output_path, sha256):
+        nonlocal done
+        done += 1
+        if journal is not None:
+            journal.add(keys.pop(index), os.path.basename(output_path), sha256)
+
+    def fail(index, error):
+        nonlocal failed
+        failed += 1
+        keys.pop(index, None)
+        print(f"record {index}: {error}", file=sys.stderr)
+
+    def collect(index, output_path, future):
+        try:
+            content = future.result()
+            if sink is not None:
+                sink.add(os.path.basename(output_path), content)
+                finish(index, output_path, None)
+            else:
+                # A converted PDF, written here rather than by the converter so it lands whole
+                with billtrace.stage('write'):
+                    billcore.write_file(output_path, content)
+                finish(index, output_path, billjournal.digest(content))
+        except Exception as e:
+            fail(index, e)
+
+    def track(index, output_path, future):
+        in_flight.append((index, output_path, future))
+        while len(in_flight) > window:
+            collect(*in_flight.popleft())
+
+    def take(results):
+        for index, output_path, error, result, trace in results:
+            with billtrace.resume(trace):
+                if error is not None:
+                    fail(index, error)
+                    continue
+                kind, content = result
+                if kind == 'convert':
+                    docx, key = content
+                    track(index, output_path,
+                          billcore.convert_docx(docx, pool, cache, key, os.path.basename(output_path)))
+                elif sink is not None:
+                    # Behind any conversions still running, so the sink gets bills in input order
+                    track(index, output_path, _finished(content))
+                else:
+                    finish(index, output_path, content)
+
+    def unfinished(records):
+        nonlocal skipped
+        for index, record in records:
+            key = billjournal.bill_key(index, record)
+            if journal.finished(key):
+                skipped += 1
+                continue
+            keys[index] = key
+            yield index, record
+
+    records = enumerate(billingest.read_records(input_path), 1)
+    if journal is not None:
+        # Before the store, so a resumed run doesn't number and store finished bills again
+        records = unfinished(records)
+    if store is not None:
+        # Numbered and stored up front, in input order, by this process only
+        records = ((index, store_record(store, record)) for index, record in records)
+    try:
+        if jobs > 1:
+            # Rendering is CPU-bound, so spread it over processes. Chunks are
+            # collected in submission order and only a few are queued per worker.
+            with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                     initargs=(template_dir, template_path, backend, native_pdf,
+                                               billtrace.worker_settings(),
+                                               cache and (cache.directory, cache.max_bytes))) as executor:
+                chunks = collections.deque()
+                for chunk in chunked(records, chunk_size):
+                    chunks.append(executor.submit(_render_chunk, chunk, out_dir, ext, mode, export_pdf))
+                    while len(chunks) > 2 * jobs or (chunks and chunks[0].done()):
+                        take(chunks.popleft().result())
+                while chunks:
+                    take(chunks.popleft().result())
+        else:
+            for index, record in records:
+                with billtrace.job('bill', record=index) as trace:
+                    try:
+                        data, output_path = bill_for(record, index, out_dir, ext)
+                        result = render_bill(data, output_path, templates.for_record(record, backend, native_pdf),
+                                             cache, mode, export_pdf)
+                        take([(index, output_path, None, result, None)])
+                    except Exception as e:
+                        fail(index, e)
+                        if trace is not None:
+                            trace.error = str(e)
+
+        while in_flight:
+            collect(*in_flight.popleft())
+    finally:
+        if sink is not None:
+            sink.close()
+        if journal is not None:
+            journal.close()
+    return done, failed, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='billmaker batch',
+                                     description='Render one bill per CSV/JSONL record without the GUI.')
+    parser.add_argument('input', help='.csv, .jsonl or .xlsx file: one bill, or one line item, per row/line')
+    parser.add_argument('-o', '--out-dir', default='bills', help='directory for the rendered bills')
+    parser.add_argument('--pdf', action='store_true', help='export PDF instead of Word')
+    parser.add_argument('--template', help=f'template path (default: {billcore.TEMPLATE_NAME})')
+    parser.add_argument('--templates', metavar='DIR',
+                        help=f'templates records can pick by name in a {billregistry.TEMPLATE_FIELD} column '
+                             '(default: the directory of --template)')
+    parser.add_argument('--backend', choices=sorted(billcore.RENDER_BACKENDS), default='docx',
+                        help='render through python-docx or rewrite the document XML directly')
+    parser.add_argument('--pdf-engine', choices=billcore.PDF_ENGINES,
+                        help='convert the Word output with an office suite (default), or draw the PDF natively')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--zip', metavar='PATH', help='write all bills into one ZIP archive instead of -o')
+    output.add_argument('--merge-pdf', metavar='PATH',
+                        help='append all bills to one PDF, bookmarked per bill (implies --pdf --pdf-engine native)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes rendering bills (default: one per core)')
+    parser.add_argument('--trace-jsonl', metavar='PATH', help='append per-bill stage timings and counters')
+    parser.add_argument('--trace-prom', metavar='PATH', help='write running totals as a Prometheus text file')
+    parser.add_argument('--profile-dir', metavar='DIR', help='save a cProfile .prof file per bill')
+    parser.add_argument('--trace-memory', action='store_true', help='record peak traced memory per bill')
+    parser.add_argument('--store', nargs='?', const=billstore.default_path(), metavar='DB',
+                        help='save every bill to the invoice store, numbering those without a BILLNUMBER '
+                             f'(default: {billstore.default_path()})')
+    parser.add_argument('--convert-timeout', type=float, metavar='SECONDS',
+                        help='kill a PDF conversion running longer than this '
+                             f'(default: {billpdf.CONVERT_TIMEOUT:g}, 0 for no limit)')
+    parser.add_argument('--dead-letter', metavar='DIR',
+                        help='keep the documents that failed to convert here '
+                             f'(default: {billpdf.default_dead_letter_dir()})')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the bills an interrupted run into the same -o directory finished')
+    parser.add_argument('--cache', nargs='?', const=billcache.default_dir(), metavar='DIR',
+                        help='reuse identical bills rendered before from a render cache '
+                             f'(default: {billcache.default_dir()})')
+    args = parser.parse_args(argv)
+
+    try:
+        # Trace options given on the command line replace the environment's
+        if args.trace_jsonl or args.trace_prom or args.profile_dir or args.trace_memory:
+            billtrace.configure(args.trace_jsonl, args.trace_prom, args.profile_dir, args.trace_memory)
+        else:
+            billtrace.configure_from_env()
+    except ValueError as e:
+        parser.error(str(e))
+
+    billpdf.configure(timeout=args.convert_timeout, dead_letter_dir=args.dead_letter)
+    start = time.perf_counter()
+    store = None
+    try:
+        if args.store:
+            store = billstore.InvoiceStore(args.store)
+        done, failed, skipped = run_batch(args.input, args.out_dir, args.pdf or bool(args.merge_pdf), args.template,
+                                 args.backend, args.pdf_engine or ('native' if args.merge_pdf else 'convert'),
+                                 max(1, args.jobs), store=store,
+                                 cache=billcache.RenderCache(args.cache) if args.cache else None,
+                                 zip_path=args.zip, merge_path=args.merge_pdf, template_dir=args.templates,
+                                 resume=args.resume)
+    except (OSError, RuntimeError, ValueError, sqlite3.Error) as e:
+        print(f"billmaker batch: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if store is not None:
+            store.close()
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed else 0
+    resumed = f", {skipped} already done" if args.resume else ""
+    print(f"{done} bills written to {args.merge_pdf or args.zip or args.out_dir} ({failed} failed{resumed}) "
+          f"in {elapsed:.2f}s, {rate:.1f}/s")
+    converter = billpdf.pool_stats()
+    if converter and (converter['converted'] or converter['failed']):
+        print(f"PDF conversion: {converter['converted']} converted on {converter['converters']} converters, "
+              f"{converter['failed']} failed, {converter['retries']} retried ({converter['timeouts']} timed out), "
+              f"{converter['restarts']} restarts, queue peaked at {converter['queued_peak']}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+DEFAULT_MAX_MB = 256
+# Bump when a change to the renderers alters their output for the same input
+CACHE_VERSION = 1
+# Eviction trims the cache to this share of its size bound
+LOW_WATER = 0.9
+
+
+def default_dir():
+    return os.path.join(os.path.expanduser('~'), '.billmaker', 'cache')
+
+
+class RenderCache:
+    """Rendered bills on disk, addressed by what went into them.
+
+    The key hashes the artifact kind, the renderer's content digest (the
+    template bytes, or template and fonts for the native PDF renderer) and
+    the bill data in canonical form, so any change to either is a miss and
+    DOCX and PDF output never share an entry. Hits refresh the file's
+    mtime; when the cache grows past ``max_bytes`` the least recently used
+    entries are removed. Entries are written to a temporary file and
+    renamed into place, so several processes can share one directory.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_MB * 2 ** 20):
+        self.directory = directory or default_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def key(kind, digest, data):
+        if not isinstance(data, dict):
+            # An Invoice: keyed on its text, so entries from before it still match
+            data = dict(data)
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(f'{CACHE_VERSION}\0{kind}\0{digest}\0{canonical}'.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def read(self, key):
+        """The cached bytes, or None on a miss."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return content
+
+    def put(self, key, content):
+        self._store(key, lambda f: f.write(content))
+
+    def put_file(self, key, source_path):
+        def copy(f):
+            with open(source_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+        self._store(key, copy)
+
+    def _store(self, key, write):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._added(size)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _entries(self):
+        entries = []
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.part'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Rescanned rather than tracked, since other processes may share the directory
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The shared render cache, configured by BILLMAKER_CACHE (a directory, or "off") and
+    BILLMAKER_CACHE_MB; None when turned off or the directory can't be created."""
+    global _cache
+    setting = os.environ.get('BILLMAKER_CACHE', '')
+    if setting.lower() == 'off':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                max_mb = float(os.environ.get('BILLMAKER_CACHE_MB') or DEFAULT_MAX_MB)
+                _cache = RenderCache(setting or None, int(max_mb * 2 ** 20))
+            except (OSError, ValueError):
+                return None
+        return _cache
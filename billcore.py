@@ -0,0 +1,389 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+from collections.abc import Mapping
+from concurrent.futures import Future
+
+import billmoney
+import billpdf
+import billpdfnative
+import billtemplate
+import billtrace
+import billxml
+
+TEMPLATE_NAME = "Bill Format.docx"
+
+# Keywords used by the v1.5 template, in the order the form shows them
+HEADER_FIELDS = ['CLIENTNAME', 'CLIENTADDRESS', 'BILLNUMBER', 'BILLDATE', 'DUEDATE']
+# Bill settings read by the money engine rather than placed in the template
+MONEY_FIELDS = ['CURRENCY', 'DISCOUNT', 'TAX']
+# Rows the template lays out; bills with fewer items are padded to this many
+ITEM_ROWS = 3
+ITEM_FIELDS = ['description', 'quantity', 'amount']
+# Suffix of the temporary files outputs are written to before being renamed into place
+PART_SUFFIX = '.part'
+# Invoice attributes holding the header keywords
+HEADER_ATTRS = dict(zip(HEADER_FIELDS, ['client_name', 'client_address', 'bill_number', 'bill_date', 'due_date']))
+DIGITS = '0123456789'
+# Keywords keyword_cell remembers at most, so stray lookups can't grow the table without end
+MAX_KEYWORD_CELLS = 4096
+TEMPLATE_KEYS = (HEADER_FIELDS
+                 + [f"{name}{i+1}" for i in range(ITEM_ROWS) for name in ITEM_FIELDS]
+                 + ['TOTAL'])
+
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+
+UNKNOWN = (None, None)
+# What each keyword looked up so far refers to, shared by every Invoice: see keyword_cell
+KEYWORD_CELLS = {key: (attr, None) for key, attr in HEADER_ATTRS.items()}
+KEYWORD_CELLS['TOTAL'] = ('TOTAL', None)
+
+
+def keyword_cell(key):
+    """(item field, row index) for an item keyword such as "amount3", else UNKNOWN; remembered."""
+    if not isinstance(key, str):
+        return UNKNOWN
+    name = key.rstrip(DIGITS)
+    number = key[len(name):]
+    cell = (name, int(number) - 1) if name in ITEM_FIELDS and number and number[0] != '0' else UNKNOWN
+    if len(KEYWORD_CELLS) < MAX_KEYWORD_CELLS:
+        KEYWORD_CELLS[key] = cell
+    return cell
+
+
+class LineItem:
+    """One row of a bill's table with its raw numbers.
+
+    ``quantity`` is an int or Decimal (None on the subtotal, discount and
+    tax rows) and ``amount`` is in minor units of the bill's currency.
+    """
+
+    __slots__ = ('description', 'quantity', 'amount')
+
+    def __init__(self, description, quantity, amount):
+        self.description = description
+        self.quantity = quantity
+        self.amount = amount
+
+    def __repr__(self):
+        return f"LineItem({self.description!r}, {self.quantity!r}, {self.amount!r})"
+
+
+class Invoice(Mapping):
+    """A bill as the renderers see it: template keywords mapped to their text.
+
+    The numbers stay as billmoney left them, item columns in arrays and
+    amounts in minor units, and a keyword's text is only formatted when a
+    renderer looks it up. Header fields can be replaced, as when the invoice
+    store hands out the bill number; everything else follows from the items.
+    """
+
+    __slots__ = ('client_name', 'client_address', 'bill_number', 'bill_date', 'due_date', 'descriptions', 'totals')
+
+    def __init__(self, fields, descriptions, totals):
+        for key, attr in HEADER_ATTRS.items():
+            setattr(self, attr, fields.get(key, ""))
+        self.descriptions = descriptions
+        self.totals = totals
+
+    @property
+    def rows(self):
+        """Rows of the table: the items, then the subtotal and adjustments if there are any."""
+        adjustments = self.totals.adjustments
+        return len(self.descriptions) + (len(adjustments) + 1 if adjustments else 0)
+
+    def lines(self):
+        totals = self.totals
+        for i, description in enumerate(self.descriptions):
+            yield LineItem(description, totals.quantities[i], totals.lines[i])
+        if totals.adjustments:
+            yield LineItem('Subtotal', None, totals.subtotal)
+            for label, amount in totals.adjustments:
+                yield LineItem(label, None, amount)
+
+    def __getitem__(self, key):
+        # Renderers look up every keyword of every bill, so this stays on the short path
+        name, index = KEYWORD_CELLS.get(key) or keyword_cell(key)
+        if index is None:
+            if name is None:
+                raise KeyError(key)
+            if name == 'TOTAL':
+                return self.totals.format(self.totals.total)
+            return getattr(self, name)
+        totals = self.totals
+        items = len(self.descriptions)
+        if index < items:
+            if name == 'description':
+                return self.descriptions[index]
+            if name == 'quantity':
+                return totals.format_quantity(index)
+            return totals.format(totals.lines[index])
+        if index >= self.rows:
+            raise KeyError(key)
+        if name == 'quantity':
+            return ''
+        label, amount = ('Subtotal', totals.subtotal) if index == items else totals.adjustments[index - items - 1]
+        return label if name == 'description' else totals.format(amount)
+
+    def __contains__(self, key):
+        name, index = KEYWORD_CELLS.get(key) or keyword_cell(key)
+        return name is not None and (index is None or index < self.rows)
+
+    def __iter__(self):
+        yield from HEADER_FIELDS
+        for number in range(1, self.rows + 1):
+            for name in ITEM_FIELDS:
+                yield f"{name}{number}"
+        yield 'TOTAL'
+
+    def __len__(self):
+        return len(HEADER_FIELDS) + len(ITEM_FIELDS) * self.rows + 1
+
+    def __setitem__(self, key, value):
+        attr = HEADER_ATTRS.get(key)
+        if attr is None:
+            raise KeyError(f"{key} is worked out from the items")
+        setattr(self, attr, value)
+
+
+def build_bill_data(fields, items):
+    """An Invoice of header fields and (description, quantity, unit price) rows.
+
+    Amounts are worked out exactly by billmoney in the bill's CURRENCY, with
+    its DISCOUNT and TAX shown as extra rows under the items. A quantity or
+    price that can't be read raises billmoney.MoneyError naming every bad cell.
+    """
+    items = list(items)
+    items += [("", "0", "0")] * (ITEM_ROWS - len(items))
+    totals = billmoney.compute([qty for _, qty, _ in items], [price for _, _, price in items],
+                               fields.get('CURRENCY'), fields.get('DISCOUNT'), fields.get('TAX'))
+    return Invoice(fields, [desc for desc, _, _ in items], totals)
+
+
+# "convert" goes DOCX -> PDF through an office converter; "native" draws the PDF directly
+PDF_ENGINES = ['convert', 'native']
+
+# "docx" renders through python-docx; "xml" rewrites word/document.xml inside the zip directly
+RENDER_BACKENDS = {
+    'docx': billtemplate.CompiledTemplate,
+    'xml': billxml.XmlTemplate,
+}
+
+
+def load_template(template_path=None, backend='docx'):
+    # The template row holding description1/quantity1/amount1 is repeated for every item
+    return billtemplate.get_template(template_path or resource_path(TEMPLATE_NAME), TEMPLATE_KEYS,
+                                     RENDER_BACKENDS[backend], ITEM_FIELDS)
+
+
+def load_pdf_renderer(template_path=None):
+    return billpdfnative.get_renderer(template_path or resource_path(TEMPLATE_NAME))
+
+
+def prewarm(template_path=None, backend='docx'):
+    """Load python-docx, the template and the native PDF renderer ahead of the first export.
+
+    Meant to run on a background thread once the window is up; anything that
+    fails here is left for the export itself to report.
+    """
+    for load, args in ((load_template, (template_path, backend)), (load_pdf_renderer, (template_path,))):
+        try:
+            load(*args)
+        except Exception:
+            pass
+
+
+class BillSession:
+    """The bill open in the form, re-rendered incrementally from one export to the next.
+
+    It stands in for the template in save_output/submit_pdf: the first save
+    renders the bill, later ones only rewrite the fields that changed since
+    (see billtemplate.RenderedBill). A changed template file starts over.
+    """
+
+    def __init__(self, template_path=None):
+        self.template_path = template_path
+        self.bill = None
+        self._lock = threading.Lock()
+
+    @property
+    def digest(self):
+        return load_template(self.template_path).digest
+
+    def save(self, data, stream):
+        template = load_template(self.template_path)
+        # Exports from one window may overlap on the thread pool
+        with self._lock:
+            if self.bill is None or self.bill.template is not template:
+                self.bill = template.open(data)
+            else:
+                self.bill.update(data)
+            self.bill.save(stream)
+
+
+def render_bytes(data, renderer):
+    """Render one bill entirely in memory and return the document bytes."""
+    buf = io.BytesIO()
+    renderer.save(data, buf)
+    return buf.getvalue()
+
+
+def cached_render(data, renderer, cache=None, kind='docx'):
+    """render_bytes, served from the render cache when this exact bill was rendered before."""
+    if cache is None:
+        return render_bytes(data, renderer)
+    key = cache.key(kind, renderer.digest, data)
+    content = cache.read(key)
+    if content is None:
+        content = render_bytes(data, renderer)
+        cache.put(key, content)
+    else:
+        billtrace.count('cache_hits')
+    return content
+
+
+def output_kind(renderer):
+    return 'pdf' if isinstance(renderer, billpdfnative.NativePdfRenderer) else 'docx'
+
+
+class AtomicFile:
+    """A file written beside ``path`` under a temporary name and renamed onto it when complete.
+
+    Until commit() nothing is at ``path`` (or the previous file still is), so
+    a crash or power cut never leaves a half-written output; at worst a
+    hidden ".part" file, which discard() or remove_partial_files() clears.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory, name = os.path.split(os.path.abspath(path))
+        while True:
+            self.temp_path = os.path.join(directory, f'.{name}.{os.urandom(4).hex()}{PART_SUFFIX}')
+            try:
+                # Not mkstemp: its 0600 would survive the rename; bills get the umask's mode like open() gives
+                fd = os.open(self.temp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0),
+                             0o666)
+                break
+            except FileExistsError:
+                continue
+        self.file = os.fdopen(fd, 'wb')
+
+    def commit(self):
+        # On disk before the rename, so the name never points at missing data
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+def write_file(output_path, content):
+    """Write content to output_path atomically (see AtomicFile)."""
+    output = AtomicFile(output_path)
+    try:
+        output.file.write(content)
+        output.commit()
+    except BaseException:
+        output.discard()
+        raise
+
+
+def remove_partial_files(directory):
+    """Delete the temporary files of AtomicFiles a crashed run left in directory."""
+    for entry in os.scandir(directory):
+        if entry.name.startswith('.') and entry.name.endswith(PART_SUFFIX) and entry.is_file():
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def save_output(data, output_path, renderer, cache=None):
+    """Write a compiled template's (or the native PDF renderer's) output for one bill; returns it."""
+    content = cached_render(data, renderer, cache, output_kind(renderer))
+    with billtrace.stage('write'):
+        write_file(output_path, content)
+    return content
+
+
+def pdf_cache_key(data, template, cache):
+    # Converted PDFs are keyed on the Word template, native ones on their own digest
+    return cache.key('pdf', template.digest, data) if cache is not None else None
+
+
+def copy_cached(cache, key, output_path):
+    """Write a cached artifact to output_path and return it; None on a miss."""
+    content = cache.read(key) if key is not None else None
+    if content is not None:
+        billtrace.count('cache_hits')
+        write_file(output_path, content)
+    return content
+
+
+def submit_docx(content, output_path, pool=None, cache=None, key=None, name=None):
+    """Queue rendered DOCX bytes for conversion; the PDF is cached under key once it lands.
+
+    ``name`` is what the bill is called if it ends up in the dead-letter
+    directory (by default output_path's file name).
+    """
+    pool = pool or billpdf.get_pool()
+    future = pool.submit_docx(content, output_path, name)
+    if key is not None:
+        def store(f):
+            if not f.cancelled() and f.exception() is None:
+                cache.put_file(key, output_path)
+        future.add_done_callback(store)
+    return future
+
+
+def convert_docx(content, pool=None, cache=None, key=None, name=None):
+    """Queue rendered DOCX bytes for conversion; the Future gives the PDF bytes.
+
+    The converter writes to a scratch file in RAM where there is one, which
+    is read back and removed as soon as the conversion lands.
+    """
+    fd, pdf_path = tempfile.mkstemp(prefix='billmaker-', suffix='.pdf', dir=billpdf.scratch_dir())
+    os.close(fd)
+    result = Future()
+
+    def finish(f):
+        try:
+            f.result()
+            with open(pdf_path, 'rb') as pdf:
+                result.set_result(pdf.read())
+        except Exception as e:
+            result.set_exception(e)
+        finally:
+            os.remove(pdf_path)
+    submit_docx(content, pdf_path, pool, cache, key, name).add_done_callback(finish)
+    return result
+
+
+def submit_pdf(data, output_path, template, pool=None, cache=None):
+    """Queue a PDF export on the converter pool and return its Future."""
+    key = pdf_cache_key(data, template, cache)
+    if copy_cached(cache, key, output_path) is not None:
+        future = Future()
+        future.set_result(output_path)
+        return future
+    return submit_docx(cached_render(data, template, cache), output_path, pool, cache, key)
+
+
+def save_pdf(data, output_path, template, pool=None, cache=None):
+    submit_pdf(data, output_path, template, pool, cache).result()
@@ -0,0 +1,295 @@
+import array
+import os
+import struct
+import sys
+import threading
+
+# Candidate fonts for the native PDF renderer, closest to the template's look first
+FONT_CANDIDATES = {
+    'regular': [
+        r'C:\Windows\Fonts\arial.ttf',
+        '/Library/Fonts/Arial.ttf',
+        '/System/Library/Fonts/Supplemental/Arial.ttf',
+        '/usr/share/fonts/truetype/msttcorefonts/Arial.ttf',
+        '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    ],
+    'bold': [
+        r'C:\Windows\Fonts\arialbd.ttf',
+        '/Library/Fonts/Arial Bold.ttf',
+        '/System/Library/Fonts/Supplemental/Arial Bold.ttf',
+        '/usr/share/fonts/truetype/msttcorefonts/Arial_Bold.ttf',
+        '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
+        '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    ],
+}
+
+# Tables a PDF viewer needs from an embedded TrueType program
+SUBSET_TABLES = ['head', 'hhea', 'maxp', 'hmtx', 'loca', 'glyf', 'cvt ', 'fpgm', 'prep']
+
+# Composite glyph flags
+ARG_1_AND_2_ARE_WORDS = 0x0001
+WE_HAVE_A_SCALE = 0x0008
+MORE_COMPONENTS = 0x0020
+WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+
+def find_font(style='regular'):
+    for path in FONT_CANDIDATES[style]:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No TrueType font found for {style} text; pass a font path explicitly")
+
+
+def _checksum(data):
+    words = array.array('I', data + b'\0' * (-len(data) % 4))
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return sum(words) & 0xFFFFFFFF
+
+
+class TrueTypeFont:
+    """Metrics, character map and glyph subsetting for one .ttf file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        version = self.data[:4]
+        if version not in (b'\0\1\0\0', b'true'):
+            raise ValueError(f"{path} is not a TrueType (glyf) font")
+
+        num_tables = struct.unpack('>H', self.data[4:6])[0]
+        self.tables = {}
+        for i in range(num_tables):
+            tag, _, offset, length = struct.unpack('>4sIII', self.data[12 + 16 * i:28 + 16 * i])
+            self.tables[tag.decode('latin-1')] = (offset, length)
+
+        head = self.table('head')
+        self.units_per_em = struct.unpack('>H', head[18:20])[0]
+        self.bbox = struct.unpack('>hhhh', head[36:44])
+        long_loca = struct.unpack('>h', head[50:52])[0] == 1
+
+        hhea = self.table('hhea')
+        self.ascent, self.descent = struct.unpack('>hh', hhea[4:8])
+        num_hmetrics = self.num_hmetrics = struct.unpack('>H', hhea[34:36])[0]
+        self.num_glyphs = struct.unpack('>H', self.table('maxp')[4:6])[0]
+
+        hmtx = self.table('hmtx')
+        advances = [struct.unpack('>H', hmtx[4 * i:4 * i + 2])[0] for i in range(num_hmetrics)]
+        advances += [advances[-1]] * (self.num_glyphs - num_hmetrics)
+        self.advances = advances
+
+        loca = self.table('loca')
+        if long_loca:
+            self.loca = struct.unpack(f'>{self.num_glyphs + 1}I', loca[:4 * (self.num_glyphs + 1)])
+        else:
+            self.loca = [2 * x for x in struct.unpack(f'>{self.num_glyphs + 1}H',
+                                                      loca[:2 * (self.num_glyphs + 1)])]
+
+        self.cap_height = self.ascent
+        if 'OS/2' in self.tables:
+            os2 = self.table('OS/2')
+            if struct.unpack('>H', os2[:2])[0] >= 2 and len(os2) >= 90:
+                self.cap_height = struct.unpack('>h', os2[88:90])[0]
+        self.italic_angle = 0
+        if 'post' in self.tables:
+            self.italic_angle = struct.unpack('>i', self.table('post')[4:8])[0] / 65536
+
+        self.cmap = self._read_cmap()
+        self.ps_name = self._read_ps_name()
+        self._subsets = {}
+        self._lock = threading.Lock()
+
+    def table(self, tag):
+        offset, length = self.tables[tag]
+        return self.data[offset:offset + length]
+
+    def _read_cmap(self):
+        cmap = self.table('cmap')
+        count = struct.unpack('>H', cmap[2:4])[0]
+        subtables = {}
+        for i in range(count):
+            platform, encoding, offset = struct.unpack('>HHI', cmap[4 + 8 * i:12 + 8 * i])
+            subtables[(platform, encoding)] = offset
+
+        for key in [(3, 10), (0, 4), (3, 1), (0, 3)]:
+            if key in subtables:
+                offset = subtables[key]
+                fmt = struct.unpack('>H', cmap[offset:offset + 2])[0]
+                if fmt == 12:
+                    return self._cmap_format12(cmap, offset)
+                if fmt == 4:
+                    return self._cmap_format4(cmap, offset)
+        raise ValueError(f"{self.path} has no Unicode character map")
+
+    @staticmethod
+    def _cmap_format4(cmap, offset):
+        seg_count = struct.unpack('>H', cmap[offset + 6:offset + 8])[0] // 2
+        ends = struct.unpack(f'>{seg_count}H', cmap[offset + 14:offset + 14 + 2 * seg_count])
+        pos = offset + 16 + 2 * seg_count
+        starts = struct.unpack(f'>{seg_count}H', cmap[pos:pos + 2 * seg_count])
+        pos += 2 * seg_count
+        deltas = struct.unpack(f'>{seg_count}h', cmap[pos:pos + 2 * seg_count])
+        pos += 2 * seg_count
+        range_offsets = struct.unpack(f'>{seg_count}H', cmap[pos:pos + 2 * seg_count])
+
+        mapping = {}
+        for i in range(seg_count):
+            for code in range(starts[i], ends[i] + 1):
+                if code == 0xFFFF:
+                    break
+                if range_offsets[i] == 0:
+                    gid = (code + deltas[i]) & 0xFFFF
+                else:
+                    addr = pos + 2 * i + range_offsets[i] + 2 * (code - starts[i])
+                    gid = struct.unpack('>H', cmap[addr:addr + 2])[0]
+                    if gid:
+                        gid = (gid + deltas[i]) & 0xFFFF
+                if gid:
+                    mapping[code] = gid
+        return mapping
+
+    @staticmethod
+    def _cmap_format12(cmap, offset):
+        groups = struct.unpack('>I', cmap[offset + 12:offset + 16])[0]
+        mapping = {}
+        for i in range(groups):
+            start, end, gid = struct.unpack('>III', cmap[offset + 16 + 12 * i:offset + 28 + 12 * i])
+            for code in range(start, end + 1):
+                mapping[code] = gid + code - start
+        return mapping
+
+    def _read_ps_name(self):
+        if 'name' in self.tables:
+            name = self.table('name')
+            count, string_offset = struct.unpack('>HH', name[2:6])
+            for i in range(count):
+                platform, encoding, _, name_id, length, offset = struct.unpack(
+                    '>HHHHHH', name[6 + 12 * i:18 + 12 * i])
+                if name_id != 6:
+                    continue
+                raw = name[string_offset + offset:string_offset + offset + length]
+                text = raw.decode('utf-16-be' if platform in (0, 3) else 'latin-1', 'ignore')
+                if text:
+                    return ''.join(c for c in text if c.isalnum() or c in '-_')
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    def glyph_ids(self, text):
+        cmap = self.cmap
+        return [cmap.get(ord(c), 0) for c in text]
+
+    def text_width(self, text, size):
+        advances = self.advances
+        return sum(advances[g] for g in self.glyph_ids(text)) * size / self.units_per_em
+
+    def glyph(self, gid):
+        base = self.tables['glyf'][0]
+        return self.data[base + self.loca[gid]:base + self.loca[gid + 1]]
+
+    def _components(self, glyph):
+        pos = 10
+        while True:
+            flags, gid = struct.unpack('>HH', glyph[pos:pos + 4])
+            yield gid
+            pos += 4 + (4 if flags & ARG_1_AND_2_ARE_WORDS else 2)
+            if flags & WE_HAVE_A_SCALE:
+                pos += 2
+            elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+                pos += 4
+            elif flags & WE_HAVE_A_TWO_BY_TWO:
+                pos += 8
+            if not flags & MORE_COMPONENTS:
+                return
+
+    def subset(self, gids):
+        """Return a font program holding only the given glyphs (plus their components).
+
+        Glyph ids are kept as they are (unused glyphs are emptied and those
+        past the highest one kept are dropped), so the PDF can address glyphs
+        with an identity CID-to-GID map.
+        """
+        key = frozenset(gids)
+        with self._lock:
+            if key in self._subsets:
+                return self._subsets[key]
+
+        keep = set(gids) | {0}
+        stack = list(keep)
+        while stack:
+            glyph = self.glyph(stack.pop())
+            if len(glyph) > 10 and struct.unpack('>h', glyph[:2])[0] < 0:
+                for component in self._components(glyph):
+                    if component not in keep:
+                        keep.add(component)
+                        stack.append(component)
+
+        glyf = bytearray()
+        offsets = []
+        for gid in sorted(keep):
+            # Dropped glyphs become zero-length entries in loca
+            offsets.extend([len(glyf)] * (gid + 1 - len(offsets)))
+            glyf += self.glyph(gid)
+            glyf += b'\0' * (-len(glyf) % 4)
+        offsets.append(len(glyf))
+
+        # Glyphs past the highest one kept are cut off entirely
+        count = len(offsets) - 1
+        hmetrics = min(self.num_hmetrics, count)
+        hmtx = self.table('hmtx')
+        hmtx = hmtx[:4 * hmetrics] + hmtx[4 * hmetrics:4 * hmetrics + 2 * (count - hmetrics)]
+
+        head = bytearray(self.table('head'))
+        head[8:12] = b'\0\0\0\0'
+        head[50:52] = struct.pack('>h', 1)
+        hhea = bytearray(self.table('hhea'))
+        hhea[34:36] = struct.pack('>H', hmetrics)
+        maxp = bytearray(self.table('maxp'))
+        maxp[4:6] = struct.pack('>H', count)
+        tables = {tag: self.table(tag) for tag in SUBSET_TABLES if tag in self.tables}
+        tables.update(head=bytes(head), hhea=bytes(hhea), maxp=bytes(maxp), hmtx=hmtx, glyf=bytes(glyf),
+                      loca=struct.pack(f'>{len(offsets)}I', *offsets))
+
+        font = bytearray(self._build_sfnt(tables))
+        head_offset = font.find(tables['head'])
+        adjustment = (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF
+        font[head_offset + 8:head_offset + 12] = struct.pack('>I', adjustment)
+        font = bytes(font)
+
+        with self._lock:
+            if len(self._subsets) > 256:
+                self._subsets.clear()
+            self._subsets[key] = font
+        return font
+
+    @staticmethod
+    def _build_sfnt(tables):
+        tags = sorted(tables)
+        count = len(tags)
+        selector = count.bit_length() - 1
+        search_range = (1 << selector) * 16
+        header = struct.pack('>4sHHHH', b'\0\1\0\0', count, search_range, selector,
+                             count * 16 - search_range)
+        directory = bytearray()
+        body = bytearray()
+        offset = 12 + 16 * count
+        for tag in tags:
+            data = tables[tag]
+            directory += struct.pack('>4sIII', tag.encode('latin-1'), _checksum(data),
+                                     offset + len(body), len(data))
+            body += data + b'\0' * (-len(data) % 4)
+        return header + bytes(directory) + bytes(body)
+
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+def load_font(path):
+    """Parsed fonts are cached for the life of the process."""
+    with _fonts_lock:
+        font = _fonts.get(path)
+        if font is None:
+            font = _fonts[path] = TrueTypeFont(path)
+        return font
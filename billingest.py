@@ -0,0 +1,267 @@
+import csv
+import datetime
+import json
+import os
+import posixpath
+import re
+import zipfile
+from xml.parsers import expat
+
+# Unnumbered item columns mark a row as one line item; the bill it belongs to is its BILLNUMBER
+ITEM_COLUMNS = ('description', 'quantity', 'price')
+
+CHUNK_SIZE = 64 * 1024
+
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+S_ROW = SHEET_NS + ' row'
+S_C = SHEET_NS + ' c'
+S_V = SHEET_NS + ' v'
+S_T = SHEET_NS + ' t'
+S_SI = SHEET_NS + ' si'
+S_RPH = SHEET_NS + ' rPh'
+# Built-in number formats that show a date (and maybe a time)
+DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+# Literal text, colours and conditions in a custom format; what is left shows a date if it has d/y
+FORMAT_NOISE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+CELL_COLUMN = re.compile(r'[A-Z]+')
+
+
+def read_records(input_path):
+    """Yield one bill per record of a .csv, .jsonl or .xlsx file, in one pass and without loading it."""
+    return group_bills(read_rows(input_path))
+
+
+def read_rows(input_path):
+    """Yield one dict per row (CSV, XLSX) or line (JSONL), reading the file as it goes."""
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext == '.xlsx':
+        yield from read_xlsx(input_path)
+        return
+    with open(input_path, newline='', encoding='utf-8') as f:
+        if ext == '.csv':
+            yield from csv.DictReader(f)
+        elif ext in ('.jsonl', '.ndjson'):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        raise ValueError(f"{os.path.basename(input_path)} line {number}: {e}") from None
+        else:
+            raise ValueError(f"Unsupported input format: {ext}")
+
+
+def group_bills(rows):
+    """Collect line-item rows into bills; rows that are whole bills pass through.
+
+    A row with unnumbered description/quantity/price columns is one line
+    item, and consecutive item rows with the same BILLNUMBER are one bill,
+    with the other columns taken from its first row. Exports list a bill's
+    rows together, so only the bill being collected is held in memory; a
+    number that comes back after other bills starts a new bill.
+    """
+    bill = None
+    for number, row in enumerate(rows, 1):
+        if 'items' in row or not any(column in row for column in ITEM_COLUMNS):
+            if bill is not None:
+                yield bill
+                bill = None
+            yield row
+            continue
+        key = str(row.get('BILLNUMBER') or '').strip()
+        if not key:
+            raise ValueError(f"row {number}: line item without a BILLNUMBER")
+        if bill is None or bill['BILLNUMBER'] != key:
+            if bill is not None:
+                yield bill
+            bill = {name: value for name, value in row.items() if name not in ITEM_COLUMNS}
+            bill['BILLNUMBER'] = key
+            bill['items'] = []
+        bill['items'].append({column: row.get(column) or '' for column in ITEM_COLUMNS})
+    if bill is not None:
+        yield bill
+
+
+def _parse(data, start, end=None, chars=None):
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.StartElementHandler = start
+    if end is not None:
+        parser.EndElementHandler = end
+    if chars is not None:
+        parser.CharacterDataHandler = chars
+        parser.buffer_text = True
+    parser.Parse(data, True)
+
+
+def _first_sheet(z):
+    """Path in the zip of the workbook's first worksheet, and of its shared strings and styles."""
+    sheets, targets = [], {}
+
+    def workbook(name, attrs):
+        if name == SHEET_NS + ' sheet':
+            sheets.append(attrs.get(REL_NS + ' id'))
+
+    def rels(name, attrs):
+        if name == PACKAGE_REL_NS + ' Relationship':
+            target = attrs['Target']
+            target = target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+            targets[attrs['Id']] = target
+            targets[attrs['Type'].rsplit('/', 1)[-1]] = target
+
+    _parse(z.read('xl/workbook.xml'), workbook)
+    _parse(z.read('xl/_rels/workbook.xml.rels'), rels)
+    if not sheets:
+        raise ValueError("The workbook has no sheets")
+    return targets[sheets[0]], targets.get('sharedStrings'), targets.get('styles')
+
+
+def _shared_strings(z, path):
+    strings, parts = [], []
+    depth = {'text': False, 'phonetic': 0}
+
+    def start(name, attrs):
+        if name == S_RPH:
+            depth['phonetic'] += 1
+        elif name == S_T:
+            depth['text'] = not depth['phonetic']
+
+    def end(name):
+        if name == S_SI:
+            strings.append(''.join(parts))
+            parts.clear()
+        elif name == S_RPH:
+            depth['phonetic'] -= 1
+        elif name == S_T:
+            depth['text'] = False
+
+    def chars(data):
+        if depth['text']:
+            parts.append(data)
+
+    if path and path in z.namelist():
+        _parse(z.read(path), start, end, chars)
+    return strings
+
+
+def _date_styles(z, path):
+    """Indexes of the cell styles that show numbers as dates."""
+    custom, formats = {}, []
+    in_xfs = []
+
+    def start(name, attrs):
+        if name == SHEET_NS + ' numFmt':
+            code = FORMAT_NOISE.sub('', attrs.get('formatCode', '')).lower()
+            custom[int(attrs['numFmtId'])] = 'd' in code or 'y' in code
+        elif name == SHEET_NS + ' cellXfs':
+            in_xfs.append(True)
+        elif name == SHEET_NS + ' xf' and in_xfs:
+            formats.append(int(attrs.get('numFmtId', 0)))
+
+    def end(name):
+        if name == SHEET_NS + ' cellXfs':
+            in_xfs.clear()
+
+    if path and path in z.namelist():
+        _parse(z.read(path), start, end)
+    return {index for index, fmt in enumerate(formats) if custom.get(fmt, fmt in DATE_FORMATS)}
+
+
+def excel_date(serial):
+    moment = EXCEL_EPOCH + datetime.timedelta(days=float(serial))
+    if moment.time() == datetime.time():
+        return moment.date().isoformat()
+    return moment.isoformat(sep=' ', timespec='seconds')
+
+
+def column_index(reference):
+    index = 0
+    for letter in CELL_COLUMN.match(reference).group():
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+class _SheetReader:
+    """Streams a worksheet's rows as lists of cell text with expat, a chunk of the file at a time."""
+
+    def __init__(self, strings, date_styles):
+        self.strings = strings
+        self.date_styles = date_styles
+        self.rows = []
+        self.row = None
+        self.cell = None
+        self.value = ''
+        self.text = None
+        self.parser = expat.ParserCreate(namespace_separator=' ')
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.chars
+        self.parser.buffer_text = True
+
+    def start(self, name, attrs):
+        if name == S_ROW:
+            self.row = []
+        elif name == S_C:
+            reference = attrs.get('r')
+            self.cell = (column_index(reference) if reference else len(self.row), attrs.get('t', 'n'),
+                         int(attrs.get('s', 0)))
+            self.value = ''
+        elif (name == S_V or name == S_T) and self.cell is not None:
+            self.text = []
+
+    def end(self, name):
+        if (name == S_V or name == S_T) and self.text is not None:
+            self.value += ''.join(self.text)
+            self.text = None
+        elif name == S_C:
+            column, kind, style = self.cell
+            value = self.value
+            if kind == 's':
+                value = self.strings[int(value)]
+            elif kind == 'b':
+                value = 'TRUE' if value == '1' else 'FALSE'
+            elif kind == 'n' and value and style in self.date_styles:
+                value = excel_date(value)
+            self.row.extend([''] * (column - len(self.row)))
+            self.row.append(value)
+            self.cell = None
+        elif name == S_ROW:
+            self.rows.append(self.row)
+            self.row = None
+
+    def chars(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def read(self, stream):
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            self.parser.Parse(data, not data)
+            rows, self.rows = self.rows, []
+            yield from rows
+            if not data:
+                return
+
+
+def read_xlsx(input_path):
+    """Yield the first worksheet's rows as dicts keyed by its first row.
+
+    Only the shared strings table is loaded whole; the sheet is parsed as it
+    is decompressed. Numbers keep the digits Excel stored, and cells shown
+    as dates come out as ISO dates.
+    """
+    with zipfile.ZipFile(input_path) as z:
+        sheet, strings_path, styles_path = _first_sheet(z)
+        reader = _SheetReader(_shared_strings(z, strings_path), _date_styles(z, styles_path))
+        header = None
+        with z.open(sheet) as stream:
+            for cells in reader.read(stream):
+                if header is None:
+                    header = [name.strip() for name in cells]
+                    continue
+                if not any(cells):
+                    continue
+                cells.extend([''] * (len(header) - len(cells)))
+                yield {name: value for name, value in zip(header, cells) if name}
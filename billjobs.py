@@ -0,0 +1,88 @@
+import itertools
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+import billcache
+import billcore
+import billtrace
+
+# How often a job waiting on the PDF converter checks for cancellation (seconds)
+POLL_INTERVAL = 0.2
+
+_job_ids = itertools.count(1)
+
+
+class ExportSignals(QObject):
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(int, str)
+    failed = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+
+
+def _discard(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class ExportJob(QRunnable):
+    """One bill export, run on a QThreadPool worker so the window never blocks on it."""
+
+    def __init__(self, data, output_path, export_pdf, pdf_engine='convert', session=None):
+        super().__init__()
+        # The window keeps its own reference so a queued job can still be cancelled
+        self.setAutoDelete(False)
+        self.job_id = next(_job_ids)
+        self.data = data
+        self.output_path = output_path
+        self.export_pdf = export_pdf
+        self.pdf_engine = pdf_engine
+        # Renders Word output incrementally when the window passes its BillSession
+        self.session = session
+        self.signals = ExportSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        if self.is_cancelled():
+            self.signals.cancelled.emit(self.job_id)
+            return
+        engine = self.pdf_engine if self.export_pdf else 'docx'
+        with billtrace.job('export', output=os.path.basename(self.output_path), engine=engine):
+            self._run()
+
+    def _run(self):
+        try:
+            self.signals.progress.emit(self.job_id, "Rendering")
+            cache = billcache.get_cache()
+            if self.export_pdf and self.pdf_engine == 'native':
+                billcore.save_output(self.data, self.output_path, billcore.load_pdf_renderer(), cache)
+            elif self.export_pdf:
+                future = billcore.submit_pdf(self.data, self.output_path,
+                                             self.session or billcore.load_template(), cache=cache)
+                self.signals.progress.emit(self.job_id, "Converting to PDF")
+                while True:
+                    try:
+                        future.result(POLL_INTERVAL)
+                        break
+                    except FutureTimeout:
+                        if self.is_cancelled():
+                            if not future.cancel():
+                                # Already on a converter; drop the file once it lands
+                                future.add_done_callback(lambda _: _discard(self.output_path))
+                            self.signals.cancelled.emit(self.job_id)
+                            return
+            else:
+                billcore.save_output(self.data, self.output_path, self.session or billcore.load_template(),
+                                     cache)
+        except Exception as e:
+            self.signals.failed.emit(self.job_id, str(e))
+            return
+        self.signals.finished.emit(self.job_id, self.output_path)
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+
+# Kept in the batch's output directory, next to the bills it lists
+JOURNAL_NAME = '.billmaker-journal.jsonl'
+
+
+def digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def bill_key(index, record):
+    """What a record is known by across runs: its BILLNUMBER, or its place in the input without one."""
+    return str(record.get('BILLNUMBER') or '').strip() or f'#{index}'
+
+
+class BatchJournal:
+    """The bills a batch run has finished, one JSON line each, appended as they land.
+
+    A line is written only once its bill is on disk in full under its final
+    name, so every bill the journal lists is complete; a run killed
+    mid-line leaves a torn last line, which is ignored. Lines are
+    ``{"bill": key, "file": name, "sha256": hex}``, key being bill_key's.
+
+    With ``resume`` the journal of an earlier run is read into a dict and
+    extended, so finished() costs one lookup and one stat per record;
+    otherwise it starts empty.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.files = {}
+        torn = self.load(path) if resume else False
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if torn:
+            # Start after the line the crash cut short, not on the end of it
+            self.file.write('\n')
+
+    def load(self, path):
+        """Read an earlier run's journal; True if its last line was cut short."""
+        line = '\n'
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.files[entry['bill']] = entry['file']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return not line.endswith('\n')
+
+    def finished(self, key):
+        # The rename of a bill written just before a power cut may not have reached the disk
+        name = self.files.get(key)
+        return name is not None and os.path.exists(os.path.join(self.directory, name))
+
+    def add(self, key, name, sha256):
+        self.files[key] = name
+        # Flushed per bill so a crash loses none; each bill was synced before its line
+        self.file.write(json.dumps({'bill': key, 'file': name, 'sha256': sha256}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -1,21 +1,37 @@
-import sys
 import os
+import sqlite3
+import sys
+import threading
+from PyQt6.QtCore import Qt, QThreadPool, QStringListModel, QTimer
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QLineEdit, QPushButton, QTableWidget, 
-                             QHeaderView, QFileDialog, QMessageBox)
-from docx import Document
-from docx2pdf import convert
+                             QHeaderView, QFileDialog, QMessageBox, QComboBox,
+                             QListWidget, QListWidgetItem, QCompleter, QInputDialog,
+                             QTableWidgetItem, QSplitter)
+import billcore
+import billmoney
+import billpreview
+import billstore
+import billtrace
+from billjobs import ExportJob
 
-def resource_path(relative_path):
-    try:
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
+# Time after the window is shown before python-docx, the template and fonts start loading (ms)
+PREWARM_DELAY_MS = 100
 
 class AstaEpsilonBilling(QWidget):
     def __init__(self):
         super().__init__()
+        # Exports run here so the window stays responsive while bills render
+        self.pool = QThreadPool()
+        self.jobs = {}
+        # Issued bills are kept so they can be reopened; the app still works without it
+        try:
+            self.store = billstore.InvoiceStore()
+        except (OSError, sqlite3.Error):
+            self.store = None
+        self.client_addresses = {}
+        # Keeps the last exported bill rendered so re-exports after an edit only patch it
+        self.session = billcore.BillSession()
         self.initUI()
 
     def initUI(self):
@@ -30,7 +46,10 @@ class AstaEpsilonBilling(QWidget):
             ('Client Address', 'CLIENTADDRESS'),
             ('Bill Number', 'BILLNUMBER'),
             ('Bill Date', 'BILLDATE'),
-            ('Due Date', 'DUEDATE')
+            ('Due Date', 'DUEDATE'),
+            ('Currency', 'CURRENCY'),
+            ('Discount', 'DISCOUNT'),
+            ('Tax', 'TAX')
         ]
 
         for label_text, keyword in fields:
@@ -39,19 +58,40 @@ class AstaEpsilonBilling(QWidget):
             lbl.setFixedWidth(120)
             row.addWidget(lbl)
             self.inputs[keyword] = QLineEdit()
+            self.inputs[keyword].textChanged.connect(self.refresh_preview)
             row.addWidget(self.inputs[keyword])
             main_layout.addLayout(row)
+        self.inputs['CURRENCY'].setPlaceholderText(billmoney.default_currency())
+        self.inputs['DISCOUNT'].setPlaceholderText("e.g. 10% or 500")
+        self.inputs['TAX'].setPlaceholderText("e.g. GST 18% or CGST 9%; SGST 9%")
+
+        if self.store is not None:
+            self.client_model = QStringListModel()
+            completer = QCompleter(self.client_model, self)
+            completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+            completer.activated.connect(self.client_chosen)
+            self.inputs['CLIENTNAME'].setCompleter(completer)
+            self.inputs['CLIENTNAME'].textEdited.connect(self.suggest_clients)
+            self.show_next_bill_number()
 
         main_layout.addWidget(QLabel("\nService Details:"))
-        self.table = QTableWidget(3, 3)
+        self.table = QTableWidget(billcore.ITEM_ROWS, 3)
         self.table.setHorizontalHeaderLabels(['Description', 'Quantity', 'Unit Price'])
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        # A blank row is always kept at the bottom so any number of items can be entered
+        self.table.cellChanged.connect(self.grow_table)
+        self.table.cellChanged.connect(self.refresh_preview)
         main_layout.addWidget(self.table)
 
         btn_layout = QHBoxLayout()
         self.btn_docx = QPushButton('Export Word (.docx)')
         self.btn_pdf = QPushButton('Export PDF (.pdf)')
         self.btn_clear = QPushButton('Clear Form')
+        self.btn_open = QPushButton('Open Bill...')
+        self.btn_open.setEnabled(self.store is not None)
+        self.pdf_engine = QComboBox()
+        self.pdf_engine.addItem('PDF via Word/LibreOffice', 'convert')
+        self.pdf_engine.addItem('PDF via built-in renderer', 'native')
         
         self.btn_pdf.setStyleSheet("background-color: #008CBA; color: white; font-weight: bold; padding: 8px;")
         self.btn_clear.setStyleSheet("background-color: #f44336; color: white; padding: 8px;")
@@ -59,91 +99,195 @@ class AstaEpsilonBilling(QWidget):
         self.btn_docx.clicked.connect(lambda: self.process_bill(export_pdf=False))
         self.btn_pdf.clicked.connect(lambda: self.process_bill(export_pdf=True))
         self.btn_clear.clicked.connect(self.clear_form)
+        self.btn_open.clicked.connect(self.open_bill)
         
         btn_layout.addWidget(self.btn_docx)
         btn_layout.addWidget(self.btn_pdf)
+        btn_layout.addWidget(self.pdf_engine)
+        btn_layout.addWidget(self.btn_open)
         btn_layout.addWidget(self.btn_clear)
         main_layout.addLayout(btn_layout)
-        self.setLayout(main_layout)
+
+        main_layout.addWidget(QLabel("Export Queue:"))
+        self.queue_list = QListWidget()
+        self.queue_list.setMaximumHeight(120)
+        main_layout.addWidget(self.queue_list)
+        self.btn_cancel = QPushButton('Cancel Selected Export')
+        self.btn_cancel.clicked.connect(self.cancel_selected)
+        main_layout.addWidget(self.btn_cancel)
+
+        # The form on the left, a live preview of the bill on the right
+        form = QWidget()
+        form.setLayout(main_layout)
+        self.preview = billpreview.PreviewPane(self.preview_data)
+        splitter = QSplitter()
+        splitter.addWidget(form)
+        splitter.addWidget(self.preview)
+        splitter.setSizes([700, 420])
+        outer = QHBoxLayout()
+        outer.addWidget(splitter)
+        self.setLayout(outer)
+        self.refresh_preview()
 
     def clear_form(self):
         for field in self.inputs.values(): field.clear()
         self.table.clearContents()
+        self.table.setRowCount(billcore.ITEM_ROWS)
+        self.refresh_preview()
 
-    def process_bill(self, export_pdf):
-        data = {key: field.text() for key, field in self.inputs.items()}
-        grand_total = 0
+    def suggest_clients(self, text):
+        matches = self.store.find_clients(text)
+        self.client_addresses = dict(matches)
+        self.client_model.setStringList([name for name, _ in matches])
+
+    def client_chosen(self, name):
+        if name in self.client_addresses:
+            self.inputs['CLIENTADDRESS'].setText(self.client_addresses[name])
+
+    def show_next_bill_number(self):
+        self.inputs['BILLNUMBER'].setPlaceholderText(f"Automatic ({self.store.next_bill_number()})")
+
+    def open_bill(self):
+        number, ok = QInputDialog.getText(self, "Open Bill", "Bill Number:")
+        if not ok or not number.strip():
+            return
+        bill = self.store.get_invoice(number)
+        if bill is None:
+            QMessageBox.warning(self, "Open Bill", f"No stored bill {number.strip()}.")
+            return
+        fields, items = bill
+        self.clear_form()
+        for key, field in self.inputs.items():
+            field.setText(fields.get(key, ""))
+        self.table.setRowCount(max(billcore.ITEM_ROWS, len(items) + 1))
+        for i, item in enumerate(items):
+            for c, text in enumerate(item):
+                self.table.setItem(i, c, QTableWidgetItem(text))
+
+    def grow_table(self, row, column):
+        item = self.table.item(row, column)
+        if row == self.table.rowCount() - 1 and item and item.text():
+            self.table.insertRow(self.table.rowCount())
+
+    def refresh_preview(self, *args):
+        # Typing only restarts the preview's debounce timer
+        if hasattr(self, 'preview'):
+            self.preview.schedule()
+
+    def preview_data(self):
+        return billcore.build_bill_data(*self.collect_bill())
 
-        for i in range(3):
+    def collect_bill(self):
+        fields = {key: field.text() for key, field in self.inputs.items()}
+        items = []
+        for i in range(self.table.rowCount()):
+            if i >= billcore.ITEM_ROWS and not any(
+                    self.table.item(i, c) and self.table.item(i, c).text() for c in range(3)):
+                continue
             desc = self.table.item(i, 0).text() if self.table.item(i, 0) else ""
             qty_val = self.table.item(i, 1).text() if self.table.item(i, 1) else "0"
             price_val = self.table.item(i, 2).text() if self.table.item(i, 2) else "0"
+            items.append((desc, qty_val, price_val))
+        return fields, items
 
-            try:
-                qty = float(qty_val)
-                price = float(price_val)
-                line_total = qty * price
-                grand_total += line_total
-                
-                # Service table keywords
-                data[f"description{i+1}"] = desc
-                data[f"quantity{i+1}"] = str(qty)
-                data[f"amount{i+1}"] = f"{line_total:,.2f}"
-            except ValueError:
-                data[f"description{i+1}"] = desc
-                data[f"quantity{i+1}"] = ""
-                data[f"amount{i+1}"] = ""
-
-        # Use "TOTAL" as the keyword for the white-text footer
-        data["TOTAL"] = f"{grand_total:,.2f}"
-        self.save_document(data, export_pdf)
-
-    def save_document(self, data, export_pdf):
-        template_name = "Bill Format.docx"
-        template_path = resource_path(template_name)
-        
-        if not os.path.exists(template_path):
+    def process_bill(self, export_pdf):
+        fields, items = self.collect_bill()
+        self.save_document(fields, items, export_pdf)
+
+    def save_document(self, fields, items, export_pdf):
+        try:
+            billcore.load_template()
+        except FileNotFoundError:
             QMessageBox.critical(self, "Error", "Template not found.")
             return
+        try:
+            data = billcore.build_bill_data(fields, items)
+        except billmoney.MoneyError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
 
         file_filter = "PDF Files (*.pdf)" if export_pdf else "Word Files (*.docx)"
         output_path, _ = QFileDialog.getSaveFileName(self, "Save Bill", "", file_filter)
         
         if output_path:
-            try:
-                doc = Document(template_path)
-                
-                def replace_logic(paragraphs):
-                    for p in paragraphs:
-                        for key, val in data.items():
-                            if key in p.text:
-                                # Replace at run-level to preserve the WHITE font color
-                                for run in p.runs:
-                                    if key in run.text:
-                                        run.text = run.text.replace(key, str(val))
-
-                replace_logic(doc.paragraphs)
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            replace_logic(cell.paragraphs)
-
-                temp_docx = "temp_render.docx"
-                doc.save(temp_docx)
-
-                if export_pdf:
-                    convert(temp_docx, output_path)
-                    os.remove(temp_docx)
+            if self.store is not None:
+                try:
+                    number = self.store.save_invoice(fields, items, data['TOTAL'])
+                except sqlite3.Error as e:
+                    QMessageBox.warning(self, "Warning", f"Bill was not saved to the invoice store: {e}")
                 else:
-                    if os.path.exists(output_path): os.remove(output_path)
-                    os.rename(temp_docx, output_path)
+                    data['BILLNUMBER'] = number
+                    self.inputs['BILLNUMBER'].setText(number)
+                    self.show_next_bill_number()
+
+            engine = self.pdf_engine.currentData()
+            job = ExportJob(data, output_path, export_pdf, engine, self.session)
+            job.signals.progress.connect(self.job_progress)
+            job.signals.finished.connect(self.job_finished)
+            job.signals.failed.connect(self.job_failed)
+            job.signals.cancelled.connect(self.job_cancelled)
+
+            item = QListWidgetItem()
+            item.setData(Qt.ItemDataRole.UserRole, job.job_id)
+            self.queue_list.addItem(item)
+            self.jobs[job.job_id] = (job, item)
+            self.set_job_status(job.job_id, "Queued")
+            self.pool.start(job)
+
+    def set_job_status(self, job_id, status):
+        job, item = self.jobs[job_id]
+        item.setText(f"#{job_id}  {os.path.basename(job.output_path)}  -  {status}")
 
-                QMessageBox.information(self, "Success", "Bill generated successfully!")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed: {str(e)}")
+    def job_progress(self, job_id, stage):
+        self.set_job_status(job_id, stage + "...")
+
+    def job_finished(self, job_id, output_path):
+        self.set_job_status(job_id, "Done")
+
+    def job_failed(self, job_id, message):
+        self.set_job_status(job_id, "Failed")
+        QMessageBox.critical(self, "Error", f"Failed: {message}")
+
+    def job_cancelled(self, job_id):
+        self.set_job_status(job_id, "Cancelled")
+
+    def cancel_selected(self):
+        for item in self.queue_list.selectedItems():
+            job, _ = self.jobs[item.data(Qt.ItemDataRole.UserRole)]
+            job.cancel()
+            # Jobs still waiting for a worker are pulled off the pool straight away
+            if self.pool.tryTake(job):
+                self.job_cancelled(job.job_id)
+
+    def closeEvent(self, event):
+        self.preview.shutdown()
+        for job, _ in self.jobs.values():
+            job.cancel()
+        self.pool.clear()
+        self.pool.waitForDone()
+        if self.store is not None:
+            self.store.close()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
+    # Batch workers re-enter this script when the app is frozen into an executable
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+    if sys.argv[1:2] == ['batch']:
+        import billbatch
+        sys.exit(billbatch.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        import billserve
+        sys.exit(billserve.main(sys.argv[2:]))
+
+    try:
+        billtrace.configure_from_env()
+    except ValueError as e:
+        sys.exit(f"billmaker: {e}")
     app = QApplication(sys.argv)
     window = AstaEpsilonBilling()
     window.show()
+    # Rendering libraries load behind the first paint rather than in front of it
+    QTimer.singleShot(PREWARM_DELAY_MS, lambda: threading.Thread(target=billcore.prewarm, daemon=True).start())
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,207 @@
+import decimal
+import os
+import re
+from array import array
+from decimal import Decimal
+from itertools import repeat
+from operator import mul
+
+# Per-currency rules: digits after the decimal point, how half a minor unit rounds, and the
+# smallest step the bill total is rounded to, in minor units (Swiss francs are paid in 0.05s)
+CURRENCIES = {
+    'INR': (2, decimal.ROUND_HALF_UP, 1),
+    'USD': (2, decimal.ROUND_HALF_UP, 1),
+    'GBP': (2, decimal.ROUND_HALF_UP, 1),
+    'EUR': (2, decimal.ROUND_HALF_EVEN, 1),
+    'CHF': (2, decimal.ROUND_HALF_UP, 5),
+    'JPY': (0, decimal.ROUND_HALF_UP, 1),
+    'KWD': (3, decimal.ROUND_HALF_UP, 1),
+}
+DEFAULT_CURRENCY = 'INR'
+# Typed amounts must stay below 10 ** MAX_DIGITS, so that every product, tax and total
+# worked out from them fits CONTEXT's precision and never overflows it
+MAX_DIGITS = 15
+MAX_WHOLE = 10 ** MAX_DIGITS
+# Bad cells listed in full in an error message; the rest are only counted
+SHOWN_PROBLEMS = 5
+
+# Wide enough that no product of two typed amounts is ever rounded by the context
+CONTEXT = decimal.Context(prec=60, rounding=decimal.ROUND_HALF_EVEN,
+                          traps=[decimal.InvalidOperation, decimal.DivisionByZero, decimal.Overflow])
+ONE = Decimal(1)
+HUNDRED = Decimal(100)
+# "CGST 9%" / "18%" / "Early payment 250"
+ADJUSTMENT_PATTERN = re.compile(r'^(.*?)\s*([-+]?[\d,_]*\.?\d+)\s*(%?)$')
+
+
+class MoneyError(ValueError):
+    """Amounts that could not be read; ``problems`` holds (row, column, text) for every bad cell."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        shown = '; '.join(f"row {row} {column} {text!r}" for row, column, text in problems[:SHOWN_PROBLEMS])
+        more = len(problems) - SHOWN_PROBLEMS
+        super().__init__(f"Invalid amount in {shown}" + (f" and {more} more" if more > 0 else ''))
+
+    def __reduce__(self):
+        # Rebuilt from the problems, not the message, when sent back from a worker process
+        return MoneyError, (self.problems,)
+
+
+def default_currency():
+    return os.environ.get('BILLMAKER_CURRENCY') or DEFAULT_CURRENCY
+
+
+def currency_rules(code):
+    code = (code or '').strip().upper() or default_currency()
+    try:
+        return code, CURRENCIES[code]
+    except KeyError:
+        raise MoneyError([(0, 'currency', code)]) from None
+
+
+def in_range(number):
+    return number.is_finite() and number.adjusted() < MAX_DIGITS
+
+
+def parse_column(values, column):
+    """Read a whole item column of text at once.
+
+    Blank cells count as zero and thousands separators are ignored. When
+    every cell is a whole number the result is an array of ints, otherwise a
+    list of Decimals. Every unreadable or out-of-range cell is reported in
+    one MoneyError.
+    """
+    cleaned = [text.replace(',', '').strip() or '0' for text in values]
+    try:
+        numbers = array('q', map(int, cleaned))
+        if not numbers or -MAX_WHOLE < min(numbers) and max(numbers) < MAX_WHOLE:
+            return numbers
+    except (ValueError, OverflowError):
+        pass
+    with decimal.localcontext(CONTEXT):
+        try:
+            numbers = list(map(Decimal, cleaned))
+            if all(map(Decimal.is_finite, numbers)) and max(map(Decimal.adjusted, numbers), default=0) < MAX_DIGITS:
+                return numbers
+        except decimal.InvalidOperation:
+            pass
+        # Only reached for bad input: find every offending cell
+        problems = []
+        for row, text in enumerate(cleaned, 1):
+            try:
+                if in_range(Decimal(text)):
+                    continue
+            except decimal.InvalidOperation:
+                pass
+            problems.append((row, column, values[row - 1]))
+        raise MoneyError(problems)
+
+
+def parse_adjustments(text, name):
+    """[(label, percent, amount), ...] from text like "CGST 9%; SGST 9%" or "250".
+
+    Entries are separated by ";". A trailing "%" makes the number a rate;
+    otherwise it is a fixed amount. Entries without a label are called name.
+    """
+    adjustments = []
+    for entry in (text or '').split(';'):
+        entry = entry.strip()
+        if not entry:
+            continue
+        match = ADJUSTMENT_PATTERN.match(entry)
+        if match is None:
+            raise MoneyError([(0, name.lower(), entry)])
+        label, number, percent = match.groups()
+        value = Decimal(number.replace(',', ''))
+        if not in_range(value):
+            raise MoneyError([(0, name.lower(), entry)])
+        adjustments.append((label or name, value if percent else None, None if percent else value))
+    return adjustments
+
+
+class Totals:
+    """Exact amounts of one bill, held as integers of the currency's minor unit.
+
+    ``lines`` are the rounded item amounts, ``adjustments`` the signed
+    (label, amount) discount, tax and cash rounding lines applied to their
+    sum ``subtotal`` to give ``total``.
+    """
+
+    __slots__ = ('currency', 'exponent', 'rounding', 'step', 'quantities', 'lines', 'subtotal', 'adjustments',
+                 'total')
+
+    def __init__(self, currency, quantities, lines, adjustments, total):
+        self.currency = currency
+        self.exponent, self.rounding, self.step = CURRENCIES[currency]
+        self.quantities = quantities
+        self.lines = lines
+        self.subtotal = sum(lines)
+        self.adjustments = adjustments
+        self.total = total
+
+    def format(self, minor):
+        if not self.exponent:
+            return f"{minor:,}"
+        whole, part = divmod(abs(minor), 10 ** self.exponent)
+        return f"{'-' if minor < 0 else ''}{whole:,}.{part:0{self.exponent}d}"
+
+    def format_lines(self):
+        return list(map(self.format, self.lines))
+
+    def format_quantities(self):
+        if isinstance(self.quantities, array):
+            return list(map(str, self.quantities))
+        return list(map('{:f}'.format, self.quantities))
+
+    def format_quantity(self, index):
+        quantity = self.quantities[index]
+        return str(quantity) if isinstance(self.quantities, array) else f'{quantity:f}'
+
+
+def line_amounts(quantities, prices, exponent, rounding):
+    """Quantity x price for every line, rounded to the minor unit."""
+    if isinstance(quantities, array) and isinstance(prices, array):
+        # Whole quantities at whole prices: exact in machine integers, no rounding needed
+        try:
+            return array('q', map(mul, map(mul, quantities, prices), repeat(10 ** exponent, len(prices))))
+        except OverflowError:
+            pass
+    with decimal.localcontext(CONTEXT):
+        if isinstance(prices, array):
+            prices = map(mul, prices, repeat(10 ** exponent))
+        else:
+            prices = map(Decimal.scaleb, prices, repeat(exponent))
+        exact = map(mul, quantities, prices)
+        return list(map(int, map(Decimal.quantize, exact, repeat(ONE), repeat(rounding))))
+
+
+def compute(quantities, prices, currency=None, discount='', tax=''):
+    """Work out a bill from its quantity and unit price columns (text).
+
+    Discounts are taken off the sum of the lines first and every tax is
+    charged on what remains. Each line is rounded to the minor unit, and the
+    total to the currency's cash step.
+    """
+    currency, (exponent, rounding, step) = currency_rules(currency)
+    quantities = parse_column(quantities, 'quantity')
+    lines = line_amounts(quantities, parse_column(prices, 'unit price'), exponent, rounding)
+
+    with decimal.localcontext(CONTEXT):
+        subtotal = sum(lines)
+        adjustments = []
+        for sign, name, text in ((-1, 'Discount', discount), (1, 'Tax', tax)):
+            base = subtotal + sum(amount for _, amount in adjustments)
+            for label, percent, amount in parse_adjustments(text, name):
+                if percent is not None:
+                    value = int((base * percent / HUNDRED).quantize(ONE, rounding))
+                else:
+                    value = int(amount.scaleb(exponent).quantize(ONE, rounding))
+                adjustments.append((label, sign * value))
+        total = subtotal + sum(amount for _, amount in adjustments)
+        if step > 1:
+            rounded = int((Decimal(total) / step).quantize(ONE, rounding)) * step
+            if rounded != total:
+                adjustments.append(('Rounding', rounded - total))
+                total = rounded
+    return Totals(currency, quantities, lines, adjustments, total)
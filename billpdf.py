@@ -0,0 +1,552 @@
+import atexit
+import collections
+import json
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+import billtrace
+
+SOFFICE_NAMES = ['soffice', 'libreoffice']
+SOFFICE_PATHS = [
+    r'C:\Program Files\LibreOffice\program\soffice.exe',
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',
+]
+STARTUP_TIMEOUT = 30
+# Seconds one conversion may take before its converter is killed
+CONVERT_TIMEOUT = 120
+# Further attempts at a failed conversion, the n-th after RETRY_BACKOFF * 2 ** (n - 1) seconds
+CONVERT_RETRIES = 2
+RETRY_BACKOFF = 1.0
+# Seconds of finished conversions the pool's throughput is averaged over
+THROUGHPUT_WINDOW = 60
+# Converters run in their own process group, so killing one takes its helper processes along
+if sys.platform == 'win32':
+    NEW_PROCESS_GROUP = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    NEW_PROCESS_GROUP = {'start_new_session': True}
+
+
+class ConversionError(RuntimeError):
+    """A conversion that failed on every attempt; ``dead_letter`` is where its document was kept."""
+
+    def __init__(self, message, dead_letter=None):
+        super().__init__(message)
+        self.dead_letter = dead_letter
+
+
+class ConversionTimeout(ConversionError):
+    pass
+
+
+def find_soffice():
+    for name in SOFFICE_NAMES:
+        path = shutil.which(name)
+        if path:
+            return path
+    for path in SOFFICE_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def scratch_dir():
+    """Directory for converter hand-off files: RAM-backed /dev/shm when there is one."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+def default_dead_letter_dir():
+    return os.environ.get('BILLMAKER_DEAD_LETTER') or os.path.join(os.path.expanduser('~'), '.billmaker',
+                                                                   'dead-letter')
+
+
+def _kill_tree(process):
+    """Kill a converter started in NEW_PROCESS_GROUP and everything it started."""
+    if process.poll() is None:
+        if sys.platform == 'win32':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    process.wait()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class SofficeWorker:
+    """One warm LibreOffice process with its own profile, kept alive between jobs.
+
+    When the LibreOffice Python bridge (``uno``) is importable, documents are
+    converted over a socket listener so each job costs a load and an export.
+    Without it every job runs ``soffice --convert-to``, which still reuses the
+    already-initialised per-worker profile. A conversion that runs past its
+    timeout has its LibreOffice killed; a listener that died is restarted
+    for the next job.
+    """
+
+    def __init__(self, soffice):
+        self.soffice = soffice
+        self.profile = tempfile.mkdtemp(prefix='billmaker-lo-')
+        self.profile_url = 'file:///' + self.profile.replace('\\', '/').lstrip('/')
+        self.process = None
+        self.desktop = None
+        self.restarts = 0
+        try:
+            import uno  # noqa: F401
+            self.use_uno = True
+        except ImportError:
+            self.use_uno = False
+
+    def start(self):
+        if not self.use_uno:
+            return
+        import uno
+
+        port = _free_port()
+        self.process = subprocess.Popen(
+            [self.soffice, '--headless', '--invisible', '--nologo', '--nodefault',
+             '--norestore', '--nolockcheck', f'-env:UserInstallation={self.profile_url}',
+             f'--accept=socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **NEW_PROCESS_GROUP)
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(
+                    f'uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext')
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError('LibreOffice listener did not start')
+                time.sleep(0.2)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+
+    def alive(self):
+        return not self.use_uno or (self.process is not None and self.process.poll() is None)
+
+    def convert(self, docx_path, pdf_path, timeout=None):
+        if not self.alive():
+            # Crashed, or killed for hanging on the last job
+            self.stop()
+            self.restarts += 1
+            self.start()
+        if self.use_uno:
+            self._convert_uno(docx_path, pdf_path, timeout)
+        else:
+            self._convert_cli(docx_path, pdf_path, timeout)
+
+    def _convert_uno(self, docx_path, pdf_path, timeout):
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def props(**kwargs):
+            out = []
+            for name, value in kwargs.items():
+                p = PropertyValue()
+                p.Name, p.Value = name, value
+                out.append(p)
+            return tuple(out)
+
+        # A hung LibreOffice never returns from the bridge call; killing it makes the call fail
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            _kill_tree(self.process)
+
+        watchdog = threading.Timer(timeout, expire) if timeout else None
+        if watchdog is not None:
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            doc = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(os.path.abspath(docx_path)), '_blank', 0, props(Hidden=True))
+            try:
+                doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                               props(FilterName='writer_pdf_Export'))
+            finally:
+                doc.close(True)
+        except Exception:
+            if expired.is_set():
+                raise ConversionTimeout(f'LibreOffice took over {timeout:g}s on {os.path.basename(docx_path)}') \
+                    from None
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+    def _convert_cli(self, docx_path, pdf_path, timeout):
+        outdir = tempfile.mkdtemp(prefix='billmaker-pdf-', dir=scratch_dir())
+        try:
+            process = subprocess.Popen(
+                [self.soffice, '--headless', '--norestore', f'-env:UserInstallation={self.profile_url}',
+                 '--convert-to', 'pdf', '--outdir', outdir, os.path.abspath(docx_path)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **NEW_PROCESS_GROUP)
+            try:
+                code = process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                _kill_tree(process)
+                raise ConversionTimeout(f'LibreOffice took over {timeout:g}s on {os.path.basename(docx_path)}') \
+                    from None
+            if code:
+                raise RuntimeError(f'LibreOffice exited with status {code} on {os.path.basename(docx_path)}')
+            produced = os.path.join(outdir, os.path.splitext(os.path.basename(docx_path))[0] + '.pdf')
+            if not os.path.exists(produced):
+                raise RuntimeError(f'LibreOffice produced no PDF for {docx_path}')
+            shutil.move(produced, pdf_path)
+        finally:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+    def stop(self):
+        self.desktop = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(5)
+                except subprocess.TimeoutExpired:
+                    _kill_tree(self.process)
+            self.process = None
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+
+def _docx2pdf_child(docx_path, pdf_path, sender):
+    try:
+        from docx2pdf import convert
+        convert(docx_path, pdf_path)
+        sender.send(None)
+    except Exception as e:
+        sender.send(str(e) or type(e).__name__)
+
+
+# Word itself, which docx2pdf drives from outside; killing the child that waits on it leaves it hung
+WORD_KILL = {'win32': ['taskkill', '/F', '/T', '/IM', 'WINWORD.EXE'], 'darwin': ['killall', '-9', 'Microsoft Word']}
+
+
+class Docx2PdfWorker:
+    """Word automation through docx2pdf, for Windows/macOS machines without LibreOffice.
+
+    Each conversion runs in a child process, which is killed if it runs past
+    its timeout: docx2pdf can wait on Word forever. Word is killed with it,
+    documents open in it included, and the next conversion starts it again.
+    """
+
+    def __init__(self):
+        self.restarts = 0
+
+    def start(self):
+        pass
+
+    def alive(self):
+        return True
+
+    def convert(self, docx_path, pdf_path, timeout=None):
+        import multiprocessing
+
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(False)
+        child = context.Process(target=_docx2pdf_child, args=(docx_path, pdf_path, sender), daemon=True)
+        child.start()
+        sender.close()
+        try:
+            if not receiver.poll(timeout):
+                child.kill()
+                self.kill_word()
+                raise ConversionTimeout(f'Word took over {timeout:g}s on {os.path.basename(docx_path)}')
+            try:
+                error = receiver.recv()
+            except EOFError:
+                error = 'Word conversion exited without a result'
+        finally:
+            child.join()
+            receiver.close()
+        if error:
+            raise RuntimeError(error)
+
+    def kill_word(self):
+        command = WORD_KILL.get(sys.platform)
+        if command:
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.restarts += 1
+
+    def close(self):
+        pass
+
+
+class ConversionJob:
+    def __init__(self, docx_path, pdf_path, name, future, trace):
+        self.docx_path = docx_path
+        self.pdf_path = pdf_path
+        # What the document is called in the dead-letter directory
+        self.name = name or os.path.basename(pdf_path)
+        self.future = future
+        self.trace = trace
+        self.queued = time.perf_counter()
+        self.attempts = 0
+
+
+class ConverterPool:
+    """Queue of DOCX->PDF jobs served by a fixed set of warm converter processes.
+
+    ``submit`` returns a Future; each worker thread owns one converter and
+    takes the next job from the shared queue, so conversions run on as many
+    cores as there are workers.
+
+    Conversions are supervised: one running past ``timeout`` seconds has its
+    converter killed (and restarted for the next job), and a failed job is
+    queued again up to ``retries`` times, waiting ``backoff`` seconds and
+    twice that each time after. A job failing every attempt raises
+    ConversionError, its document copied to ``dead_letter_dir`` beside a
+    JSON note of what went wrong. stats() gives queue depth and throughput.
+    """
+
+    def __init__(self, workers=None, soffice=None, timeout=CONVERT_TIMEOUT, retries=CONVERT_RETRIES,
+                 backoff=RETRY_BACKOFF, dead_letter_dir=None):
+        soffice = soffice or find_soffice()
+        if soffice:
+            count = workers or max(1, min(4, os.cpu_count() or 1))
+            self.converters = [SofficeWorker(soffice) for _ in range(count)]
+        elif sys.platform in ('win32', 'darwin'):
+            # Word is a single shared instance, more workers would only contend for it
+            self.converters = [Docx2PdfWorker()]
+        else:
+            raise RuntimeError('No PDF converter found: install LibreOffice (soffice) for PDF export')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.dead_letter_dir = dead_letter_dir
+
+        self._lock = threading.Lock()
+        self._closed = False
+        # Jobs waiting out their backoff, with the timer that queues them again
+        self._retrying = {}
+        self._running = 0
+        self._counts = {'converted': 0, 'failed': 0, 'retries': 0, 'timeouts': 0}
+        self._queued_peak = 0
+        self._started = time.monotonic()
+        self._finished = collections.deque()
+
+        self.jobs = queue.Queue()
+        self.threads = []
+        for converter in self.converters:
+            t = threading.Thread(target=self._work, args=(converter,), daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def _work(self, converter):
+        started = False
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                converter.close()
+                return
+            # The conversion is timed as part of the job that queued it
+            with billtrace.resume(job.trace):
+                if not job.attempts and not job.future.set_running_or_notify_cancel():
+                    continue
+                if job.trace is not None:
+                    job.trace.add_time('convert_queue', time.perf_counter() - job.queued)
+                job.attempts += 1
+                with self._lock:
+                    self._running += 1
+                try:
+                    if not started:
+                        with billtrace.stage('converter_start'):
+                            converter.start()
+                        started = True
+                    with billtrace.stage('convert'):
+                        converter.convert(job.docx_path, job.pdf_path, self.timeout or None)
+                except Exception as e:
+                    self._failed(job, e)
+                else:
+                    with self._lock:
+                        self._counts['converted'] += 1
+                        self._finished.append(time.monotonic())
+                        self._trim()
+                    job.future.set_result(job.pdf_path)
+                finally:
+                    with self._lock:
+                        self._running -= 1
+
+    def _failed(self, job, error):
+        timed_out = isinstance(error, ConversionTimeout)
+        billtrace.count('convert_timeouts' if timed_out else 'convert_errors')
+        with self._lock:
+            self._counts['timeouts'] += timed_out
+            if job.attempts <= self.retries and not self._closed:
+                self._counts['retries'] += 1
+                timer = threading.Timer(self.backoff * 2 ** (job.attempts - 1), self._requeue, args=(job,))
+                timer.daemon = True
+                self._retrying[job] = timer
+                if job.trace is not None:
+                    job.trace.hold()
+                timer.start()
+                return
+            self._counts['failed'] += 1
+        kept = self._dead_letter(job, error)
+        message = f"{error} (after {job.attempts} attempt{'s' if job.attempts > 1 else ''})"
+        if kept:
+            message += f"; document kept as {kept}"
+        failure = (ConversionTimeout if timed_out else ConversionError)(message, kept)
+        failure.__cause__ = error
+        job.future.set_exception(failure)
+
+    def _requeue(self, job):
+        # Under the lock, so it can't land behind close()'s stop markers
+        with self._lock:
+            if self._retrying.pop(job, None) is None:
+                return
+            job.queued = time.perf_counter()
+            self.jobs.put(job)
+            self._queued_peak = max(self._queued_peak, self.jobs.qsize())
+
+    def _dead_letter(self, job, error):
+        """Copy the document that would not convert to dead_letter_dir; returns its path there."""
+        if not self.dead_letter_dir:
+            return None
+        try:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.path.splitext(job.name)[0]}-"
+            fd, path = tempfile.mkstemp(prefix=stem, suffix='.docx', dir=self.dead_letter_dir)
+            with os.fdopen(fd, 'wb') as f, open(job.docx_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+            note = {'name': job.name, 'pdf_path': job.pdf_path, 'error': str(error) or type(error).__name__,
+                    'attempts': job.attempts, 'failed_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+            with open(os.path.splitext(path)[0] + '.json', 'w', encoding='utf-8') as f:
+                json.dump(note, f, indent=1)
+        except OSError:
+            # The job's own error is what matters; losing the copy must not hide it
+            return None
+        return path
+
+    def _trim(self):
+        horizon = time.monotonic() - THROUGHPUT_WINDOW
+        while self._finished and self._finished[0] < horizon:
+            self._finished.popleft()
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def stats(self):
+        """Queue depth, load and throughput (conversions a second over THROUGHPUT_WINDOW), for sizing the pool."""
+        with self._lock:
+            self._trim()
+            # A pool younger than the window is averaged over its age, but at least a second
+            window = min(THROUGHPUT_WINDOW, max(1.0, time.monotonic() - self._started))
+            return {
+                'converters': len(self.converters),
+                'queued': self.jobs.qsize(),
+                'queued_peak': self._queued_peak,
+                'running': self._running,
+                'retrying': len(self._retrying),
+                **self._counts,
+                'restarts': sum(converter.restarts for converter in self.converters),
+                'per_second': round(len(self._finished) / window, 3),
+            }
+
+    def submit(self, docx_path, pdf_path, name=None):
+        future = Future()
+        trace = billtrace.current()
+        if trace is not None:
+            trace.hold()
+        self.jobs.put(ConversionJob(docx_path, pdf_path, name, future, trace))
+        with self._lock:
+            self._queued_peak = max(self._queued_peak, self.jobs.qsize())
+        return future
+
+    def submit_docx(self, docx_bytes, pdf_path, name=None):
+        """Queue an in-memory DOCX; it is handed over through a per-job scratch file."""
+        fd, temp_docx = tempfile.mkstemp(prefix='billmaker-', suffix='.docx', dir=scratch_dir())
+        with os.fdopen(fd, 'wb') as f:
+            f.write(docx_bytes)
+        future = self.submit(temp_docx, pdf_path, name)
+        future.add_done_callback(lambda _: os.remove(temp_docx))
+        return future
+
+    def convert(self, docx_path, pdf_path, timeout=None):
+        return self.submit(docx_path, pdf_path).result(timeout)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            waiting, self._retrying = self._retrying, {}
+        for job, timer in waiting.items():
+            timer.cancel()
+            job.future.set_exception(ConversionError('The converter pool closed before the job could be retried'))
+            if job.trace is not None:
+                job.trace.release()
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# ConverterPool arguments get_pool starts the pool with, set by configure
+_settings = {}
+
+
+def configure(**settings):
+    """Settings for the process-wide pool (ConverterPool's keyword arguments; None keeps the default).
+
+    Takes effect when the pool starts, so call it before the first conversion.
+    """
+    _settings.update((key, value) for key, value in settings.items() if value is not None)
+
+
+def get_pool():
+    """The process-wide converter pool, started on first use and shut down at exit.
+
+    Timeout and dead-letter directory come from configure(), else from
+    BILLMAKER_CONVERT_TIMEOUT (seconds, 0 for none) and BILLMAKER_DEAD_LETTER.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            settings = {'timeout': float(os.environ.get('BILLMAKER_CONVERT_TIMEOUT') or CONVERT_TIMEOUT),
+                        'dead_letter_dir': default_dead_letter_dir(), **_settings}
+            _pool = ConverterPool(**settings)
+            atexit.register(_pool.close)
+            billtrace.gauges('converter', _pool.stats)
+        return _pool
+
+
+def pool_stats():
+    """The process-wide pool's stats(), or None while no conversion has started it."""
+    pool = _pool
+    return pool.stats() if pool is not None else None
+
+
+def convert(docx_path, pdf_path):
+    return get_pool().convert(docx_path, pdf_path)
@@ -0,0 +1,450 @@
+import hashlib
+import os
+import struct
+import threading
+import zipfile
+import zlib
+
+import billfont
+import billtrace
+
+# Page geometry of "Bill Format.docx" in points (1 pt = 20 twips)
+PAGE_WIDTH = 595.3
+PAGE_HEIGHT = 841.9
+LEFT = 36.55            # 1440 twip margin less the -709 twip paragraph indent
+TOP = 163.05
+TEXT_RIGHT = 521.0
+TABLE_COLUMNS = [240.75, 113.4, 155.95]
+CELL_PADDING = 5.4
+TABLE_BOTTOM = 630.0    # where the footer band of the letterhead starts
+TOTAL_RIGHT = 561.05
+TOTAL_BASELINE = 735.0
+
+BODY_SIZE = 12
+HEADING_SIZE = 16
+TOTAL_SIZE = 36
+LINE_SPACING = 278 / 240
+PARAGRAPH_AFTER = 8
+
+HEADING_COLOR = (0x13 / 255, 0x4E / 255, 0x5E / 255)
+TEXT_COLOR = (0, 0, 0)
+TOTAL_COLOR = (1, 1, 1)
+
+
+def _png_image(png):
+    """Wrap the IDAT data of an 8-bit, non-interlaced grey/RGB PNG as a PDF image dictionary."""
+    if png[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError("Letterhead image is not a PNG")
+    pos = 8
+    idat = bytearray()
+    while pos < len(png):
+        length, kind = struct.unpack('>I4s', png[pos:pos + 8])
+        chunk = png[pos + 8:pos + 8 + length]
+        if kind == b'IHDR':
+            width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'IDAT':
+            idat += chunk
+        pos += 12 + length
+    if depth != 8 or color not in (0, 2) or interlace:
+        raise ValueError("Letterhead PNG must be 8-bit grey or RGB without alpha or interlacing")
+    colors = 3 if color == 2 else 1
+    space = '/DeviceRGB' if color == 2 else '/DeviceGray'
+    header = (f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+              f'/ColorSpace {space} /BitsPerComponent 8 /Filter /FlateDecode '
+              f'/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {width} >> '
+              f'/Length {len(idat)} >>')
+    return header.encode('latin-1') + b'\nstream\n' + bytes(idat) + b'\nendstream'
+
+
+def letterhead_from_template(template_path):
+    """The full-page background picture embedded in the Word template, if any."""
+    with zipfile.ZipFile(template_path) as z:
+        for name in sorted(z.namelist()):
+            if name.startswith('word/media/') and name.lower().endswith('.png'):
+                return z.read(name)
+    return None
+
+
+class _FontUse:
+    """One font as used on a document: which glyphs were drawn and what text they stand for."""
+
+    def __init__(self, font, name):
+        self.font = font
+        self.name = name
+        self.used = {}
+
+    def encode(self, text):
+        gids = self.font.glyph_ids(text)
+        for gid, char in zip(gids, text):
+            self.used.setdefault(gid, char)
+        return ''.join(f'{gid:04X}' for gid in gids)
+
+    def objects(self, first):
+        """PDF objects (numbered from ``first``) for a Type0 font with an embedded glyph subset."""
+        font = self.font
+        scale = 1000 / font.units_per_em
+        gids = sorted(self.used)
+        program = font.subset(gids)
+        tag = ''.join(chr(65 + b % 26) for b in hashlib.md5(bytes(str(gids), 'ascii')).digest()[:6])
+        base = f'{tag}+{font.ps_name}'
+
+        widths = ' '.join(f'{gid} [{round(font.advances[gid] * scale)}]' for gid in gids)
+        bbox = ' '.join(str(round(v * scale)) for v in font.bbox)
+        tounicode = self._tounicode(gids)
+        compressed = zlib.compress(program, 6)
+
+        _, cid, descriptor, file_, cmap = range(first, first + 5)
+        return [
+            f'<< /Type /Font /Subtype /Type0 /BaseFont /{base} /Encoding /Identity-H '
+            f'/DescendantFonts [{cid} 0 R] /ToUnicode {cmap} 0 R >>'.encode('latin-1'),
+            f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{base} '
+            f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+            f'/FontDescriptor {descriptor} 0 R /CIDToGIDMap /Identity /W [{widths}] >>'.encode('latin-1'),
+            f'<< /Type /FontDescriptor /FontName /{base} /Flags 32 /FontBBox [{bbox}] '
+            f'/ItalicAngle {font.italic_angle:g} /Ascent {round(font.ascent * scale)} '
+            f'/Descent {round(font.descent * scale)} /CapHeight {round(font.cap_height * scale)} '
+            f'/StemV 80 /FontFile2 {file_} 0 R >>'.encode('latin-1'),
+            f'<< /Length {len(compressed)} /Length1 {len(program)} /Filter /FlateDecode >>\nstream\n'
+            .encode('latin-1') + compressed + b'\nendstream',
+            f'<< /Length {len(tounicode)} >>\nstream\n'.encode('latin-1') + tounicode + b'\nendstream',
+        ]
+
+    def _tounicode(self, gids):
+        lines = ['/CIDInit /ProcSet findresource begin', '12 dict begin', 'begincmap',
+                 '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def',
+                 '/CMapName /Adobe-Identity-UCS def', '/CMapType 2 def',
+                 '1 begincodespacerange', '<0000> <FFFF>', 'endcodespacerange']
+        for i in range(0, len(gids), 100):
+            block = gids[i:i + 100]
+            lines.append(f'{len(block)} beginbfchar')
+            for gid in block:
+                lines.append(f'<{gid:04X}> <{self.used[gid].encode("utf-16-be").hex().upper()}>')
+            lines.append('endbfchar')
+        lines += ['endcmap', 'CMapName currentdict /CMap defineresource pop', 'end', 'end']
+        return '\n'.join(lines).encode('latin-1')
+
+
+def _resources(font_refs, image):
+    resources = f"<< /Font << {' '.join(font_refs)} >>"
+    if image:
+        resources += f' /XObject << /Im1 {image} 0 R >>'
+    return resources + ' >>'
+
+
+def _page_content(ops, image):
+    """The content stream object of one page: letterhead, then the page's own drawing."""
+    lines = []
+    if image:
+        lines.append(f'q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Im1 Do Q')
+    lines.append('0 0 0 RG 0.5 w')
+    lines.extend(ops)
+    content = zlib.compress('\n'.join(lines).encode('latin-1'), 6)
+    return f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode('latin-1') + content + b'\nendstream'
+
+
+def _page(parent, resources, content):
+    return (f'<< /Type /Page /Parent {parent} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources {resources} /Contents {content} 0 R >>').encode('latin-1')
+
+
+def _text_string(text):
+    # UTF-16 with a byte order mark, hex-encoded: any text without escaping
+    return f"<FEFF{text.encode('utf-16-be').hex().upper()}>"
+
+
+class _Page:
+    def __init__(self):
+        self.ops = []
+
+    def text(self, font, size, color, x, y, text):
+        if text:
+            self.ops.append(f'BT {color[0]:.3f} {color[1]:.3f} {color[2]:.3f} rg /{font.name} {size} Tf '
+                            f'{x:.2f} {PAGE_HEIGHT - y:.2f} Td <{font.encode(text)}> Tj ET')
+
+    def rect(self, x, y, w, h):
+        self.ops.append(f'{x:.2f} {PAGE_HEIGHT - y - h:.2f} {w:.2f} {h:.2f} re S')
+
+
+class NativePdfRenderer:
+    """Draws the invoice layout of "Bill Format.docx" straight to PDF.
+
+    Fonts are parsed once and cached; each document embeds only the glyphs
+    it uses. The letterhead picture is lifted from the template once and
+    its compressed data is reused unchanged on every page.
+    """
+
+    def __init__(self, template_path=None, font_path=None, bold_font_path=None):
+        self.template_path = template_path
+        self.mtime = os.stat(template_path).st_mtime_ns if template_path else None
+        self.regular = billfont.load_font(font_path or billfont.find_font('regular'))
+        self.bold = billfont.load_font(bold_font_path or billfont.find_font('bold'))
+        png = letterhead_from_template(template_path) if template_path else None
+        self.letterhead = _png_image(png) if png else None
+        digest = hashlib.sha256(b'native')
+        for part in (png or b'', self.regular.data, self.bold.data):
+            digest.update(hashlib.sha256(part).digest())
+        self.digest = digest.hexdigest()
+
+    def is_stale(self):
+        if self.template_path is None:
+            return False
+        try:
+            return os.stat(self.template_path).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return True
+
+    def line_height(self, font, size, spacing=LINE_SPACING):
+        return (font.ascent - font.descent) / font.units_per_em * size * spacing
+
+    def wrap(self, font, size, text, width):
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ''
+            for word in paragraph.split(' '):
+                candidate = f'{line} {word}' if line else word
+                if line and font.text_width(candidate, size) > width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return lines
+
+    def render(self, data):
+        with billtrace.stage('layout'):
+            pages, fonts = self._layout(data)
+        with billtrace.stage('save'):
+            return self._write(pages, fonts)
+
+    def lay_out(self, data):
+        """One bill's pages as content operator lists, and the glyphs ({gid: char}) each font drew.
+
+        Plain data, so bills can be laid out in worker processes and
+        appended to a MergedPdfWriter in the parent.
+        """
+        with billtrace.stage('layout'):
+            pages, fonts = self._layout(data)
+        return [page.ops for page in pages], [font.used for font in fonts]
+
+    def _layout(self, data):
+        regular = _FontUse(self.regular, 'F1')
+        bold = _FontUse(self.bold, 'F2')
+        pages = [_Page()]
+        page = pages[0]
+        y = TOP
+
+        def paragraph(font, size, color, text):
+            nonlocal y
+            for line in self.wrap(font.font, size, text, TEXT_RIGHT - LEFT):
+                page.text(font, size, color, LEFT, y + font.font.ascent / font.font.units_per_em * size, line)
+                y += self.line_height(font.font, size)
+            y += PARAGRAPH_AFTER
+
+        def get(key):
+            return str(data.get(key, ''))
+
+        y += self.line_height(self.bold, HEADING_SIZE) + PARAGRAPH_AFTER
+        paragraph(bold, HEADING_SIZE, HEADING_COLOR, 'Client Details')
+        paragraph(regular, BODY_SIZE, TEXT_COLOR,
+                  f"Client Name: {get('CLIENTNAME')}\nClient Address: {get('CLIENTADDRESS')}")
+        paragraph(bold, HEADING_SIZE, HEADING_COLOR, 'Billing Details')
+        paragraph(regular, BODY_SIZE, TEXT_COLOR,
+                  f"Bill Number: {get('BILLNUMBER')}\nBilling Date: {get('BILLDATE')}\n"
+                  f"Due Date: {get('DUEDATE')}")
+        y += self.line_height(self.regular, BODY_SIZE) + PARAGRAPH_AFTER
+        paragraph(bold, HEADING_SIZE, HEADING_COLOR, 'Description of Service')
+
+        rows = [(bold, HEADING_COLOR, ['Description', 'Quantity', 'Amount'])]
+        i = 1
+        while f'description{i}' in data:
+            rows.append((regular, TEXT_COLOR, [get(f'description{i}'), get(f'quantity{i}'), get(f'amount{i}')]))
+            i += 1
+
+        cell_line = self.line_height(self.regular, BODY_SIZE, 1.0)
+        for index, (font, color, cells) in enumerate(rows):
+            wrapped = self._wrap_cells(font, cells)
+            if index and y + len(max(wrapped, key=len)) * cell_line > TABLE_BOTTOM:
+                # Continue the table on a fresh letterhead page, repeating the header row
+                page = _Page()
+                pages.append(page)
+                header_font, header_color, header = rows[0]
+                y = self._table_row(page, header_font, header_color, self._wrap_cells(header_font, header),
+                                    TOP, cell_line)
+            y = self._table_row(page, font, color, wrapped, y, cell_line)
+
+        total = get('TOTAL')
+        width = self.regular.text_width(total, TOTAL_SIZE)
+        page.text(regular, TOTAL_SIZE, TOTAL_COLOR, TOTAL_RIGHT - width, TOTAL_BASELINE, total)
+
+        billtrace.count('line_items', len(rows) - 1)
+        billtrace.count('pages', len(pages))
+        return pages, [regular, bold]
+
+    def _wrap_cells(self, font, cells):
+        return [self.wrap(font.font, BODY_SIZE, text, width - 2 * CELL_PADDING)
+                for text, width in zip(cells, TABLE_COLUMNS)]
+
+    def _table_row(self, page, font, color, wrapped, y, cell_line):
+        height = len(max(wrapped, key=len)) * cell_line
+        ascent = font.font.ascent / font.font.units_per_em * BODY_SIZE
+        x = LEFT
+        for lines, width in zip(wrapped, TABLE_COLUMNS):
+            page.rect(x, y, width, height)
+            for n, line in enumerate(lines):
+                # Cells are centred like the template's table paragraphs
+                offset = (width - font.font.text_width(line, BODY_SIZE)) / 2
+                page.text(font, BODY_SIZE, color, x + offset, y + n * cell_line + ascent, line)
+            x += width
+        return y + height
+
+    def _write(self, pages, fonts):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        catalog = add(None)
+        pages_obj = add(None)
+        image = add(self.letterhead) if self.letterhead else None
+
+        font_refs = []
+        for font in fonts:
+            if font.used:
+                first = len(objects) + 1
+                for body in font.objects(first):
+                    add(body)
+                font_refs.append(f'/{font.name} {first} 0 R')
+        resources = _resources(font_refs, image)
+
+        kids = []
+        for page in pages:
+            stream = add(_page_content(page.ops, image))
+            kids.append(add(_page(pages_obj, resources, stream)))
+
+        objects[catalog - 1] = f'<< /Type /Catalog /Pages {pages_obj} 0 R >>'.encode('latin-1')
+        objects[pages_obj - 1] = (f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] "
+                                  f"/Count {len(kids)} >>").encode('latin-1')
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(out))
+            out += f'{number} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n'
+        xref = len(out)
+        out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+        for offset in offsets:
+            out += f'{offset:010d} 00000 n \n'.encode('latin-1')
+        out += (f'trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\n'
+                f'startxref\n{xref}\n%%EOF\n').encode('latin-1')
+        return bytes(out)
+
+    def save(self, data, stream):
+        stream.write(self.render(data))
+
+
+class MergedPdfWriter:
+    """Bills appended one after another to a single PDF written on a stream.
+
+    Each bill's pages are written out as soon as it is added; only object
+    offsets, page numbers and one bookmark per bill are kept. Letterheads
+    are written once per template. The two fonts are shared by all bills
+    and embedded once, by ``close``, with every glyph any bill used,
+    followed by the page tree, the bookmarks and the cross-reference table.
+    The stream is only ever appended to, so it need not be seekable.
+    """
+
+    def __init__(self, renderer, stream):
+        self.renderer = renderer
+        self.stream = stream
+        self.position = 0
+        self.offsets = {}
+        self.fonts = [_FontUse(renderer.regular, 'F1'), _FontUse(renderer.bold, 'F2')]
+        self.kids = []
+        self.bookmarks = []
+        # Written last, but numbered first so every page can refer to them
+        self.catalog, self.page_tree, self.outlines = 1, 2, 3
+        self.font_numbers = [4 + 5 * i for i in range(len(self.fonts))]
+        self.next_number = 4 + 5 * len(self.fonts)
+        self.font_refs = [f'/{font.name} {number} 0 R' for font, number in zip(self.fonts, self.font_numbers)]
+        # (letterhead image object, page resources) per renderer digest
+        self.letterheads = {}
+        self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _emit(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+    def _object(self, body, number=None):
+        if number is None:
+            number = self.next_number
+            self.next_number += 1
+        self.offsets[number] = self.position
+        self._emit(f'{number} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n')
+        return number
+
+    def _letterhead(self, renderer):
+        entry = self.letterheads.get(renderer.digest)
+        if entry is None:
+            image = self._object(renderer.letterhead) if renderer.letterhead else None
+            entry = self.letterheads[renderer.digest] = (image, _resources(self.font_refs, image))
+        return entry
+
+    def add(self, title, pages, used, renderer=None):
+        """Append one bill as returned by NativePdfRenderer.lay_out, on the
+        letterhead of renderer (by default the writer's own)."""
+        image, resources = self._letterhead(renderer or self.renderer)
+        for font, glyphs in zip(self.fonts, used):
+            for gid, char in glyphs.items():
+                font.used.setdefault(gid, char)
+        first = None
+        for ops in pages:
+            content = self._object(_page_content(ops, image))
+            page = self._object(_page(self.page_tree, resources, content))
+            self.kids.append(page)
+            first = first or page
+        if first:
+            self.bookmarks.append((title, first))
+
+    def close(self):
+        for font, first in zip(self.fonts, self.font_numbers):
+            if not font.used:
+                # An embedded font needs at least one glyph
+                font.encode(' ')
+            for i, body in enumerate(font.objects(first)):
+                self._object(body, first + i)
+        self._object((f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in self.kids)}] "
+                      f"/Count {len(self.kids)} >>").encode('latin-1'), self.page_tree)
+
+        items = list(range(self.next_number, self.next_number + len(self.bookmarks)))
+        self.next_number += len(items)
+        for i, (title, page) in enumerate(self.bookmarks):
+            links = f' /Prev {items[i - 1]} 0 R' if i else ''
+            links += f' /Next {items[i + 1]} 0 R' if i + 1 < len(items) else ''
+            self._object(f'<< /Title {_text_string(title)} /Parent {self.outlines} 0 R{links} '
+                         f'/Dest [{page} 0 R /XYZ null null null] >>'.encode('latin-1'), items[i])
+        outline = f'<< /Type /Outlines /Count {len(items)}'
+        if items:
+            outline += f' /First {items[0]} 0 R /Last {items[-1]} 0 R'
+        self._object((outline + ' >>').encode('latin-1'), self.outlines)
+        self._object(f'<< /Type /Catalog /Pages {self.page_tree} 0 R /Outlines {self.outlines} 0 R '
+                     f'/PageMode /UseOutlines >>'.encode('latin-1'), self.catalog)
+
+        xref = self.position
+        lines = [f'xref\n0 {self.next_number}\n0000000000 65535 f ']
+        lines += [f'{self.offsets[n]:010d} 00000 n ' for n in range(1, self.next_number)]
+        self._emit(('\n'.join(lines) + f'\ntrailer\n<< /Size {self.next_number} /Root {self.catalog} 0 R >>\n'
+                    f'startxref\n{xref}\n%%EOF\n').encode('latin-1'))
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(template_path=None):
+    """The renderer for a template, made again when the template changes on disk."""
+    with _renderers_lock:
+        renderer = _renderers.get(template_path)
+        if renderer is None or renderer.is_stale():
+            renderer = _renderers[template_path] = NativePdfRenderer(template_path)
+        return renderer
@@ -0,0 +1,205 @@
+import collections
+import importlib.util
+import threading
+
+from PyQt6.QtCore import (QBuffer, QByteArray, QIODevice, QObject, QRunnable, QSize, QThreadPool, QTimer,
+                          Qt, pyqtSignal)
+from PyQt6.QtGui import QPixmap
+from PyQt6.QtWidgets import QLabel, QScrollArea, QVBoxLayout, QWidget
+
+import billcache
+import billcore
+
+# Some PyQt6 builds ship without the QtPdf module. It is imported by the first render, on
+# the preview thread, so it stays off the app's startup path.
+HAVE_QTPDF = importlib.util.find_spec('PyQt6.QtPdf') is not None
+
+# Quiet time after the last edit before the preview is rendered (ms)
+DEBOUNCE_MS = 300
+# Rendered page images kept for reuse, counted in pages
+CACHE_PAGES = 64
+
+
+class PageCache:
+    """Page images by (bill content key, pixel width), least recently used evicted first."""
+
+    def __init__(self, size=CACHE_PAGES):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, width):
+        with self._lock:
+            images = self.entries.get((key, width))
+            if images is not None:
+                self.entries.move_to_end((key, width))
+            return images
+
+    def put(self, key, width, images):
+        with self._lock:
+            old = self.entries.pop((key, width), None)
+            self.pages -= len(old) if old else 0
+            self.entries[(key, width)] = images
+            self.pages += len(images)
+            while self.pages > self.size and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.pages -= len(evicted)
+
+
+def render_pages(pdf, width):
+    """Rasterise every page of a PDF to QImages width pixels wide."""
+    from PyQt6.QtPdf import QPdfDocument
+    doc = QPdfDocument(None)
+    buf = QBuffer()
+    buf.setData(QByteArray(pdf))
+    buf.open(QIODevice.OpenModeFlag.ReadOnly)
+    doc.load(buf)
+    try:
+        images = []
+        for page in range(doc.pageCount()):
+            size = doc.pagePointSize(page)
+            images.append(doc.render(page, QSize(width, round(width * size.height() / size.width()))))
+        return images
+    finally:
+        doc.close()
+
+
+class PreviewSignals(QObject):
+    done = pyqtSignal(int, list)
+    failed = pyqtSignal(int, str)
+
+
+class PreviewJob(QRunnable):
+    """Draws the bill with the native PDF renderer and rasterises its pages off the GUI thread."""
+
+    def __init__(self, generation, data, width, cache):
+        super().__init__()
+        self.generation = generation
+        self.data = data
+        self.width = width
+        self.cache = cache
+        self.signals = PreviewSignals()
+
+    def run(self):
+        try:
+            renderer = billcore.load_pdf_renderer()
+            key = billcache.RenderCache.key('preview', renderer.digest, self.data)
+            images = self.cache.get(key, self.width)
+            if images is None:
+                images = render_pages(renderer.render(self.data), self.width)
+                self.cache.put(key, self.width, images)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        self.signals.done.emit(self.generation, images)
+
+
+class PreviewPane(QScrollArea):
+    """Live page images of the bill being edited.
+
+    ``schedule`` is cheap enough to call on every keystroke: it only restarts
+    a debounce timer. When the timer fires the bill is collected through
+    ``data_source`` on the GUI thread and drawn on a single background
+    thread. If the form changed while that render was running its result is
+    dropped and the latest bill is rendered instead.
+    """
+
+    def __init__(self, data_source, parent=None):
+        super().__init__(parent)
+        self.data_source = data_source
+        self.cache = PageCache()
+        self.generation = 0
+        self.busy = False
+        self.pending = False
+        self.rendered_width = None
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DEBOUNCE_MS)
+        self.timer.timeout.connect(self.start_render)
+
+        self.pages = QWidget()
+        self.pages_layout = QVBoxLayout(self.pages)
+        self.pages_layout.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter)
+        self.setWidget(self.pages)
+        self.setWidgetResizable(True)
+        self.setMinimumWidth(320)
+        self.message = QLabel()
+        self.message.setWordWrap(True)
+        self.pages_layout.addWidget(self.message)
+        if not HAVE_QTPDF:
+            self.message.setText("Preview needs the QtPdf module of PyQt6.")
+
+    def schedule(self):
+        if HAVE_QTPDF:
+            self.timer.start()
+
+    def page_width(self):
+        return max(100, self.viewport().width() - 2 * self.pages_layout.contentsMargins().left())
+
+    def start_render(self):
+        if self.busy:
+            self.pending = True
+            return
+        self.pending = False
+        self.generation += 1
+        try:
+            data = self.data_source()
+        except ValueError as e:
+            # Half-typed amounts; keep the last pages up and say why they're stale
+            self.message.setText(f"Preview unavailable: {e}")
+            self.message.show()
+            return
+        self.busy = True
+        ratio = self.devicePixelRatioF()
+        job = PreviewJob(self.generation, data, round(self.page_width() * ratio), self.cache)
+        job.signals.done.connect(self.show_pages)
+        job.signals.failed.connect(self.show_error)
+        self.pool.start(job)
+
+    def _finished(self, generation):
+        self.busy = False
+        if self.pending or generation != self.generation:
+            # The form changed while this render ran; render the current bill instead
+            self.start_render()
+            return False
+        return True
+
+    def show_pages(self, generation, images):
+        if not self._finished(generation):
+            return
+        self.message.hide()
+        labels = [self.pages_layout.itemAt(i).widget() for i in range(1, self.pages_layout.count())]
+        for label in labels[len(images):]:
+            self.pages_layout.removeWidget(label)
+            label.deleteLater()
+        ratio = self.devicePixelRatioF()
+        for i, image in enumerate(images):
+            if i < len(labels):
+                label = labels[i]
+            else:
+                label = QLabel()
+                self.pages_layout.addWidget(label)
+            pixmap = QPixmap.fromImage(image)
+            pixmap.setDevicePixelRatio(ratio)
+            label.setPixmap(pixmap)
+        self.rendered_width = self.page_width()
+
+    def show_error(self, generation, message):
+        if not self._finished(generation):
+            return
+        self.message.setText(f"Preview unavailable: {message}")
+        self.message.show()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.rendered_width is not None and self.page_width() != self.rendered_width:
+            self.schedule()
+
+    def shutdown(self):
+        self.timer.stop()
+        self.pool.clear()
+        self.pool.waitForDone()
@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+import zipfile
+
+import billcore
+import billpdfnative
+import billtemplate
+
+# Record key naming the template a bill is rendered with; blank means the default template
+TEMPLATE_FIELD = 'TEMPLATE'
+
+# How the v1.2-v1.4 templates spell the bill keys, inside {{...}}
+BRACE_NAMES = {
+    'CLIENTNAME': 'name',
+    'CLIENTADDRESS': 'address',
+    'BILLNUMBER': 'invoiceno',
+    'BILLDATE': 'billdate',
+    'DUEDATE': 'duedate',
+    'TOTAL': 'total',
+}
+BRACE_KEYS = {name: key for key, name in BRACE_NAMES.items()}
+BRACE_PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+KEYWORD_PLACEHOLDER = re.compile(r'\b(?:%s|(?:%s)\d+)\b' % ('|'.join(billcore.HEADER_FIELDS + ['TOTAL']),
+                                                           '|'.join(billcore.ITEM_FIELDS)))
+ITEM_PLACEHOLDER = re.compile(r'(%s)(\d+)$' % '|'.join(billcore.ITEM_FIELDS))
+PARAGRAPH_END = re.compile(r'</w:p>')
+# Breaks and tabs inside a paragraph, which separate words as much as a paragraph end does
+BREAK = re.compile(r'<w:(?:br|cr)\b[^>]*>')
+TAB = re.compile(r'<w:tab\b[^>]*>')
+TAG = re.compile(r'<[^>]+>')
+
+
+def document_text(path):
+    """The main document's text, one line per paragraph, with Word's run splits joined up."""
+    with zipfile.ZipFile(path) as z:
+        xml = z.read('word/document.xml').decode('utf-8')
+    xml = TAB.sub('\t', BREAK.sub('\n', PARAGRAPH_END.sub('\n', xml)))
+    return TAG.sub('', xml)
+
+
+class TemplateSchema:
+    """The placeholders one template uses, read from the document once.
+
+    ``style`` is 'keyword' for the v1.5 templates (bare CLIENTNAME ...
+    TOTAL, with a line-item row repeated per item) or 'braces' for the
+    v1.2-v1.4 ones ({{name}} ... {{total}}, with ``item_rows`` fixed item
+    rows). ``placeholders`` maps each bill key the template shows to the
+    text standing for it in the document.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        text = document_text(path)
+        braces = [m.group(1) for m in BRACE_PLACEHOLDER.finditer(text)]
+        if braces:
+            self.style = 'braces'
+            self.placeholders = {BRACE_KEYS.get(name, name): f'{{{{{name}}}}}' for name in braces}
+            self.item_fields = ()
+        else:
+            self.style = 'keyword'
+            found = set(KEYWORD_PLACEHOLDER.findall(text))
+            self.placeholders = {key: key for key in billcore.TEMPLATE_KEYS if key in found}
+            self.item_fields = billcore.ITEM_FIELDS
+        self.item_rows = max((int(m.group(2)) for m in map(ITEM_PLACEHOLDER.match, self.placeholders) if m),
+                             default=0)
+
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return True
+
+    def keys(self):
+        # A keyword template is compiled exactly as billcore.load_template does, so the two share it
+        return billcore.TEMPLATE_KEYS if self.style == 'keyword' else list(self.placeholders.values())
+
+    def fill(self, data):
+        """Bill data (billcore.build_bill_data) in the template's own placeholders."""
+        if self.style == 'keyword':
+            return data
+        rows = billtemplate.item_count(data, billcore.ITEM_FIELDS)
+        # Rows padded on by build_bill_data are blank and don't need a slot
+        used = max((i for i in range(1, rows + 1)
+                    if data[f'description{i}'] or data[f'quantity{i}'] not in ('', '0')), default=0)
+        if used > self.item_rows:
+            raise ValueError(f"Template {self.name!r} has room for {self.item_rows} items, the bill has {used}")
+        return {text: data.get(key, '') for key, text in self.placeholders.items()}
+
+
+class FilledTemplate:
+    """A compiled template of another generation, taking bill data in billcore's keys."""
+
+    def __init__(self, schema, template):
+        self.schema = schema
+        self.template = template
+        self.digest = template.digest
+
+    def save(self, data, stream):
+        self.template.save(self.schema.fill(data), stream)
+
+
+def read_schema(name, path):
+    """The schema of a template file; None if it can't be read or has no placeholders."""
+    try:
+        schema = TemplateSchema(name, path)
+    except (OSError, KeyError, UnicodeDecodeError, zipfile.BadZipFile):
+        return None
+    return schema if schema.placeholders else None
+
+
+class TemplateRegistry:
+    """The templates in a directory by name, each with its placeholder schema read once.
+
+    Names are file names without ".docx"; documents without placeholders
+    (rendered bills) are left out. A record with no template name gets
+    ``default``. Compiled templates come from billtemplate's cache, so
+    records switching between templates never reload one, and one edited on
+    disk is recompiled. A template whose file has changed has its schema read
+    again, and the directory is scanned again when a record names a template
+    it doesn't have and the directory has changed since the last scan, so a
+    long-running service picks up templates added or edited meanwhile
+    without unknown names costing more than a stat.
+    """
+
+    def __init__(self, directory=None, default=None):
+        self.default = os.path.abspath(default or billcore.resource_path(billcore.TEMPLATE_NAME))
+        self.directory = os.path.abspath(directory or os.path.dirname(self.default))
+        self._lock = threading.Lock()
+        self._default_schema = None
+        self.scan()
+
+    def scan(self):
+        # Taken first, so a file added while scanning is caught by the next scan
+        self._scanned = self.directory_mtime()
+        schemas = {}
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            name, ext = os.path.splitext(entry.name)
+            if ext.lower() != '.docx' or name.startswith('~$') or not entry.is_file():
+                continue
+            schema = read_schema(name, entry.path)
+            if schema is not None:
+                schemas[name] = schema
+        self.schemas = schemas
+
+    def directory_mtime(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reread(self, schema):
+        """Read a schema whose file changed again; None once it is gone or no longer a template."""
+        fresh = read_schema(schema.name, schema.path)
+        # Replaced rather than changed in place, as names() reads it without the lock
+        schemas = dict(self.schemas)
+        if fresh is None:
+            del schemas[schema.name]
+        else:
+            schemas[schema.name] = fresh
+        self.schemas = schemas
+        return fresh
+
+    def names(self):
+        return list(self.schemas)
+
+    def schema(self, name=None):
+        if name:
+            name = name[:-len('.docx')] if name.lower().endswith('.docx') else name
+            with self._lock:
+                schema = self.schemas.get(name)
+                if schema is not None and schema.is_stale():
+                    schema = self.reread(schema)
+                if schema is None and self.directory_mtime() != self._scanned:
+                    # Templates added, renamed or removed since the last scan
+                    self.scan()
+                    schema = self.schemas.get(name)
+            if schema is None:
+                raise ValueError(f"Unknown template {name!r}; {self.directory} has "
+                                 f"{', '.join(map(repr, self.schemas)) or 'none'}")
+            return schema
+        with self._lock:
+            if self._default_schema is None or self._default_schema.is_stale():
+                if not os.path.exists(self.default):
+                    raise FileNotFoundError(f"Template not found: {self.default}")
+                self._default_schema = TemplateSchema(os.path.splitext(os.path.basename(self.default))[0],
+                                                      self.default)
+            return self._default_schema
+
+    def renderer(self, name=None, backend='docx', native_pdf=False):
+        """What renders a bill with the named template: a compiled template taking
+        build_bill_data's keys, or the native PDF renderer with its letterhead."""
+        schema = self.schema(name)
+        if native_pdf:
+            # The native renderer draws the v1.5 layout; only the letterhead comes from the template
+            if schema.style != 'keyword':
+                raise ValueError(f"Template {schema.name!r} can't be drawn by the native PDF engine; "
+                                 "use --pdf-engine convert")
+            return billpdfnative.get_renderer(schema.path)
+        renderer = billtemplate.get_template(schema.path, schema.keys(), billcore.RENDER_BACKENDS[backend],
+                                             schema.item_fields)
+        return renderer if schema.style == 'keyword' else FilledTemplate(schema, renderer)
+
+    def for_record(self, record, backend='docx', native_pdf=False):
+        return self.renderer(str(record.get(TEMPLATE_FIELD) or '').strip(), backend, native_pdf)
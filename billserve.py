@@ -0,0 +1,492 @@
+"""Bill rendering over HTTP, for systems that would otherwise hand their data to someone to retype.
+
+    python billmakerv1-5.py serve [--port 8750] [--workers N] [--queue 64]
+
+POST /invoices takes one record as JSON, in the batch JSONL format (the
+template keywords, CURRENCY/DISCOUNT/TAX and an "items" list of
+{"description", "quantity", "price"}), and answers with the rendered bill.
+``?format=pdf`` (or ``Accept: application/pdf``) asks for a PDF instead of
+Word, and ``?engine=native|convert`` picks how it is made. A "TEMPLATE"
+key picks a template from ``--templates`` by name.
+
+POST /invoices/batch takes many records, as JSON lines or a JSON array, and
+streams back one JSON line per record in input order: {"index", "filename",
+"content_type", "content" (base64)} or {"index", "error"}. JSON lines
+bodies are read as the service catches up, so a long batch never sits in
+memory.
+
+GET /health reports the queue and, once a PDF has been converted, the
+converter pool's queue depth, throughput, retries and timeouts.
+
+Bills are rendered on a pool of worker processes, each with the template
+loaded once, and converted to PDF on the shared converter pool. At most
+``--queue`` bills are queued or in progress at a time. A single invoice
+that finds the queue full gets 503 with Retry-After; a batch waits for room
+and stops reading its request body meanwhile.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import os
+import sys
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+import billbatch
+import billcache
+import billcore
+import billmoney
+import billpdf
+import billregistry
+
+DEFAULT_PORT = 8750
+DEFAULT_QUEUE = 64
+# Largest body accepted for one invoice, or for a batch sent as a JSON array
+MAX_BODY = 1024 * 1024
+MAX_BATCH_BODY = 64 * 1024 * 1024
+# Bills of one batch rendered ahead of the one being sent back
+BATCH_WINDOW = 16
+WRITE_CHUNK = 64 * 1024
+RETRY_AFTER = 1
+
+CONTENT_TYPES = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pdf': 'application/pdf',
+}
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+# Worker processes: the render cache and the template registry
+_worker_cache = None
+_worker_templates = None
+
+
+def _init_worker(template_dir, template_path, backend, cache_settings):
+    global _worker_cache, _worker_templates
+    if cache_settings:
+        _worker_cache = billcache.RenderCache(*cache_settings)
+    _worker_templates = billregistry.TemplateRegistry(template_dir, template_path)
+    # The first request shouldn't pay for loading the default template and fonts
+    for native_pdf in (False, True):
+        try:
+            _worker_templates.renderer(None, backend, native_pdf)
+        except Exception:
+            pass
+
+
+def _render(record, output, backend):
+    """Render one record in a worker process.
+
+    Returns (content, needs converting, PDF cache key): for a converted PDF
+    the content is the DOCX to convert, unless the PDF came from the cache.
+    """
+    data = billcore.build_bill_data(billbatch.record_fields(record), billbatch.record_items(record))
+    template = _worker_templates.for_record(record, backend, output == 'native')
+    if output == 'native':
+        return billcore.cached_render(data, template, _worker_cache, 'pdf'), False, None
+    if output == 'docx':
+        return billcore.cached_render(data, template, _worker_cache), False, None
+    key = billcore.pdf_cache_key(data, template, _worker_cache)
+    if key is not None:
+        content = _worker_cache.read(key)
+        if content is not None:
+            return content, False, None
+    return billcore.cached_render(data, template, _worker_cache), True, key
+
+
+class Request:
+    def __init__(self, method, target, version, headers, reader, writer):
+        self.method = method
+        url = urllib.parse.urlsplit(target)
+        self.path = url.path
+        self.query = dict(urllib.parse.parse_qsl(url.query))
+        self.version = version
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        try:
+            self.remaining = 0 if self.chunked else int(headers.get('content-length') or 0)
+        except ValueError:
+            self.remaining = -1
+        if self.remaining < 0:
+            raise HttpError(400, f"Invalid Content-Length {headers['content-length']!r}")
+        self.finished = False
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        return connection == 'keep-alive' if self.version == 'HTTP/1.0' else connection != 'close'
+
+    async def chunks(self):
+        """The rest of the request body as it arrives; may be picked up again after a break."""
+        if self.headers.get('expect', '').lower() == '100-continue' and not self.finished:
+            self.headers.pop('expect')
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        while self.chunked and not self.finished:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Trailers end with a blank line
+                while (await self.reader.readline()).strip():
+                    pass
+                self.finished = True
+                return
+            chunk = await self.reader.readexactly(size)
+            await self.reader.readexactly(2)
+            yield chunk
+        while self.remaining:
+            chunk = await self.reader.read(min(self.remaining, WRITE_CHUNK))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', self.remaining)
+            self.remaining -= len(chunk)
+            yield chunk
+
+    async def body(self, limit):
+        parts = []
+        size = 0
+        async for chunk in self.chunks():
+            size += len(chunk)
+            if size > limit:
+                raise HttpError(413, f"Request body is over {limit} bytes")
+            parts.append(chunk)
+        return b''.join(parts)
+
+    async def discard(self):
+        async for _ in self.chunks():
+            pass
+
+
+async def read_request(reader, writer):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return Request(method, target, version, headers, reader, writer)
+
+
+def response_head(status, headers):
+    lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}']
+    lines += [f'{name}: {value}' for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def send(writer, status, body, content_type, headers=(), keep_alive=True):
+    writer.write(response_head(status, [('Content-Type', content_type), ('Content-Length', len(body)),
+                                        ('Connection', 'keep-alive' if keep_alive else 'close'),
+                                        *headers]))
+    # Written piecewise so a slow client holds back this response rather than filling memory
+    view = memoryview(body)
+    for start in range(0, len(body), WRITE_CHUNK):
+        writer.write(view[start:start + WRITE_CHUNK])
+        await writer.drain()
+    await writer.drain()
+
+
+async def send_json(writer, status, value, headers=(), keep_alive=True):
+    await send(writer, status, json.dumps(value).encode('utf-8'), 'application/json', headers, keep_alive)
+
+
+def parse_record(text):
+    try:
+        record = json.loads(text)
+    except ValueError as e:
+        raise HttpError(400, f"Invalid JSON: {e}") from None
+    if not isinstance(record, dict):
+        raise HttpError(400, "A bill must be a JSON object")
+    return record
+
+
+class RenderService:
+    """Renders bills for HTTP requests on worker processes and the converter pool."""
+
+    def __init__(self, workers=1, queue_size=DEFAULT_QUEUE, template_path=None, backend='docx',
+                 pdf_engine='convert', cache=None, template_dir=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.template_path = template_path
+        self.backend = backend
+        self.pdf_engine = pdf_engine
+        self.cache = cache
+        self.jobs = 0
+        self.counts = collections.Counter()
+        self.executor = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                            initargs=(template_dir, template_path, backend,
+                                                      cache and (cache.directory, cache.max_bytes)))
+        self.slots = None
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def output(self, request):
+        """'docx', 'native' or 'convert' for the format and engine a request asks for."""
+        fmt = request.query.get('format')
+        if fmt is None:
+            fmt = 'pdf' if 'application/pdf' in request.headers.get('accept', '') else 'docx'
+        if fmt not in CONTENT_TYPES:
+            raise HttpError(400, f"Unknown format {fmt!r}; use docx or pdf")
+        engine = request.query.get('engine', self.pdf_engine)
+        if engine not in billcore.PDF_ENGINES:
+            raise HttpError(400, f"Unknown engine {engine!r}; use {' or '.join(billcore.PDF_ENGINES)}")
+        return 'docx' if fmt == 'docx' else engine
+
+    async def render(self, record, output):
+        """Render one record, holding a queue slot while it waits and while it renders."""
+        await self.slots.acquire()
+        self.jobs += 1
+        try:
+            loop = asyncio.get_running_loop()
+            content, convert, key = await loop.run_in_executor(self.executor, _render, record, output,
+                                                               self.backend)
+            if convert:
+                content = await self.convert(content, key)
+            self.counts['rendered'] += 1
+            return content
+        except Exception:
+            self.counts['failed'] += 1
+            raise
+        finally:
+            self.jobs -= 1
+            self.slots.release()
+
+    async def convert(self, docx, key):
+        return await asyncio.wrap_future(billcore.convert_docx(docx, billpdf.get_pool(), self.cache, key))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, writer)
+                    if request is None:
+                        break
+                    await self.dispatch(request, writer)
+                except HttpError as e:
+                    await send_json(writer, e.status, {'error': str(e)}, e.headers, keep_alive=False)
+                    break
+                # The body must be used up before the next request on this connection
+                await request.discard()
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request, writer):
+        routes = {'/invoices': ('POST', self.invoice), '/invoices/batch': ('POST', self.batch),
+                  '/health': ('GET', self.health)}
+        if request.path not in routes:
+            raise HttpError(404, f"No such endpoint: {request.path}")
+        method, handler = routes[request.path]
+        if request.method != method:
+            raise HttpError(405, f"{request.path} takes {method}", [('Allow', method)])
+        await handler(request, writer)
+
+    async def health(self, request, writer):
+        await send_json(writer, 200, {
+            'status': 'ok', 'jobs': self.jobs, 'queue_size': self.queue_size, 'workers': self.workers,
+            **self.counts, 'converter': billpdf.pool_stats(),
+        }, keep_alive=request.keep_alive)
+
+    async def invoice(self, request, writer):
+        output = self.output(request)
+        record = parse_record(await request.body(MAX_BODY))
+        if self.slots.locked():
+            self.counts['rejected'] += 1
+            raise HttpError(503, "Render queue is full", [('Retry-After', RETRY_AFTER)])
+        try:
+            content = await self.render(record, output)
+        except billmoney.MoneyError as e:
+            await send_json(writer, 422, {'error': str(e), 'problems': e.problems},
+                            keep_alive=request.keep_alive)
+            return
+        except ValueError as e:
+            # An unknown template, or more items than a fixed-row template holds
+            await send_json(writer, 422, {'error': str(e)}, keep_alive=request.keep_alive)
+            return
+        except Exception as e:
+            await send_json(writer, 500, {'error': str(e)}, keep_alive=request.keep_alive)
+            return
+        fmt = 'docx' if output == 'docx' else 'pdf'
+        filename = billbatch.output_name(record, 0, '.' + fmt)
+        await send(writer, 200, content, CONTENT_TYPES[fmt],
+                   [('Content-Disposition', f'attachment; filename="{filename}"')], request.keep_alive)
+
+    async def records(self, request):
+        """Records of a batch body: JSON lines as they arrive, or a whole JSON array."""
+        pending = b''
+        first = True
+        async for chunk in request.chunks():
+            if first and chunk.lstrip()[:1] == b'[':
+                rest = await request.body(MAX_BATCH_BODY - len(chunk))
+                try:
+                    records = json.loads(chunk + rest)
+                except ValueError as e:
+                    raise HttpError(400, f"Invalid JSON: {e}") from None
+                if not isinstance(records, list):
+                    raise HttpError(400, "A batch must be JSON lines or a JSON array")
+                # All checked before any is answered, so a bad entry fails the batch with a 400
+                for index, record in enumerate(records, 1):
+                    if not isinstance(record, dict):
+                        raise HttpError(400, f"Entry {index} of the batch is not a JSON object")
+                for record in records:
+                    yield record
+                return
+            first = first and not chunk.strip()
+            pending += chunk
+            *lines, pending = pending.split(b'\n')
+            if len(pending) > MAX_BODY:
+                raise HttpError(413, f"A bill in the batch is over {MAX_BODY} bytes")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
+
+    async def batch(self, request, writer):
+        output = self.output(request)
+        fmt = 'docx' if output == 'docx' else 'pdf'
+        window = asyncio.Semaphore(BATCH_WINDOW)
+        results = asyncio.Queue()
+
+        async def one(index, entry):
+            try:
+                record = entry if isinstance(entry, dict) else parse_record(entry)
+                content = await self.render(record, output)
+            except billmoney.MoneyError as e:
+                return {'index': index, 'error': str(e), 'problems': e.problems}
+            except Exception as e:
+                return {'index': index, 'error': str(e)}
+            return {'index': index, 'filename': billbatch.output_name(record, index, '.' + fmt),
+                    'content_type': CONTENT_TYPES[fmt], 'content': base64.b64encode(content).decode('ascii')}
+
+        async def produce():
+            # Stops reading the body while the window or the service queue is full
+            try:
+                index = 0
+                async for entry in self.records(request):
+                    index += 1
+                    await window.acquire()
+                    results.put_nowait(asyncio.ensure_future(one(index, entry)))
+            except HttpError as e:
+                results.put_nowait(e)
+            except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+                # The records read so far are still answered
+                results.put_nowait({'index': None, 'error': str(e) or type(e).__name__})
+            finally:
+                results.put_nowait(None)
+
+        producer = asyncio.ensure_future(produce())
+        started = False
+        try:
+            while True:
+                item = await results.get()
+                if isinstance(item, HttpError):
+                    if not started:
+                        # Refused before any bill was read: the whole batch gets the error's status
+                        raise item
+                    item = {'index': None, 'error': str(item)}
+                if not started:
+                    writer.write(response_head(200, [('Content-Type', 'application/x-ndjson'),
+                                                     ('Transfer-Encoding', 'chunked'),
+                                                     ('Connection', 'keep-alive' if request.keep_alive else 'close')]))
+                    started = True
+                if item is None:
+                    break
+                if isinstance(item, asyncio.Future):
+                    item = await item
+                    window.release()
+                line = json.dumps(item).encode('utf-8') + b'\n'
+                writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+                await writer.drain()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            producer.cancel()
+
+    async def serve(self, host, port):
+        self.slots = asyncio.Semaphore(self.queue_size)
+        # Start the workers, and so load their templates, before taking requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid) for _ in range(self.workers)))
+        server = await asyncio.start_server(self.handle, host, port)
+        names = ', '.join(f'http://{s.getsockname()[0]}:{s.getsockname()[1]}' for s in server.sockets)
+        print(f"Serving bills on {names}", file=sys.stderr, flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='billmaker serve',
+                                     description='Render bills for other systems over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: this machine only)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes rendering bills (default: one per core)')
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE,
+                        help='bills queued or in progress before new invoices are turned away')
+    parser.add_argument('--template', help=f'template path (default: {billcore.TEMPLATE_NAME})')
+    parser.add_argument('--templates', metavar='DIR',
+                        help=f'templates a bill can pick by name with a {billregistry.TEMPLATE_FIELD} key '
+                             '(default: the directory of --template)')
+    parser.add_argument('--backend', choices=sorted(billcore.RENDER_BACKENDS), default='docx',
+                        help='render through python-docx or rewrite the document XML directly')
+    parser.add_argument('--pdf-engine', choices=billcore.PDF_ENGINES, default='convert',
+                        help='how PDFs are made when a request does not say')
+    parser.add_argument('--cache', nargs='?', const=billcache.default_dir(), metavar='DIR',
+                        help=f'reuse bills rendered before from a render cache (default: {billcache.default_dir()})')
+    parser.add_argument('--convert-timeout', type=float, metavar='SECONDS',
+                        help='kill a PDF conversion running longer than this '
+                             f'(default: {billpdf.CONVERT_TIMEOUT:g}, 0 for no limit)')
+    parser.add_argument('--dead-letter', metavar='DIR',
+                        help='keep the documents that failed to convert here '
+                             f'(default: {billpdf.default_dead_letter_dir()})')
+    args = parser.parse_args(argv)
+    billpdf.configure(timeout=args.convert_timeout, dead_letter_dir=args.dead_letter)
+
+    template = args.template or billcore.resource_path(billcore.TEMPLATE_NAME)
+    if not os.path.exists(template):
+        print(f"error: Template not found: {template}", file=sys.stderr)
+        return 1
+    if args.templates and not os.path.isdir(args.templates):
+        print(f"error: Not a directory: {args.templates}", file=sys.stderr)
+        return 1
+    service = None
+    try:
+        service = RenderService(max(1, args.workers), max(1, args.queue), args.template, args.backend,
+                                args.pdf_engine, billcache.RenderCache(args.cache) if args.cache else None,
+                                args.templates)
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if service is not None:
+            service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
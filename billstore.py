@@ -0,0 +1,186 @@
+import datetime
+import json
+import os
+import sqlite3
+
+BILL_PREFIX = 'INV-'
+BILL_DIGITS = 6
+# Date formats tried on BILLDATE/DUEDATE before falling back to today
+DATE_FORMATS = ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%d/%m/%y']
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL UNIQUE,
+    address TEXT NOT NULL DEFAULT '',
+    last_used TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    bill_number TEXT NOT NULL UNIQUE,
+    client_id INTEGER NOT NULL REFERENCES clients(id),
+    bill_date TEXT NOT NULL,
+    due_date TEXT,
+    total TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invoices_client ON invoices(client_id, bill_date);
+CREATE INDEX IF NOT EXISTS invoices_date ON invoices(bill_date);
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    prefix TEXT NOT NULL,
+    digits INTEGER NOT NULL,
+    next INTEGER NOT NULL
+);
+"""
+
+
+def default_path():
+    return os.environ.get('BILLMAKER_DB') or os.path.join(os.path.expanduser('~'), '.billmaker',
+                                                          'invoices.db')
+
+
+def iso_date(text):
+    text = (text or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def _prefix_bound(prefix):
+    # Every key starting with prefix sorts below prefix + U+10FFFF
+    return prefix + '\U0010ffff'
+
+
+class InvoiceStore:
+    """Issued bills kept in an embedded SQLite database.
+
+    Bill numbers come from a counter that is read, used and advanced inside
+    the same write transaction as the invoice insert, so concurrent writers
+    (other windows, batch runs) never get the same number and a number is
+    only consumed by an invoice that was actually stored. Client names are
+    kept case-folded under a unique index so name prefixes resolve with an
+    index range scan.
+
+    A store holds one connection and is meant for the thread that opened it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Transactions are managed explicitly below
+        self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        self.db.executescript(SCHEMA)
+        self.db.execute("INSERT OR IGNORE INTO sequences VALUES ('bill', ?, ?, 1)", (BILL_PREFIX, BILL_DIGITS))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _format(self, prefix, digits, n):
+        return f'{prefix}{n:0{digits}d}'
+
+    def next_bill_number(self):
+        """The number the next automatically numbered bill will get (not reserved)."""
+        prefix, digits, n = self.db.execute(
+            "SELECT prefix, digits, next FROM sequences WHERE name = 'bill'").fetchone()
+        return self._format(prefix, digits, n)
+
+    def _take_bill_number(self):
+        prefix, digits, n = self.db.execute(
+            "SELECT prefix, digits, next FROM sequences WHERE name = 'bill'").fetchone()
+        # Skip numbers someone typed in by hand
+        while self.db.execute('SELECT 1 FROM invoices WHERE bill_number = ?',
+                              (self._format(prefix, digits, n),)).fetchone():
+            n += 1
+        self.db.execute("UPDATE sequences SET next = ? WHERE name = 'bill'", (n + 1,))
+        return self._format(prefix, digits, n)
+
+    def _client_id(self, name, address, now):
+        key = name.strip().casefold()
+        self.db.execute(
+            'INSERT INTO clients (name, name_key, address, last_used) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(name_key) DO UPDATE SET name = excluded.name, address = excluded.address, '
+            'last_used = excluded.last_used', (name.strip(), key, address, now))
+        return self.db.execute('SELECT id FROM clients WHERE name_key = ?', (key,)).fetchone()[0]
+
+    def save_invoice(self, fields, items, total=''):
+        """Store a bill and return its bill number.
+
+        A blank BILLNUMBER is assigned from the counter; an existing bill
+        number is re-issued, replacing the stored copy.
+        """
+        now = _now()
+        fields = dict(fields)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            if not fields.get('BILLNUMBER', '').strip():
+                fields['BILLNUMBER'] = self._take_bill_number()
+            number = fields['BILLNUMBER'].strip()
+            client = self._client_id(fields.get('CLIENTNAME', ''), fields.get('CLIENTADDRESS', ''), now)
+            data = json.dumps({'fields': fields, 'items': [list(item) for item in items]})
+            self.db.execute(
+                'INSERT INTO invoices (bill_number, client_id, bill_date, due_date, total, data, '
+                'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(bill_number) DO UPDATE SET client_id = excluded.client_id, '
+                'bill_date = excluded.bill_date, due_date = excluded.due_date, total = excluded.total, '
+                'data = excluded.data, updated_at = excluded.updated_at',
+                (number, client, iso_date(fields.get('BILLDATE')) or now[:10],
+                 iso_date(fields.get('DUEDATE')), str(total), data, now, now))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return number
+
+    def get_invoice(self, bill_number):
+        """Return (fields, items) of a stored bill, or None."""
+        row = self.db.execute('SELECT data FROM invoices WHERE bill_number = ?',
+                              (bill_number.strip(),)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        return data['fields'], [tuple(item) for item in data['items']]
+
+    def find_clients(self, prefix, limit=10):
+        """[(name, address), ...] of clients whose name starts with prefix, ignoring case."""
+        key = prefix.strip().casefold()
+        if not key:
+            return []
+        return self.db.execute(
+            'SELECT name, address FROM clients WHERE name_key >= ? AND name_key < ? '
+            'ORDER BY name_key LIMIT ?', (key, _prefix_bound(key), limit)).fetchall()
+
+    def client_history(self, name):
+        """[(bill number, bill date, total), ...] for one client, newest first."""
+        return self.db.execute(
+            'SELECT i.bill_number, i.bill_date, i.total FROM invoices i '
+            'JOIN clients c ON c.id = i.client_id WHERE c.name_key = ? '
+            'ORDER BY i.bill_date DESC, i.id DESC', (name.strip().casefold(),)).fetchall()
+
+    def invoices_between(self, start, end):
+        """[(bill number, client, bill date, total), ...] with start <= bill date <= end (ISO dates)."""
+        return self.db.execute(
+            'SELECT i.bill_number, c.name, i.bill_date, i.total FROM invoices i '
+            'JOIN clients c ON c.id = i.client_id WHERE i.bill_date BETWEEN ? AND ? '
+            'ORDER BY i.bill_date, i.id', (start, end)).fetchall()
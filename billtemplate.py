@@ -0,0 +1,360 @@
+import copy
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+
+import billtrace
+
+# python-docx (and lxml under it) is imported on first compile, keeping it off the app's startup path
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_P = f'{{{W_NS}}}p'
+W_R = f'{{{W_NS}}}r'
+W_TR = f'{{{W_NS}}}tr'
+
+ITEM_KEY = re.compile(r'(\D+)(\d+)$')
+
+
+def split_package(raw, part_name):
+    """Copy every part of a .docx zip except part_name into a new zip.
+
+    Returns (zip bytes, the part's ZipInfo, the part's content); the part
+    is added back per document by ``write_package``.
+    """
+    prefix = io.BytesIO()
+    info = content = None
+    with zipfile.ZipFile(io.BytesIO(raw)) as src, zipfile.ZipFile(prefix, 'w') as dst:
+        for entry in src.infolist():
+            if entry.filename == part_name:
+                info, content = entry, src.read(entry)
+            else:
+                dst.writestr(entry, src.read(entry))
+    return prefix.getvalue(), info, content
+
+
+def write_package(prefix, info, content, stream):
+    buf = io.BytesIO(prefix)
+    buf.seek(0, io.SEEK_END)
+    with zipfile.ZipFile(buf, 'a') as z:
+        z.writestr(info, content)
+    stream.write(buf.getbuffer())
+
+
+def placeholder_pattern(keys):
+    """One alternation for all keys; longest first so description10 wins over description1."""
+    ordered = sorted(set(keys), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(key) for key in ordered))
+
+
+def index_paragraph(matcher, runs):
+    """Find placeholders in one paragraph given its [(run position, run text), ...].
+
+    Returns (run position, [(literal before, key), ...], trailing literal)
+    for every run whose text changes. A placeholder that Word split over
+    several runs is written into the run where it starts and its remaining
+    fragments are dropped.
+    """
+    joined = ''.join(text for _, text in runs)
+    matches = list(matcher.finditer(joined))
+    if not matches:
+        return []
+
+    slots = []
+    start = 0
+    for pos, text in runs:
+        end = start + len(text)
+        pieces = []
+        cursor = start
+        for m in matches:
+            if m.end() <= start or m.start() >= end:
+                continue
+            if m.start() >= start:
+                pieces.append((joined[cursor:m.start()], m.group()))
+            cursor = min(m.end(), end)
+        if pieces or cursor != start:
+            slots.append((pos, pieces, joined[cursor:end]))
+        start = end
+    return slots
+
+
+def placeholder_map(slots):
+    placeholders = {}
+    for pos, pieces, _ in slots:
+        for _, key in pieces:
+            placeholders.setdefault(key, []).append(pos)
+    return placeholders
+
+
+def slot_text(pieces, tail, data):
+    out = []
+    for literal, key in pieces:
+        out.append(literal)
+        out.append(str(data[key]) if key in data else key)
+    out.append(tail)
+    return ''.join(out)
+
+
+def split_item_row(slots, row_of, item_fields):
+    """Separate the slots of the repeating line-item row from the rest of the document.
+
+    The item row is the table row holding the first item field numbered 1
+    (``description1``). Other rows holding numbered item fields are the
+    template's extra fixed slots and are dropped; the item row is cloned once
+    per line item instead. Returns (document slots, item row, item row slots,
+    dropped rows); item row slot pieces are (literal, key, is item field).
+    """
+    def item_field(key):
+        m = ITEM_KEY.match(key)
+        return m.groups() if m and m.group(1) in item_fields else (None, None)
+
+    item_row = None
+    for pos, pieces, _ in slots:
+        for _, key in pieces:
+            if item_fields and item_field(key) == (item_fields[0], '1') and row_of(pos) is not None:
+                item_row = row_of(pos)
+    if item_row is None:
+        return slots, None, [], set()
+
+    dropped = set()
+    for pos, pieces, _ in slots:
+        row = row_of(pos)
+        if row not in (None, item_row) and any(item_field(key)[0] for _, key in pieces):
+            dropped.add(row)
+
+    document_slots = []
+    row_slots = []
+    for pos, pieces, tail in slots:
+        row = row_of(pos)
+        if row == item_row:
+            row_slots.append((pos, [(literal, item_field(key)[0] or key, bool(item_field(key)[0]))
+                                    for literal, key in pieces], tail))
+        elif row not in dropped:
+            document_slots.append((pos, pieces, tail))
+    return document_slots, item_row, row_slots, dropped
+
+
+def item_count(data, item_fields):
+    count = 0
+    while f"{item_fields[0]}{count + 1}" in data:
+        count += 1
+    return count
+
+
+def item_slot_text(pieces, tail, data, number):
+    return slot_text([(literal, f"{key}{number}" if item else key) for literal, key, item in pieces],
+                     tail, data)
+
+
+def slot_counts(slots, item_slots):
+    """(runs, placeholders) rewritten per render outside and inside the line-item row."""
+    return (len(slots), sum(len(pieces) for _, pieces, _ in slots),
+            len(item_slots), sum(len(pieces) for _, pieces, _ in item_slots))
+
+
+def count_render(counts, data, item_fields):
+    if billtrace.current() is None:
+        return
+    runs, placeholders, item_runs, item_placeholders = counts
+    items = item_count(data, item_fields) if item_fields else 0
+    billtrace.count('runs_touched', runs + items * item_runs)
+    billtrace.count('placeholders_replaced', placeholders + items * item_placeholders)
+    billtrace.count('line_items', items)
+
+
+class CompiledTemplate:
+    """A template parsed once, with the runs holding each placeholder indexed up front.
+
+    Every render works on a deep copy of the document XML, so the parsed
+    template is never modified and only the indexed runs are touched. When
+    ``item_fields`` are given and the template has a line-item row, that row
+    is cloned once per item.
+    """
+
+    def __init__(self, template_path, keys, item_fields=()):
+        self.path = template_path
+        self.keys = list(keys)
+        self.item_fields = tuple(item_fields)
+        self._lock = threading.Lock()
+        self.compile()
+
+    def compile(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Template not found: {self.path}")
+        self.mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        # Identifies the template's content for the render cache
+        self.digest = hashlib.sha256(raw).hexdigest()
+        self._raw = raw
+        self._package = None
+        from docx import Document
+        self._doc = Document(io.BytesIO(raw))
+        self._part = self._doc.part
+        self._root = self._part.element
+
+        self.matcher = placeholder_pattern(self.keys)
+
+        # Group runs by their paragraph so placeholders that Word split
+        # across several runs are matched on the joined paragraph text.
+        paragraphs = {}
+        run_rows = []
+        first_run = {}
+        rows = {row: index for index, row in enumerate(self._root.iter(W_TR))}
+        for pos, run in enumerate(self._root.iter(W_R)):
+            p = next(run.iterancestors(W_P), None)
+            paragraphs.setdefault(p, []).append((pos, run.text))
+            row = rows.get(next(run.iterancestors(W_TR), None))
+            run_rows.append(row)
+            first_run.setdefault(row, pos)
+
+        slots = []
+        for runs in paragraphs.values():
+            slots.extend(index_paragraph(self.matcher, runs))
+        self.placeholders = placeholder_map(slots)
+        billtrace.count('paragraphs_scanned', len(paragraphs))
+        billtrace.count('runs_scanned', len(run_rows))
+
+        self.slots, self.item_row, item_slots, dropped = split_item_row(
+            slots, run_rows.__getitem__, self.item_fields)
+        self.dropped_rows = sorted(dropped)
+        # Item row run positions are kept relative to the row's first run
+        start = first_run.get(self.item_row, 0)
+        self.item_slots = [(pos - start, pieces, tail) for pos, pieces, tail in item_slots]
+        self.counts = slot_counts(self.slots, self.item_slots)
+
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return True
+
+    def render(self, data):
+        """Return a substituted copy of the document XML root."""
+        with billtrace.stage('substitute'):
+            root = self._render(data)
+        count_render(self.counts, data, self.item_fields if self.item_row is not None else ())
+        return root
+
+    def _render(self, data, nodes=None):
+        # nodes, when given, collects {key: [(run, pieces, tail, item number), ...]}
+        root = copy.deepcopy(self._root)
+        runs = list(root.iter(W_R))
+        for pos, pieces, tail in self.slots:
+            runs[pos].text = slot_text(pieces, tail, data)
+            if nodes is not None:
+                entry = (runs[pos], pieces, tail, None)
+                for _, key in pieces:
+                    nodes.setdefault(key, []).append(entry)
+
+        if self.item_row is not None:
+            rows = list(root.iter(W_TR))
+            for index in self.dropped_rows:
+                rows[index].getparent().remove(rows[index])
+            row = rows[self.item_row]
+            for number in range(1, item_count(data, self.item_fields) + 1):
+                clone = copy.deepcopy(row)
+                clone_runs = list(clone.iter(W_R))
+                for pos, pieces, tail in self.item_slots:
+                    clone_runs[pos].text = item_slot_text(pieces, tail, data, number)
+                    if nodes is not None:
+                        entry = (clone_runs[pos], pieces, tail, number)
+                        for _, key, item in pieces:
+                            nodes.setdefault(f"{key}{number}" if item else key, []).append(entry)
+                row.addprevious(clone)
+            row.getparent().remove(row)
+        return root
+
+    def save(self, data, stream):
+        self.write(self.render(data), stream)
+
+    def open(self, data):
+        """Render a bill and keep it open for incremental updates."""
+        return RenderedBill(self, data)
+
+    def package(self):
+        """(zip of every part but the main document, that part's ZipInfo), built on first use."""
+        with self._lock:
+            if self._package is None:
+                prefix, info, _ = split_package(self._raw, self._part.partname.lstrip('/'))
+                self._package = (prefix, info)
+            return self._package
+
+    def write(self, root, stream):
+        """Save a rendered XML root as a .docx on the stream."""
+        # The package serialises whatever element the document part holds,
+        # so swap the rendered copy in just for the duration of the save.
+        with billtrace.stage('save'), self._lock:
+            self._part._element = root
+            try:
+                self._doc.save(stream)
+            finally:
+                self._part._element = self._root
+
+
+class RenderedBill:
+    """A rendered bill kept in memory so that edits only rewrite the runs they change.
+
+    ``nodes`` maps each placeholder key to the runs showing it. ``update``
+    compares the new data with the last and rewrites only those runs (a
+    change in the number of line items renders the document again), and
+    ``save`` serialises just the main document part, adding it to the
+    template's other parts, which are zipped once per template.
+    """
+
+    def __init__(self, template, data):
+        self.template = template
+        self._open(data)
+
+    def _open(self, data):
+        template = self.template
+        self.nodes = {}
+        with billtrace.stage('substitute'):
+            self.root = template._render(data, self.nodes)
+        count_render(template.counts, data, template.item_fields if template.item_row is not None else ())
+        self.data = dict(data)
+        self.items = item_count(data, template.item_fields) if template.item_row is not None else 0
+
+    def update(self, data):
+        template = self.template
+        if template.item_row is not None and item_count(data, template.item_fields) != self.items:
+            self._open(data)
+            return
+        with billtrace.stage('substitute'):
+            changed = [key for key in data.keys() | self.data.keys() if data.get(key) != self.data.get(key)]
+            touched = {}
+            for key in changed:
+                for entry in self.nodes.get(key, ()):
+                    touched[id(entry)] = entry
+            for run, pieces, tail, number in touched.values():
+                if number is None:
+                    run.text = slot_text(pieces, tail, data)
+                else:
+                    run.text = item_slot_text(pieces, tail, data, number)
+        self.data = dict(data)
+        billtrace.count('runs_touched', len(touched))
+        billtrace.count('fields_changed', len(changed))
+
+    def save(self, stream):
+        from docx.opc.oxml import serialize_part_xml
+        prefix, info = self.template.package()
+        with billtrace.stage('save'):
+            write_package(prefix, info, serialize_part_xml(self.root), stream)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_template(template_path, keys, factory=CompiledTemplate, item_fields=()):
+    """Return the compiled template for a path, recompiling when the file changes on disk."""
+    path = os.path.abspath(template_path)
+    cache_key = (path, factory, tuple(item_fields))
+    with _cache_lock:
+        template = _cache.get(cache_key)
+        if template is None or template.is_stale() or template.keys != list(keys):
+            with billtrace.stage('load'):
+                template = factory(path, keys, item_fields)
+            _cache[cache_key] = template
+        return template
@@ -0,0 +1,336 @@
+"""Stage timers, counters and optional profiles for bill renders.
+
+Tracing is off until ``configure`` turns it on. While it is off ``job``,
+``stage`` and ``resume`` hand back a shared no-op context manager and
+``count`` returns straight away, so the hooks left in the render path cost
+a function call each.
+
+A job (one exported bill) collects the time spent in each stage and its
+counters on a thread-local Trace. Work handed to another thread or process
+takes the trace along (``hold``/``resume``) and the job is written to the
+sinks once the last piece of it finishes.
+"""
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_sinks = []
+_profile_dir = None
+_memory = False
+_local = threading.local()
+_lock = threading.Lock()
+_profile_ids = itertools.count(1)
+# Callables whose numbers the Prometheus file shows as gauges, by name; see gauges()
+_gauges = {}
+
+
+class Trace:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.started = time.time()
+        self.seconds = None
+        self.stages = {}
+        self.counters = {}
+        self.memory_peak = None
+        self.profile = None
+        self.error = None
+        self._pending = 1
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def hold(self):
+        """Keep the job open for work that finishes later (e.g. a queued conversion)."""
+        with _lock:
+            self._pending += 1
+
+    def release(self):
+        with _lock:
+            self._pending -= 1
+            finished = self._pending == 0
+        if finished:
+            emit(self.record())
+
+    def record(self):
+        record = {'time': self.started, 'job': self.name, **self.labels, 'seconds': self.seconds,
+                  'stages': self.stages, 'counters': self.counters}
+        if self.memory_peak is not None:
+            record['memory_peak'] = self.memory_peak
+        if self.profile:
+            record['profile'] = self.profile
+        if self.error:
+            record['error'] = self.error
+        return record
+
+
+class _Null:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class _Stage:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.trace
+
+    def __exit__(self, *exc):
+        self.trace.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _Job:
+    def __init__(self, name, labels):
+        self.trace = Trace(name, labels)
+
+    def __enter__(self):
+        self.previous = current()
+        _local.trace = self.trace
+        self.profiler = None
+        # The profilers are only imported once asked for, so tracing costs nothing at startup
+        if _profile_dir:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another job's profiler is running (one at a time on Python 3.12+)
+                self.profiler = None
+        if _memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = self.trace
+        trace.seconds = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            trace.profile = os.path.join(_profile_dir,
+                                         f'{trace.name}-{os.getpid()}-{next(_profile_ids)}.prof')
+            self.profiler.dump_stats(trace.profile)
+        if _memory:
+            import tracemalloc
+            trace.memory_peak = tracemalloc.get_traced_memory()[1]
+        if exc is not None:
+            trace.error = str(exc) or exc_type.__name__
+        _local.trace = self.previous
+        trace.release()
+        return False
+
+
+class _Resume:
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = current()
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not self.trace.error:
+            self.trace.error = str(exc) or exc_type.__name__
+        _local.trace = self.previous
+        self.trace.release()
+        return False
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+def job(name, **labels):
+    """Trace one job on this thread; labels are written out with its record."""
+    if not _enabled:
+        return _NULL
+    return _Job(name, labels)
+
+
+def stage(name):
+    """Time a block against the current job."""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL
+    return _Stage(trace, name)
+
+
+def count(name, n=1):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.count(name, n)
+
+
+def resume(trace):
+    """Continue a held trace on this thread (or in the parent process) and release it after."""
+    if trace is None:
+        return _NULL
+    return _Resume(trace)
+
+
+def gauges(name, read):
+    """Show read()'s dict of numbers in the Prometheus file as billmaker_<name>_<key> gauges."""
+    _gauges[name] = read
+
+
+def emit(record):
+    for sink in _sinks:
+        sink.write(record)
+
+
+class JsonLinesSink:
+    """One JSON object per finished job, appended to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _label_text(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+class PrometheusSink:
+    """Running totals in the Prometheus text format, e.g. for node_exporter's textfile collector.
+
+    The file is rewritten at most once every ``interval`` seconds and when
+    the process exits.
+    """
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.jobs = {}
+        self.errors = {}
+        self.seconds = {}
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._written = 0.0
+
+    def write(self, record):
+        name = record['job']
+        with self._lock:
+            self.jobs[name] = self.jobs.get(name, 0) + 1
+            self.errors[name] = self.errors.get(name, 0) + ('error' in record)
+            self.seconds[name] = self.seconds.get(name, 0) + (record['seconds'] or 0)
+            for stage_name, seconds in record['stages'].items():
+                key = (name, stage_name)
+                total, n = self.stages.get(key, (0, 0))
+                self.stages[key] = (total + seconds, n + 1)
+            for counter, n in record['counters'].items():
+                key = (name, counter)
+                self.counters[key] = self.counters.get(key, 0) + n
+            if time.monotonic() - self._written >= self.interval:
+                self._flush()
+
+    def _flush(self):
+        lines = ['# HELP billmaker_jobs_total Finished jobs.',
+                 '# TYPE billmaker_jobs_total counter']
+        lines += [f'billmaker_jobs_total{{job="{name}"}} {n}' for name, n in sorted(self.jobs.items())]
+        lines += ['# HELP billmaker_job_errors_total Jobs that raised an error.',
+                  '# TYPE billmaker_job_errors_total counter']
+        lines += [f'billmaker_job_errors_total{{job="{name}"}} {n}' for name, n in sorted(self.errors.items())]
+        lines += ['# HELP billmaker_job_seconds_total Wall time spent in jobs.',
+                  '# TYPE billmaker_job_seconds_total counter']
+        lines += [f'billmaker_job_seconds_total{{job="{name}"}} {s:.6f}' for name, s in sorted(self.seconds.items())]
+        lines += ['# HELP billmaker_stage_seconds Time spent in each rendering stage.',
+                  '# TYPE billmaker_stage_seconds summary']
+        for (name, stage_name), (total, n) in sorted(self.stages.items()):
+            labels = _label_text([('job', name), ('stage', stage_name)])
+            lines.append(f'billmaker_stage_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'billmaker_stage_seconds_count{{{labels}}} {n}')
+        lines += ['# HELP billmaker_events_total Counted rendering events.',
+                  '# TYPE billmaker_events_total counter']
+        for (name, counter), n in sorted(self.counters.items()):
+            lines.append(f'billmaker_events_total{{{_label_text([("job", name), ("event", counter)])}}} {n}')
+        for name, read in sorted(_gauges.items()):
+            for key, value in sorted(read().items()):
+                lines += [f'# TYPE billmaker_{name}_{key} gauge', f'billmaker_{name}_{key} {value}']
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.path)
+        self._written = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+
+def _close_sinks():
+    for sink in _sinks:
+        sink.close()
+
+
+def configure(jsonl=None, prometheus=None, profile_dir=None, memory=False, enabled=None):
+    """Turn tracing on or off; it is on when there is a sink or profile directory, or ``enabled``.
+
+    Memory peaks are only written to the sinks, so ``memory`` without one is
+    refused with ValueError rather than measured and dropped.
+    """
+    global _enabled, _profile_dir, _memory
+    if memory and enabled is None and not (jsonl or prometheus):
+        raise ValueError('memory tracing needs a trace file: give --trace-jsonl or --trace-prom '
+                         '(BILLMAKER_TRACE_JSONL or BILLMAKER_TRACE_PROM)')
+    _close_sinks()
+    _sinks.clear()
+    if jsonl:
+        _sinks.append(JsonLinesSink(jsonl))
+    if prometheus:
+        _sinks.append(PrometheusSink(prometheus))
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    _profile_dir = profile_dir
+    _memory = memory
+    _enabled = bool(_sinks or profile_dir) if enabled is None else enabled
+
+
+def configure_from_env(environ=os.environ):
+    """Settings from BILLMAKER_TRACE_JSONL, BILLMAKER_TRACE_PROM, BILLMAKER_PROFILE_DIR and
+    BILLMAKER_TRACE_MEMORY=1."""
+    configure(jsonl=environ.get('BILLMAKER_TRACE_JSONL'), prometheus=environ.get('BILLMAKER_TRACE_PROM'),
+              profile_dir=environ.get('BILLMAKER_PROFILE_DIR'),
+              memory=environ.get('BILLMAKER_TRACE_MEMORY') == '1')
+
+
+def worker_settings():
+    """Settings for a worker process, whose traces are handed back to this one to write out."""
+    return {'profile_dir': _profile_dir, 'memory': _memory, 'enabled': _enabled}
+
+
+atexit.register(_close_sinks)
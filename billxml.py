@@ -0,0 +1,245 @@
+import hashlib
+import os
+import re
+import threading
+from xml.parsers import expat
+
+import billtrace
+from billtemplate import (count_render, index_paragraph, item_count, item_slot_text, placeholder_map,
+                          placeholder_pattern, slot_counts, slot_text, split_item_row, split_package,
+                          write_package)
+
+DOCUMENT_PART = 'word/document.xml'
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_P = W_NS + ' p'
+W_R = W_NS + ' r'
+W_TR = W_NS + ' tr'
+W_T = W_NS + ' t'
+W_RPR = W_NS + ' rPr'
+
+# Run children that python-docx's Run.text reports as text
+RUN_CHARS = {W_NS + ' tab': '\t', W_NS + ' cr': '\n', W_NS + ' ptab': '\t',
+             W_NS + ' noBreakHyphen': '-'}
+W_BR = W_NS + ' br'
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Characters XML 1.0 doesn't allow, which lxml refuses when the docx backend sets them
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def escape(text):
+    # What xml.sax.saxutils.escape does, without that module pulling in urllib at startup
+    if XML_INVALID.search(text):
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters')
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+class _RunScanner:
+    """Incremental expat pass over document.xml recording where each run's content lives.
+
+    Runs can nest, as in a text box or mc:AlternateContent inside a run, and
+    paragraphs inside those; each run belongs to its innermost paragraph and
+    records only its own text, as in python-docx.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.runs = []          # [pos, paragraph id, content start, content end, text parts, row id]
+        self.rows = []          # [start, end] byte range of each table row
+        self.paragraphs = []    # stack of open paragraph ids
+        self.open_rows = []     # stack of open row ids
+        self.stack = []
+        self.open_runs = []     # stack of open runs, innermost last
+        self.in_text = False
+        self.next_paragraph = 0
+
+        self.parser = expat.ParserCreate(namespace_separator=' ')
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.chars
+        self.parser.buffer_text = True
+
+    def scan(self):
+        for i in range(0, len(self.xml), CHUNK_SIZE):
+            self.parser.Parse(self.xml[i:i + CHUNK_SIZE], False)
+        self.parser.Parse(b'', True)
+        return self.runs, self.rows
+
+    def _tag_end(self):
+        return self.xml.index(b'>', self.parser.CurrentByteIndex) + 1
+
+    def start(self, name, attrs):
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(name)
+        if name == W_P:
+            self.paragraphs.append(self.next_paragraph)
+            self.next_paragraph += 1
+        elif name == W_TR:
+            self.open_rows.append(len(self.rows))
+            self.rows.append([self.parser.CurrentByteIndex, None])
+        elif name == W_R:
+            paragraph = self.paragraphs[-1] if self.paragraphs else None
+            row = self.open_rows[-1] if self.open_rows else None
+            start = self._tag_end()
+            run = [len(self.runs), paragraph, start, start, [], row]
+            self.runs.append(run)
+            self.open_runs.append(run)
+        elif self.open_runs and parent == W_R:
+            run = self.open_runs[-1]
+            if name == W_T:
+                self.in_text = True
+            elif name == W_BR:
+                kind = attrs.get(W_NS + ' type', 'textWrapping')
+                run[4].append('\n' if kind == 'textWrapping' else '')
+            elif name in RUN_CHARS:
+                run[4].append(RUN_CHARS[name])
+
+    def end(self, name):
+        self.stack.pop()
+        parent = self.stack[-1] if self.stack else None
+        if name == W_P:
+            self.paragraphs.pop()
+        elif name == W_TR:
+            self.rows[self.open_rows.pop()][1] = self._tag_end()
+        elif name == W_R:
+            self.open_runs.pop()[3] = self.parser.CurrentByteIndex
+        elif name == W_T:
+            self.in_text = False
+        elif name == W_RPR and parent == W_R and self.open_runs:
+            # Run properties stay; only what follows them is rewritten
+            self.open_runs[-1][2] = self._tag_end()
+
+    def chars(self, data):
+        if self.in_text and self.open_runs:
+            self.open_runs[-1][4].append(data)
+
+
+def run_content_xml(text):
+    """The same run children python-docx writes for Run.text = text."""
+    out = []
+    for part in text.replace('\r', '\n').split('\n'):
+        for i, piece in enumerate(part.split('\t')):
+            if i:
+                out.append('<w:tab/>')
+            if piece:
+                space = ' xml:space="preserve"' if piece != piece.strip() else ''
+                out.append(f'<w:t{space}>{escape(piece)}</w:t>')
+        out.append('<w:br/>')
+    out.pop()
+    return ''.join(out)
+
+
+def _run_xml(text):
+    return run_content_xml(text).encode('utf-8')
+
+
+def _split(xml, start, end, cuts):
+    """Literal byte chunks of xml[start:end] interleaved with the ops replacing each cut range.
+
+    A cut inside an earlier one (a run nested in a run being rewritten) is
+    dropped with the content around it, as python-docx drops it.
+    """
+    ops = []
+    cursor = start
+    for cut_start, cut_end, op in sorted(cuts, key=lambda cut: cut[0]):
+        if cut_start < cursor:
+            continue
+        ops.append(xml[cursor:cut_start])
+        if op is not None:
+            ops.append(op)
+        cursor = cut_end
+    ops.append(xml[cursor:end])
+    return ops
+
+
+class XmlTemplate:
+    """Render backend that treats the template as a zip instead of a python-docx object tree.
+
+    Every part except word/document.xml is copied through unchanged, and
+    document.xml is pre-split around the runs that hold placeholders (and
+    around the line-item row, which is repeated per item) so a render is a
+    join of byte chunks and escaped values.
+    """
+
+    def __init__(self, template_path, keys, item_fields=()):
+        self.path = template_path
+        self.keys = list(keys)
+        self.item_fields = tuple(item_fields)
+        self._lock = threading.Lock()
+        self.compile()
+
+    def compile(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Template not found: {self.path}")
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        self.digest = hashlib.sha256(raw).hexdigest()
+
+        self.prefix, self.document_info, xml = split_package(raw, DOCUMENT_PART)
+
+        runs, rows = _RunScanner(xml).scan()
+        self.matcher = placeholder_pattern(self.keys)
+        paragraphs = {}
+        for pos, paragraph, _, _, parts, _ in runs:
+            paragraphs.setdefault(paragraph, []).append((pos, ''.join(parts)))
+        slots = []
+        for group in paragraphs.values():
+            slots.extend(index_paragraph(self.matcher, group))
+        self.placeholders = placeholder_map(slots)
+        billtrace.count('paragraphs_scanned', len(paragraphs))
+        billtrace.count('runs_scanned', len(runs))
+
+        slots, self.item_row, item_slots, dropped = split_item_row(
+            slots, lambda pos: runs[pos][5], self.item_fields)
+        self.counts = slot_counts(slots, item_slots)
+
+        cuts = [(runs[pos][2], runs[pos][3], ('slot', pieces, tail)) for pos, pieces, tail in slots]
+        cuts += [(rows[row][0], rows[row][1], None) for row in dropped]
+        if self.item_row is not None:
+            row_start, row_end = rows[self.item_row]
+            row_ops = _split(xml, row_start, row_end,
+                             [(runs[pos][2], runs[pos][3], ('item', pieces, tail))
+                              for pos, pieces, tail in item_slots])
+            cuts.append((row_start, row_end, ('items', row_ops)))
+        self.ops = _split(xml, 0, len(xml), cuts)
+
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return True
+
+    def render(self, data):
+        """Return the substituted word/document.xml bytes."""
+        with billtrace.stage('substitute'):
+            xml = self._render(data)
+        count_render(self.counts, data, self.item_fields if self.item_row is not None else ())
+        return xml
+
+    def _render(self, data):
+        out = []
+        for op in self.ops:
+            if isinstance(op, bytes):
+                out.append(op)
+            elif op[0] == 'slot':
+                out.append(_run_xml(slot_text(op[1], op[2], data)))
+            else:
+                for number in range(1, item_count(data, self.item_fields) + 1):
+                    for row_op in op[1]:
+                        if isinstance(row_op, bytes):
+                            out.append(row_op)
+                        else:
+                            out.append(_run_xml(item_slot_text(row_op[1], row_op[2], data, number)))
+        return b''.join(out)
+
+    def save(self, data, stream):
+        self.write(self.render(data), stream)
+
+    def write(self, xml, stream):
+        """Package rendered document XML into a .docx on the stream."""
+        with billtrace.stage('save'):
+            write_package(self.prefix, self.document_info, xml, stream)